@@ -0,0 +1,129 @@
+"""
+Local backend.
+
+Deployments and services live only in the in-memory `ObjectStore`, and
+rollouts are simulated by the rollout controller. `KubernetesBackend`
+(app/kube.py) offers the same methods against a real cluster.
+"""
+
+from typing import Optional
+
+from app.controller import RolloutController
+from app.store import ObjectStore, check_version
+
+
+class LocalBackend:
+    """Writes go straight to the store; the controller rolls deployments out."""
+
+    def __init__(self, store: ObjectStore, controller: RolloutController):
+        self.store = store
+        self.controller = controller
+
+    async def start(self) -> None:
+        # Rollouts cut short by a restart carry on from their recovered state
+        self.controller.enqueue_many(
+            dep["id"] for dep in self.store.deployments.values() if dep["status"] != "running"
+        )
+
+    async def stop(self) -> None:
+        await self.controller.stop()
+
+    def _roll_out(self, deployment_id: str, rollouts: Optional[list[str]]) -> None:
+        if rollouts is None:
+            self.controller.enqueue(deployment_id)
+        else:
+            rollouts.append(deployment_id)  # the caller enqueues them together
+
+    async def create_deployment(self, record: dict, rollouts: Optional[list[str]] = None) -> dict:
+        """
+        Add a deployment and roll it out.
+
+        Args:
+            record: The new deployment
+            rollouts: Collects the id instead of enqueueing its rollout now
+        """
+        dep = self.store.add_deployment(record)
+        self._roll_out(dep["id"], rollouts)
+        return dep
+
+    async def update_deployment(
+        self,
+        deployment_id: str,
+        updated_at: str,
+        image: Optional[str] = None,
+        replicas: Optional[int] = None,
+        env: Optional[dict[str, str]] = None,
+        labels: Optional[dict[str, str]] = None,
+        expected_version: Optional[int] = None,
+        rollouts: Optional[list[str]] = None,
+    ) -> dict:
+        """
+        Change a deployment's spec and roll it out.
+
+        Values equal to the current spec are ignored; if nothing is left,
+        the deployment keeps its version and no rollout is scheduled.
+        As with `create_deployment`, `rollouts` collects the id instead.
+
+        Raises:
+            KeyError: No such deployment
+            ConflictError: It is no longer at `expected_version`
+        """
+        dep = self.store.deployments[deployment_id]
+        check_version(dep, expected_version)
+        changes = {}
+
+        if image and image != dep["image"]:
+            changes.update(image=image, updated_replicas=0, status="updating")
+
+        if replicas and replicas != dep["replicas"]:
+            changes["replicas"] = replicas
+            # Scaling doesn't end an image rollout that is still under way
+            changes.setdefault("status", "updating" if dep["status"] == "updating" else "scaling")
+
+        if env is not None and env != dep["env"]:
+            changes["env"] = dict(env)
+
+        if labels is not None and labels != dep["labels"]:
+            changes["labels"] = dict(labels)
+
+        if not changes:
+            return dep
+
+        if "image" in changes:
+            self.store.pods[deployment_id].revise()
+        dep = self.store.update_deployment(deployment_id, updated_at=updated_at, **changes)
+
+        if "image" in changes or "replicas" in changes:
+            # Queued once however many patches arrive; a rollout already in
+            # progress picks up the new spec on its next step
+            self._roll_out(deployment_id, rollouts)
+
+        return dep
+
+    async def delete_deployment(self, deployment_id: str) -> None:
+        # Also deletes associated services
+        self.store.remove_deployment(deployment_id)
+        self.controller.cancel(deployment_id)
+
+    async def create_service(self, record: dict) -> dict:
+        return self.store.add_service(record)
+
+    async def update_service(self, service_id: str, expected_version: Optional[int] = None, **spec) -> dict:
+        """
+        Change a service's ports, type or labels.
+
+        Raises:
+            KeyError: No such service
+            ConflictError: It is no longer at `expected_version`
+        """
+        svc = self.store.services[service_id]
+        check_version(svc, expected_version)
+        spec = {key: value for key, value in spec.items() if svc.get(key) != value}
+        if not spec:
+            return svc
+        if "type" in spec:
+            spec["external_ip"] = "192.168.1.100" if spec["type"] == "LoadBalancer" else None
+        return self.store.update_service(service_id, **spec)
+
+    async def delete_service(self, service_id: str) -> None:
+        self.store.remove_service(service_id)
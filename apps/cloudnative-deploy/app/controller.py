@@ -0,0 +1,149 @@
+"""
+Rollout controller.
+
+One loop drives every rollout: object ids go through a work queue that
+holds each id at most once, and pending rollout steps wait in a single
+heap of timers. However many deployments exist, there is one task and at
+most one scheduled step per deployment.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Callable, Iterable, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+class RolloutController:
+    """
+    Work queue plus timer heap, drained by a single asyncio task.
+
+    `step(object_id)` advances one object by one step and returns True
+    while it has more steps to take. Enqueued ids get their first step
+    `interval` seconds later; ids that already have a step scheduled are
+    left alone, since that step reads the latest spec anyway.
+    """
+
+    def __init__(
+        self,
+        step: Callable[[str], bool],
+        interval: float = 0.5,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._step = step
+        self.interval = interval
+        self._clock = clock
+        self._queue: deque[str] = deque()
+        self._queued: set[str] = set()
+        self._timers: list[tuple[float, int, str]] = []
+        self._scheduled: dict[str, int] = {}  # object id -> live timer's seq
+        self._seq = itertools.count()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def pending(self) -> int:
+        """Objects with a rollout in progress or queued."""
+        return len(self._scheduled.keys() | self._queued)
+
+    def is_active(self, object_id: str) -> bool:
+        return object_id in self._scheduled or object_id in self._queued
+
+    def enqueue(self, object_id: str) -> None:
+        """Ask for an object to be reconciled; duplicates are dropped."""
+        self.enqueue_many((object_id,))
+
+    def enqueue_many(self, object_ids: Iterable[str]) -> None:
+        for object_id in object_ids:
+            if object_id not in self._queued:
+                self._queued.add(object_id)
+                self._queue.append(object_id)
+        if self._ensure_running():
+            self._wake.set()
+
+    def cancel(self, object_id: str) -> None:
+        """Drop any queued or scheduled work for an object."""
+        # Heap and queue entries are skipped lazily once they're no longer live
+        self._scheduled.pop(object_id, None)
+        self._queued.discard(object_id)
+
+    def clear(self) -> None:
+        self._queue.clear()
+        self._queued.clear()
+        self._timers.clear()
+        self._scheduled.clear()
+
+    def run_pending(self, now: Optional[float] = None) -> Optional[float]:
+        """
+        Drain the work queue and take every step that is due.
+
+        Returns:
+            When the next step is due (clock time), or None if idle
+        """
+        now = self._clock() if now is None else now
+        while self._queue:
+            object_id = self._queue.popleft()
+            if object_id not in self._queued:
+                continue  # cancelled
+            self._queued.discard(object_id)
+            if object_id not in self._scheduled:
+                self._schedule(object_id, now + self.interval)
+
+        while self._timers and self._timers[0][0] <= now:
+            due, seq, object_id = heapq.heappop(self._timers)
+            if self._scheduled.get(object_id) != seq:
+                continue  # cancelled
+            del self._scheduled[object_id]
+            try:
+                more = self._step(object_id)
+            except Exception:
+                logger.exception("Rollout step failed for %s", object_id)
+                continue
+            if more:
+                self._schedule(object_id, now + self.interval)
+
+        # Skip over stale timers so they don't cause early wake-ups
+        while self._timers and self._scheduled.get(self._timers[0][2]) != self._timers[0][1]:
+            heapq.heappop(self._timers)
+        return self._timers[0][0] if self._timers else None
+
+    def _schedule(self, object_id: str, due: float) -> None:
+        seq = next(self._seq)
+        self._scheduled[object_id] = seq
+        heapq.heappush(self._timers, (due, seq, object_id))
+
+    def _ensure_running(self) -> bool:
+        """Start the loop task if needed; False outside an event loop (call `run_pending`)."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wake = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        return True
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            next_due = self.run_pending()
+            timeout = None if next_due is None else max(0.0, next_due - self._clock())
+            try:
+                async with asyncio.timeout(timeout):
+                    await self._wake.wait()
+            except TimeoutError:
+                pass
+
+    async def stop(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
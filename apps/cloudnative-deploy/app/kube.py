@@ -0,0 +1,584 @@
+"""
+Kubernetes backend.
+
+Reads never reach the cluster: an informer per resource type lists the
+objects once, then follows a watch from the list's resourceVersion and
+mirrors every change into the `ObjectStore` the endpoints read from.
+Writes go to the API server through one pooled async HTTP client, and
+their responses are applied to the store right away so a client reads
+its own writes without waiting for the watch.
+"""
+
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+import httpx
+
+from app.manifests import deployment_manifest, service_manifest
+from app.store import ConflictError, ObjectStore, check_version
+
+
+logger = logging.getLogger(__name__)
+
+SERVICE_ACCOUNT_DIR = "/var/run/secrets/kubernetes.io/serviceaccount"
+
+# Ties a Service back to the deployment it was created for
+DEPLOYMENT_ANNOTATION = "cloudnative-deploy/deployment-id"
+
+DEPLOYMENTS_PATH = "/apis/apps/v1/deployments"
+SERVICES_PATH = "/api/v1/services"
+
+
+class KubeError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(f"{status}: {message}")
+        self.status = status
+        self.message = message
+
+
+class KubeClient:
+    """
+    Minimal async client for the Kubernetes REST API.
+
+    One `httpx.AsyncClient` keeps up to `max_connections` connections
+    alive and shares them across every request and watch.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        token: Optional[str] = None,
+        verify: str | bool = True,
+        max_connections: int = 20,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            verify=verify,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(10.0),
+            transport=transport,
+        )
+
+    @classmethod
+    def from_env(cls) -> "KubeClient":
+        """
+        `KUBE_API_URL` / `KUBE_TOKEN` when set, otherwise the in-cluster
+        service account.
+        """
+        url = os.getenv("KUBE_API_URL")
+        token = os.getenv("KUBE_TOKEN")
+        verify: str | bool = True
+        if url is None:
+            host, port = os.environ["KUBERNETES_SERVICE_HOST"], os.environ["KUBERNETES_SERVICE_PORT"]
+            url = f"https://{host}:{port}"
+            with open(os.path.join(SERVICE_ACCOUNT_DIR, "token")) as f:
+                token = f.read().strip()
+            verify = os.path.join(SERVICE_ACCOUNT_DIR, "ca.crt")
+        return cls(url, token=token, verify=verify)
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+    async def request(self, method: str, path: str, **kwargs) -> dict:
+        """
+        Raises:
+            KubeError: The API server answered with an error status
+        """
+        response = await self._http.request(method, path, **kwargs)
+        if response.status_code >= 400:
+            raise KubeError(response.status_code, _error_message(response.content))
+        return response.json()
+
+    async def list(self, path: str) -> dict:
+        return await self.request("GET", path)
+
+    async def create(self, path: str, body: dict) -> dict:
+        return await self.request("POST", path, json=body)
+
+    async def patch(self, path: str, body: dict) -> dict:
+        return await self.request(
+            "PATCH", path, content=json.dumps(body),
+            headers={"Content-Type": "application/strategic-merge-patch+json"},
+        )
+
+    async def delete(self, path: str) -> dict:
+        return await self.request("DELETE", path)
+
+    async def watch(self, path: str, resource_version: str, timeout: float) -> AsyncIterator[dict]:
+        """
+        Watch events after `resource_version` until the server ends the
+        watch, after at most `timeout` seconds.
+        """
+        params = {
+            "watch": "1",
+            "resourceVersion": resource_version,
+            "timeoutSeconds": f"{timeout:g}",
+            "allowWatchBookmarks": "true",
+        }
+        async with self._http.stream(
+            "GET", path, params=params, timeout=httpx.Timeout(10.0, read=timeout + 10.0)
+        ) as response:
+            if response.status_code >= 400:
+                raise KubeError(response.status_code, _error_message(await response.aread()))
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+
+def _error_message(content: bytes) -> str:
+    try:
+        return json.loads(content).get("message", "")
+    except (ValueError, AttributeError):
+        return content.decode(errors="replace")
+
+
+class Informer:
+    """
+    Keeps one resource type mirrored through list + watch.
+
+    Watches resume from the last resourceVersion seen. When the server
+    no longer has that version (410 Gone), the informer lists again and
+    reports objects that disappeared meanwhile as DELETED.
+    """
+
+    def __init__(
+        self,
+        client: KubeClient,
+        path: str,
+        handler: Callable[[str, dict], None],
+        watch_timeout: float = 290.0,
+        retry_delay: float = 1.0,
+    ):
+        self.client = client
+        self.path = path
+        self.handler = handler
+        self.watch_timeout = watch_timeout
+        self.retry_delay = retry_delay
+        self.resource_version: Optional[str] = None
+        self.synced = asyncio.Event()
+        self._uids: set[str] = set()
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if self.resource_version is None:
+                    await self._relist()
+                await self._watch()
+            except asyncio.CancelledError:
+                raise
+            except KubeError as e:
+                if e.status == 410:
+                    self.resource_version = None
+                    continue
+                logger.warning("Watch on %s failed: %s", self.path, e)
+                await asyncio.sleep(self.retry_delay)
+            except httpx.HTTPError as e:
+                logger.warning("Watch on %s interrupted: %s", self.path, e)
+                await asyncio.sleep(self.retry_delay)
+
+    async def _relist(self) -> None:
+        listing = await self.client.list(self.path)
+        uids = set()
+        for obj in listing["items"]:
+            uid = obj["metadata"]["uid"]
+            uids.add(uid)
+            self.handler("MODIFIED" if uid in self._uids else "ADDED", obj)
+        for uid in self._uids - uids:
+            self.handler("DELETED", {"metadata": {"uid": uid}})
+        self._uids = uids
+        self.resource_version = listing["metadata"]["resourceVersion"]
+        self.synced.set()
+
+    async def _watch(self) -> None:
+        async for event in self.client.watch(self.path, self.resource_version, self.watch_timeout):
+            obj = event["object"]
+            if event["type"] == "ERROR":
+                raise KubeError(obj.get("code", 500), obj.get("message", ""))
+            self.resource_version = obj["metadata"]["resourceVersion"]
+            if event["type"] == "BOOKMARK":
+                continue
+            uid = obj["metadata"]["uid"]
+            if event["type"] == "DELETED":
+                self._uids.discard(uid)
+            else:
+                self._uids.add(uid)
+            self.handler(event["type"], obj)
+
+
+# === Object mapping ===
+
+def deployment_record(obj: dict) -> dict:
+    """Map a Kubernetes Deployment to the API's deployment record."""
+    meta, spec, status = obj["metadata"], obj.get("spec", {}), obj.get("status", {})
+    containers = spec.get("template", {}).get("spec", {}).get("containers", [])
+    container = containers[0] if containers else {}
+    limits = container.get("resources", {}).get("limits", {})
+    replicas = spec.get("replicas", 1)
+    ready = status.get("readyReplicas", 0)
+    updated = status.get("updatedReplicas", 0)
+
+    conditions = {c["type"]: c for c in status.get("conditions", [])}
+    if conditions.get("Progressing", {}).get("status") == "False" or "ReplicaFailure" in conditions:
+        state = "failed"
+    elif ready == updated == replicas:
+        state = "running"
+    elif ready == 0:
+        state = "pending"
+    elif updated < replicas:
+        state = "updating"
+    else:
+        state = "scaling"
+
+    return {
+        "id": meta["uid"],
+        "name": meta["name"],
+        "image": container.get("image", ""),
+        "replicas": replicas,
+        "namespace": meta.get("namespace", "default"),
+        "labels": meta.get("labels", {}),
+        "status": state,
+        "ready_replicas": ready,
+        "updated_replicas": updated,
+        "created_at": meta.get("creationTimestamp", ""),
+        "updated_at": _last_update(meta),
+        "env": {e["name"]: e.get("value", "") for e in container.get("env", [])},
+        "port": next(iter(container.get("ports", [])), {}).get("containerPort"),
+        "cpu_limit": limits.get("cpu", ""),
+        "memory_limit": limits.get("memory", ""),
+        "manifest": _manifest(obj),
+    }
+
+
+def service_record(obj: dict) -> dict:
+    """Map a Kubernetes Service to the API's service record."""
+    meta, spec = obj["metadata"], obj.get("spec", {})
+    ports = spec.get("ports") or [{}]
+    ingress = obj.get("status", {}).get("loadBalancer", {}).get("ingress") or [{}]
+    return {
+        "id": meta["uid"],
+        "name": meta["name"],
+        "deployment_id": meta.get("annotations", {}).get(DEPLOYMENT_ANNOTATION, ""),
+        "port": ports[0].get("port", 0),
+        "target_port": ports[0].get("targetPort", ports[0].get("port", 0)),
+        "type": spec.get("type", "ClusterIP"),
+        "external_ip": ingress[0].get("ip") or ingress[0].get("hostname"),
+        "created_at": meta.get("creationTimestamp", ""),
+        "namespace": meta.get("namespace", "default"),
+        "labels": meta.get("labels", {}),
+        "selector": spec.get("selector", {}),
+        "manifest": _manifest(obj),
+    }
+
+
+def _last_update(meta: dict) -> str:
+    times = [f["time"] for f in meta.get("managedFields", []) if f.get("time")]
+    return max(times, default=meta.get("creationTimestamp", ""))
+
+
+def _labels_patch(current: dict[str, str], wanted: dict[str, str]) -> dict:
+    """Merge patch turning `current` labels into `wanted` (null deletes a key)."""
+    return {**{key: None for key in current if key not in wanted}, **wanted}
+
+
+def _replace_list(items: list[dict]) -> list[dict]:
+    """
+    A strategic-merge-patch list that replaces the whole list.
+
+    Without the directive, lists such as `ports` and `env` are merged with
+    the existing items by key, so changed or removed items would linger.
+    """
+    return [{"$patch": "replace"}, *items]
+
+
+def _precondition(resource_version: Optional[str]) -> dict:
+    """Patch metadata that makes the API server answer 409 unless the object is at `resource_version`."""
+    return {} if resource_version is None else {"resourceVersion": resource_version}
+
+
+def _manifest(obj: dict) -> dict:
+    meta = obj["metadata"]
+    return {
+        "apiVersion": obj.get("apiVersion"),
+        "kind": obj.get("kind"),
+        "metadata": {
+            key: meta[key] for key in ("name", "namespace", "labels", "annotations") if key in meta
+        },
+        "spec": obj.get("spec", {}),
+    }
+
+
+# === Backend ===
+
+@dataclass
+class _QueuedPatch:
+    """Changes to one object waiting for the patch in flight to finish."""
+
+    changes: dict
+    conditional: bool = False  # sent only if the object is still at the version read
+    sent: asyncio.Event = field(default_factory=asyncio.Event)
+    error: Optional[Exception] = None
+
+
+class KubernetesBackend:
+    """
+    Same methods as `LocalBackend`, backed by a cluster.
+
+    Args:
+        store: Store the informers mirror the cluster into
+        client: Pooled API client
+        watch_timeout: Seconds before a watch is renewed
+    """
+
+    def __init__(self, store: ObjectStore, client: KubeClient, watch_timeout: float = 290.0):
+        self.store = store
+        self.client = client
+        self._versions: dict[str, str] = {}  # uid -> last applied resourceVersion
+        # Per object: the lock held while a patch is in flight, and the
+        # changes waiting to be sent after it
+        self._patching: dict[str, asyncio.Lock] = {}
+        self._queued: dict[str, _QueuedPatch] = {}
+        self.informers = [
+            Informer(client, DEPLOYMENTS_PATH, self._on_deployment, watch_timeout),
+            Informer(client, SERVICES_PATH, self._on_service, watch_timeout),
+        ]
+        self._tasks: list[asyncio.Task] = []
+
+    async def start(self, sync_timeout: float = 30.0) -> None:
+        """Start the informers and wait for their initial lists."""
+        self._tasks = [asyncio.create_task(informer.run()) for informer in self.informers]
+        await asyncio.wait_for(
+            asyncio.gather(*(informer.synced.wait() for informer in self.informers)), sync_timeout
+        )
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.client.aclose()
+
+    def _is_new(self, event_type: str, obj: dict) -> bool:
+        """False for an object version already applied (e.g. by a write)."""
+        uid = obj["metadata"]["uid"]
+        if event_type == "DELETED":
+            self._versions.pop(uid, None)
+            return True
+        version = obj["metadata"].get("resourceVersion")
+        if self._versions.get(uid) == version:
+            return False
+        self._versions[uid] = version
+        return True
+
+    def _on_deployment(self, event_type: str, obj: dict) -> None:
+        if not self._is_new(event_type, obj):
+            return
+        uid = obj["metadata"]["uid"]
+        if event_type == "DELETED":
+            dep = self.store.deployments.get(uid)
+            if dep is not None:
+                # Services outlive their deployment in the cluster
+                for svc in self.store.services_of(uid):
+                    self.store.update_service(svc["id"], deployment_id="")
+                self.store.remove_deployment(uid)
+            return
+        record = deployment_record(obj)
+        if uid in self.store.deployments:
+            self.store.update_deployment(uid, **record)
+        else:
+            self.store.add_deployment(record)
+
+    def _on_service(self, event_type: str, obj: dict) -> None:
+        if not self._is_new(event_type, obj):
+            return
+        uid = obj["metadata"]["uid"]
+        if event_type == "DELETED":
+            self.store.remove_service(uid)
+            return
+        record = service_record(obj)
+        if uid in self.store.services:
+            self.store.update_service(uid, **record)
+        else:
+            self.store.add_service(record)
+
+    @staticmethod
+    def _deployment_path(namespace: str, name: str = "") -> str:
+        path = f"/apis/apps/v1/namespaces/{namespace}/deployments"
+        return f"{path}/{name}" if name else path
+
+    @staticmethod
+    def _service_path(namespace: str, name: str = "") -> str:
+        path = f"/api/v1/namespaces/{namespace}/services"
+        return f"{path}/{name}" if name else path
+
+    async def create_deployment(self, record: dict, rollouts: Optional[list[str]] = None) -> dict:
+        """Create a deployment; the cluster rolls it out, so `rollouts` is left alone."""
+        obj = await self.client.create(self._deployment_path(record["namespace"]), deployment_manifest(record))
+        self._on_deployment("ADDED", obj)
+        return self.store.deployments[obj["metadata"]["uid"]]
+
+    async def _coalesce(
+        self,
+        objects: dict[str, dict],
+        object_id: str,
+        changes: dict,
+        expected_version: Optional[int],
+        send: Callable[[dict, Optional[str]], Awaitable[None]],
+    ) -> None:
+        """
+        Send one object's changes, one patch at a time per object.
+
+        Changes arriving while a patch is in flight are merged (later values
+        win) and go out together in the next patch, so a burst of updates
+        costs at most two requests and the cluster starts one rollout for
+        the final spec.
+
+        With `expected_version`, `send` gets the cluster resourceVersion
+        the local copy was read at, to put in the patch: the API server
+        then refuses it if another client changed the object since.
+        Conditional changes aren't merged with others.
+
+        Raises:
+            ConflictError: The object is no longer at `expected_version`,
+                locally or in the cluster, or other changes to it are
+                already queued
+        """
+        while (queued := self._queued.get(object_id)) is not None:
+            if expected_version is not None:
+                raise ConflictError("the object is being changed by another request; read it again and retry")
+            if queued.conditional:
+                await queued.sent.wait()  # its precondition isn't ours; queue up behind it
+                continue
+            queued.changes.update(changes)
+            await queued.sent.wait()
+            if queued.error is not None:
+                raise queued.error
+            return
+
+        queued = self._queued[object_id] = _QueuedPatch(dict(changes), expected_version is not None)
+        lock = self._patching.setdefault(object_id, asyncio.Lock())
+        try:
+            async with lock:
+                del self._queued[object_id]
+                check_version(objects[object_id], expected_version)
+                # Local copies only change with the cluster's, so this is the version it was read at
+                resource_version = self._versions.get(object_id) if queued.conditional else None
+                try:
+                    await send(queued.changes, resource_version)
+                except KubeError as e:
+                    if e.status != 409:
+                        raise
+                    raise ConflictError(
+                        "the object was changed in the cluster; read it again and retry"
+                    ) from e
+        except Exception as e:
+            queued.error = e
+            raise
+        finally:
+            if self._queued.get(object_id) is queued:
+                del self._queued[object_id]  # cancelled while waiting for the lock
+            if object_id not in self._queued:
+                self._patching.pop(object_id, None)
+            queued.sent.set()
+
+    async def update_deployment(
+        self,
+        deployment_id: str,
+        updated_at: str,
+        image: Optional[str] = None,
+        replicas: Optional[int] = None,
+        env: Optional[dict[str, str]] = None,
+        labels: Optional[dict[str, str]] = None,
+        expected_version: Optional[int] = None,
+        rollouts: Optional[list[str]] = None,
+    ) -> dict:
+        """
+        Patch a deployment; the cluster rolls it out, so `rollouts` is left alone.
+
+        Raises:
+            KeyError: No such deployment
+            ConflictError: It is no longer at `expected_version`
+        """
+        check_version(self.store.deployments[deployment_id], expected_version)
+        changes = {"image": image, "replicas": replicas, "env": env, "labels": labels}
+
+        async def send(changes: dict, resource_version: Optional[str]) -> None:
+            dep = self.store.deployments[deployment_id]
+            container = {"name": dep["manifest"]["spec"]["template"]["spec"]["containers"][0]["name"]}
+            if changes.get("image"):
+                container["image"] = changes["image"]
+            if changes.get("env") is not None:
+                container["env"] = _replace_list([{"name": k, "value": v} for k, v in changes["env"].items()])
+            patch: dict = {"metadata": _precondition(resource_version), "spec": {}}
+            if changes.get("replicas"):
+                patch["spec"]["replicas"] = changes["replicas"]
+            if len(container) > 1:
+                patch["spec"]["template"] = {"spec": {"containers": [container]}}
+            if changes.get("labels") is not None:
+                patch["metadata"]["labels"] = _labels_patch(dep["labels"], changes["labels"])
+
+            obj = await self.client.patch(self._deployment_path(dep["namespace"], dep["name"]), patch)
+            self._on_deployment("MODIFIED", obj)
+
+        dep = self.store.deployments[deployment_id]
+        changes = {key: value for key, value in changes.items() if value is not None and dep.get(key) != value}
+        if changes:
+            await self._coalesce(self.store.deployments, deployment_id, changes, expected_version, send)
+        return self.store.deployments[deployment_id]
+
+    async def delete_deployment(self, deployment_id: str) -> None:
+        dep = self.store.deployments[deployment_id]
+        for svc in self.store.services_of(deployment_id):
+            await self.delete_service(svc["id"])
+        await self.client.delete(self._deployment_path(dep["namespace"], dep["name"]))
+        self.store.remove_deployment(deployment_id)
+
+    async def create_service(self, record: dict) -> dict:
+        namespace = self.store.deployments[record["deployment_id"]]["namespace"]
+        manifest = service_manifest(record)
+        manifest["metadata"].setdefault("annotations", {})[DEPLOYMENT_ANNOTATION] = record["deployment_id"]
+        obj = await self.client.create(self._service_path(namespace), manifest)
+        self._on_service("ADDED", obj)
+        return self.store.services[obj["metadata"]["uid"]]
+
+    async def update_service(self, service_id: str, expected_version: Optional[int] = None, **spec) -> dict:
+        """
+        Patch a service's ports, type or labels.
+
+        Raises:
+            KeyError: No such service
+            ConflictError: It is no longer at `expected_version`
+        """
+        check_version(self.store.services[service_id], expected_version)
+
+        async def send(spec: dict, resource_version: Optional[str]) -> None:
+            svc = self.store.services[service_id]
+            patch: dict = {"metadata": _precondition(resource_version), "spec": {}}
+            if "type" in spec:
+                patch["spec"]["type"] = spec["type"]
+            if "port" in spec or "target_port" in spec:
+                patch["spec"]["ports"] = _replace_list([{
+                    "port": spec.get("port", svc["port"]),
+                    "targetPort": spec.get("target_port", svc["target_port"]),
+                }])
+            if "labels" in spec:
+                patch["metadata"]["labels"] = _labels_patch(svc["labels"], spec["labels"])
+            obj = await self.client.patch(self._service_path(svc["namespace"], svc["name"]), patch)
+            self._on_service("MODIFIED", obj)
+
+        svc = self.store.services[service_id]
+        spec = {key: value for key, value in spec.items() if svc.get(key) != value}
+        if spec:
+            await self._coalesce(self.store.services, service_id, spec, expected_version, send)
+        return self.store.services[service_id]
+
+    async def delete_service(self, service_id: str) -> None:
+        svc = self.store.services[service_id]
+        await self.client.delete(self._service_path(svc["namespace"], svc["name"]))
+        self.store.remove_service(service_id)
@@ -0,0 +1,162 @@
+"""
+List requests.
+
+Parses Kubernetes-style label and field selectors, encodes the opaque
+`continue` tokens used for pagination, and serializes list pages from
+per-object JSON fragments that are cached until the object changes.
+"""
+
+import base64
+import binascii
+import json
+import re
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+from pydantic import BaseModel
+
+
+@dataclass(frozen=True)
+class Requirement:
+    """
+    One term of a selector.
+
+    `op` is one of "=", "!=", "in", "notin", "exists" and "!exists";
+    `values` is empty for the existence operators.
+    """
+
+    key: str
+    op: str
+    values: frozenset[str] = frozenset()
+
+
+_SET_TERM = re.compile(r"^(!?)\s*([^\s=!(),]+)\s*(?:(in|notin)\s*\(([^()]*)\))?$")
+_EQUALITY_TERM = re.compile(r"^([^\s=!(),]+)\s*(==|=|!=)\s*([^\s=!(),]*)$")
+
+
+def _terms(selector: str) -> list[str]:
+    """Split a selector on the commas outside parentheses."""
+    terms, depth, start = [], 0, 0
+    for i, char in enumerate(selector):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and depth == 0:
+            terms.append(selector[start:i])
+            start = i + 1
+    terms.append(selector[start:])
+    return [term.strip() for term in terms if term.strip()]
+
+
+def parse_label_selector(selector: Optional[str]) -> list[Requirement]:
+    """
+    Parse a label selector such as ``tier=web,env in (prod,staging),!canary``.
+
+    Raises:
+        ValueError: Malformed selector
+    """
+    requirements = []
+    for term in _terms(selector or ""):
+        match = _EQUALITY_TERM.match(term)
+        if match:
+            key, op, value = match.groups()
+            requirements.append(Requirement(key, "!=" if op == "!=" else "=", frozenset([value])))
+            continue
+        match = _SET_TERM.match(term)
+        if match is None or (match[1] and match[3]):
+            raise ValueError(f"invalid label selector term {term!r}")
+        negated, key, op, values = match.groups()
+        if op:
+            requirements.append(Requirement(key, op, frozenset(v.strip() for v in values.split(","))))
+        else:
+            requirements.append(Requirement(key, "!exists" if negated else "exists"))
+    return requirements
+
+
+def parse_field_selector(selector: Optional[str], fields: Iterable[str]) -> list[Requirement]:
+    """
+    Parse a field selector such as ``metadata.namespace=prod,status.phase!=failed``.
+
+    Args:
+        selector: Selector string
+        fields: Field names the selector may use
+
+    Raises:
+        ValueError: Malformed selector or unsupported field
+    """
+    fields = set(fields)
+    requirements = []
+    for term in _terms(selector or ""):
+        match = _EQUALITY_TERM.match(term)
+        if match is None:
+            raise ValueError(f"invalid field selector term {term!r}")
+        key, op, value = match.groups()
+        if key not in fields:
+            raise ValueError(f"field {key!r} is not supported; use one of {', '.join(sorted(fields))}")
+        requirements.append(Requirement(key, "!=" if op == "!=" else "=", frozenset([value])))
+    return requirements
+
+
+# === Continue tokens ===
+
+def encode_continue(resource_version: int, last_key: tuple[str, ...]) -> str:
+    """Token for the page that follows `last_key` in a listing at `resource_version`."""
+    raw = json.dumps({"rv": resource_version, "start": list(last_key)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_continue(token: str) -> tuple[int, tuple[str, ...]]:
+    """
+    Resource version and last key of a continue token.
+
+    Raises:
+        ValueError: Not a token issued by `encode_continue`
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        resource_version, start = data["rv"], data["start"]
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError):
+        raise ValueError("invalid continue token") from None
+    valid = isinstance(resource_version, int) and isinstance(start, list)
+    if not valid or not all(isinstance(part, str) for part in start):
+        raise ValueError("invalid continue token")
+    return resource_version, tuple(start)
+
+
+# === Serialization ===
+
+class FragmentCache:
+    """
+    JSON encodings of records as a response model, one per object.
+
+    A record is projected onto the model's fields and encoded once per
+    resource version, so a page is serialized by joining cached bytes
+    instead of validating every object through the model.
+    """
+
+    def __init__(self, model: type[BaseModel]):
+        self.fields = {
+            name: field.get_default(call_default_factory=True)
+            for name, field in model.model_fields.items()
+        }
+        self._fragments: dict[str, tuple[int, bytes]] = {}  # object id -> (resource version, JSON)
+
+    def fragment(self, obj: dict) -> bytes:
+        version = obj.get("resource_version", 0)
+        cached = self._fragments.get(obj["id"])
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        data = {name: obj.get(name, default) for name, default in self.fields.items()}
+        encoded = json.dumps(data, separators=(",", ":")).encode()
+        self._fragments[obj["id"]] = (version, encoded)
+        return encoded
+
+    def encode(self, objects: Iterable[dict]) -> bytes:
+        return b"[" + b",".join(self.fragment(obj) for obj in objects) + b"]"
+
+    def discard(self, object_id: str) -> None:
+        self._fragments.pop(object_id, None)
+
+    def clear(self) -> None:
+        self._fragments.clear()
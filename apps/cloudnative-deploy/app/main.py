@@ -5,13 +5,49 @@ A FastAPI application for managing Kubernetes deployments,
 services, and infrastructure as code.
 """
 
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import Optional, Literal
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing import Annotated, Optional, Literal, Union
+from contextlib import asynccontextmanager
 from datetime import datetime
+import json
+import os
+import time
 import uuid
-import asyncio
+
+import yaml
+
+from app.backend import LocalBackend
+from app.controller import RolloutController
+from app.kube import KubeClient, KubeError, KubernetesBackend
+from app.listing import (
+    FragmentCache,
+    Requirement,
+    decode_continue,
+    encode_continue,
+    parse_field_selector,
+    parse_label_selector,
+)
+from app.manifests import MEDIA_TYPES, ManifestCache, etag_matches
+from app.persistence import LogWriteError, StateLog
+from app.store import SELECTABLE_FIELDS, ConflictError, ObjectStore, list_key
+from app.watch import ExpiredError, WatchHub, sse_message
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if state_log is not None:
+        state_log.recover()
+        watch_hub.resource_version = store.resource_version
+        state_log.start()
+    await backend.start()
+    yield
+    await backend.stop()
+    if state_log is not None:
+        await state_log.close()
+
 
 app = FastAPI(
     title="CloudNative Deploy",
@@ -26,6 +62,7 @@ Manage Kubernetes deployments, services, and infrastructure with ease.
 - 📦 **Pods**: Monitor pod status and health
 - 🌐 **Namespaces**: Organize workloads across namespaces
 - 📊 **Cluster Info**: View cluster-wide metrics and status
+- 👀 **Watch**: Stream changes with `?watch=true` instead of polling
 
 ### Getting Started
 1. Create a deployment via `POST /api/deployments`
@@ -35,10 +72,12 @@ Manage Kubernetes deployments, services, and infrastructure with ease.
     version="0.1.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
     openapi_tags=[
         {"name": "Health", "description": "API health check"},
         {"name": "Deployments", "description": "Kubernetes deployment management"},
         {"name": "Services", "description": "Kubernetes service management"},
+        {"name": "Apply", "description": "Bulk create-or-update"},
         {"name": "Namespaces", "description": "Namespace operations"},
         {"name": "Cluster", "description": "Cluster-wide information"},
     ],
@@ -59,6 +98,7 @@ class DeploymentCreate(BaseModel):
     image: str
     replicas: int = Field(default=1, ge=1, le=100)
     namespace: str = "default"
+    labels: dict[str, str] = Field(default_factory=dict)
     env: dict[str, str] = Field(default_factory=dict)
     port: Optional[int] = None
     cpu_limit: str = "500m"
@@ -71,8 +111,11 @@ class Deployment(BaseModel):
     image: str
     replicas: int
     namespace: str
+    labels: dict[str, str] = Field(default_factory=dict)
     status: Literal["pending", "running", "failed", "scaling", "updating"]
     ready_replicas: int = 0
+    updated_replicas: int = 0
+    resource_version: int = 0
     created_at: str
     updated_at: str
 
@@ -81,6 +124,7 @@ class DeploymentUpdate(BaseModel):
     image: Optional[str] = None
     replicas: Optional[int] = Field(default=None, ge=1, le=100)
     env: Optional[dict[str, str]] = None
+    resource_version: Optional[int] = None  # apply only if the deployment is still at this version
 
 
 class ServiceCreate(BaseModel):
@@ -89,109 +133,250 @@ class ServiceCreate(BaseModel):
     port: int
     target_port: int
     type: Literal["ClusterIP", "NodePort", "LoadBalancer"] = "ClusterIP"
+    labels: dict[str, str] = Field(default_factory=dict)
 
 
 class Service(BaseModel):
     id: str
     name: str
     deployment_id: str
+    namespace: str = "default"
+    labels: dict[str, str] = Field(default_factory=dict)
     port: int
     target_port: int
     type: str
     external_ip: Optional[str] = None
+    resource_version: int = 0
     created_at: str
 
 
+class ServiceUpdate(BaseModel):
+    port: Optional[int] = None
+    target_port: Optional[int] = None
+    type: Optional[Literal["ClusterIP", "NodePort", "LoadBalancer"]] = None
+    labels: Optional[dict[str, str]] = None
+    resource_version: Optional[int] = None  # apply only if the service is still at this version
+
+
+class DeploymentApply(DeploymentCreate):
+    kind: Literal["Deployment"]
+
+
+class ServiceApply(BaseModel):
+    kind: Literal["Service"]
+    name: str
+    deployment: str  # name of a deployment in the same namespace
+    namespace: str = "default"
+    port: int
+    target_port: int
+    type: Literal["ClusterIP", "NodePort", "LoadBalancer"] = "ClusterIP"
+    labels: dict[str, str] = Field(default_factory=dict)
+
+
+ApplyItem = Annotated[Union[DeploymentApply, ServiceApply], Field(discriminator="kind")]
+apply_item_adapter = TypeAdapter(ApplyItem)
+
+MAX_APPLY_ITEMS = 5000
+
+
 class PodStatus(BaseModel):
     name: str
     status: str
     ready: bool
     restarts: int
     age: str
+    started_at: str
+    revision: int
 
 
 # === In-Memory Storage (would use K8s API in production) ===
 
-deployments: dict[str, dict] = {}
-services: dict[str, dict] = {}
+store = ObjectStore()
+deployments = store.deployments  # read-only views; writes go through `store`
+services = store.services
 
+# Every store change is published once to all watchers
+watch_hub = WatchHub(history=1024, queue_size=256)
 
-# === Kubernetes Manifest Generators ===
 
-def generate_deployment_manifest(dep: DeploymentCreate) -> dict:
-    """Generate Kubernetes Deployment manifest."""
-    return {
-        "apiVersion": "apps/v1",
-        "kind": "Deployment",
-        "metadata": {
-            "name": dep.name,
-            "namespace": dep.namespace,
-            "labels": {"app": dep.name},
-        },
-        "spec": {
-            "replicas": dep.replicas,
-            "selector": {"matchLabels": {"app": dep.name}},
-            "template": {
-                "metadata": {"labels": {"app": dep.name}},
-                "spec": {
-                    "containers": [
-                        {
-                            "name": dep.name,
-                            "image": dep.image,
-                            "ports": [{"containerPort": dep.port}] if dep.port else [],
-                            "env": [
-                                {"name": k, "value": v}
-                                for k, v in dep.env.items()
-                            ],
-                            "resources": {
-                                "limits": {
-                                    "cpu": dep.cpu_limit,
-                                    "memory": dep.memory_limit,
-                                },
-                            },
-                        }
-                    ]
-                },
-            },
-        },
-    }
+def public_view(obj: dict) -> dict:
+    """An object as the API returns it (without its manifest)."""
+    return {k: v for k, v in obj.items() if k != "manifest"}
 
 
-def generate_service_manifest(svc: ServiceCreate, deployment_name: str) -> dict:
-    """Generate Kubernetes Service manifest."""
-    return {
-        "apiVersion": "v1",
-        "kind": "Service",
-        "metadata": {"name": svc.name},
-        "spec": {
-            "type": svc.type,
-            "selector": {"app": deployment_name},
-            "ports": [
-                {
-                    "port": svc.port,
-                    "targetPort": svc.target_port,
-                }
-            ],
-        },
-    }
+store.listeners.append(
+    lambda event_type, kind, obj, rv: watch_hub.publish(event_type, kind, public_view(obj), rv)
+)
+
+# Serialized manifests, valid for one resource version of their object
+manifest_cache = ManifestCache(max_entries=10_000)
+
+
+# List pages are joined from cached per-object JSON
+deployment_fragments = FragmentCache(Deployment)
+service_fragments = FragmentCache(Service)
+
+
+def forget_serialized(event_type: str, kind: str, obj: dict, rv: int) -> None:
+    if event_type == "DELETED":
+        manifest_cache.discard(obj["id"])
+        (deployment_fragments if kind == "Deployment" else service_fragments).discard(obj["id"])
+
+
+store.listeners.append(forget_serialized)
+
+
+def list_response(
+    kind: str,
+    namespace: Optional[str],
+    label_selector: Optional[str],
+    field_selector: Optional[str],
+    limit: Optional[int],
+    continue_token: Optional[str],
+) -> Response:
+    """
+    One page of a listing, in creation order.
+    
+    Selectors are evaluated against the store's indexes. When more objects
+    match than `limit`, the `X-Continue` header holds the token for the
+    next page and `X-Remaining-Item-Count` how many objects are left.
+    Later pages show objects as they are when the page is read.
+    
+    Raises:
+        HTTPException: 400 for a malformed selector or continue token
+    """
+    try:
+        labels = parse_label_selector(label_selector)
+        fields = parse_field_selector(field_selector, SELECTABLE_FIELDS[kind])
+        version, after = decode_continue(continue_token) if continue_token else (store.resource_version, None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if namespace:
+        fields.append(Requirement("metadata.namespace", "=", frozenset([namespace])))
+    
+    items, remaining = store.page(kind, store.select(kind, labels, fields), after, limit)
+    
+    headers = {"X-Resource-Version": str(version)}
+    if remaining:
+        headers["X-Continue"] = encode_continue(version, list_key(items[-1]))
+        headers["X-Remaining-Item-Count"] = str(remaining)
+    fragments = deployment_fragments if kind == "Deployment" else service_fragments
+    return Response(fragments.encode(items), media_type="application/json", headers=headers)
+
+
+def watch_response(
+    kind: str,
+    current: list[dict],
+    resource_version: Optional[int],
+    timeout_seconds: Optional[int],
+    object_id: Optional[str] = None,
+    namespace: Optional[str] = None,
+) -> StreamingResponse:
+    """
+    Stream changes as server-sent events.
+    
+    Without a resource version, the current objects are sent first as
+    ADDED events, followed by a BOOKMARK carrying the version to resume
+    from. Each change event's SSE id is its resource version, so browsers
+    resume automatically via Last-Event-ID.
+    
+    Raises:
+        HTTPException: 410 if `resource_version` is no longer buffered
+    """
+    try:
+        watcher = watch_hub.subscribe(kind, resource_version, object_id, namespace)
+    except ExpiredError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    
+    initial = []
+    if resource_version is None:
+        initial = [
+            sse_message("ADDED", json.dumps({"type": "ADDED", "object": public_view(obj)}))
+            for obj in current
+        ]
+        bookmark = {"type": "BOOKMARK", "object": {"resource_version": watcher.resource_version}}
+        initial.append(sse_message("BOOKMARK", json.dumps(bookmark), watcher.resource_version))
+    
+    return StreamingResponse(
+        watch_hub.stream(watcher, initial, timeout=timeout_seconds),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # === Simulated K8s Operations ===
 
-async def simulate_deployment_rollout(deployment_id: str):
-    """Simulate deployment rollout progress."""
-    if deployment_id not in deployments:
-        return
+def rollout_step(deployment_id: str) -> bool:
+    """
+    Simulate one pod transition of a deployment's rollout.
     
-    dep = deployments[deployment_id]
-    total_replicas = dep["replicas"]
+    Pods started by the previous step come up first. Then extra pods are
+    stopped (outdated ones before current ones), pods still running an old
+    revision are replaced one at a time, and missing pods are started.
+    
+    Returns:
+        True while the deployment hasn't converged on its spec
+    """
+    dep = deployments.get(deployment_id)
+    if dep is None:
+        return False
     
-    for i in range(total_replicas + 1):
-        await asyncio.sleep(0.5)  # Simulate pod startup
-        if deployment_id in deployments:
-            deployments[deployment_id]["ready_replicas"] = i
-            if i == total_replicas:
-                deployments[deployment_id]["status"] = "running"
+    pods, replicas, now = store.pods[deployment_id], dep["replicas"], time.time()
+    pods.mark_ready()
+    outdated = pods.outdated()
+    if len(pods) > replicas:
+        pods.remove(len(pods) - 1 if outdated is None else outdated)
+    elif outdated is not None:
+        pods.remove(outdated)
+        pods.add(now)
+    elif len(pods) < replicas:
+        pods.add(now)
+    
+    ready, updated = pods.ready, pods.updated
+    done = ready == updated == len(pods) == replicas
+    store.update_deployment(
+        deployment_id,
+        ready_replicas=ready,
+        updated_replicas=updated,
+        status="running" if done else dep["status"],
+    )
+    return not done
+
+
+# One loop advances every rollout, one pod per deployment every 0.5s
+controller = RolloutController(rollout_step, interval=0.5)
+
+# CLOUDNATIVE_BACKEND=kubernetes mirrors a real cluster into `store` instead
+if os.getenv("CLOUDNATIVE_BACKEND") == "kubernetes":
+    backend = KubernetesBackend(store, KubeClient.from_env())
+else:
+    backend = LocalBackend(store, controller)
+
+# CLOUDNATIVE_STATE_DIR keeps local objects and rollouts across restarts
+state_dir = os.getenv("CLOUDNATIVE_STATE_DIR")
+state_log = StateLog(state_dir, store) if state_dir and isinstance(backend, LocalBackend) else None
+
+
+async def commit() -> None:
+    """Wait until the changes made so far are durable (when persisting)."""
+    if state_log is not None:
+        await state_log.commit()
+
+
+@app.exception_handler(KubeError)
+async def kube_error_handler(request, exc: KubeError):
+    return JSONResponse(status_code=exc.status, content={"detail": exc.message})
+
+
+@app.exception_handler(ConflictError)
+async def conflict_error_handler(request, exc: ConflictError):
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+
+@app.exception_handler(LogWriteError)
+async def log_write_error_handler(request, exc: LogWriteError):
+    # The change was made in memory but can't be made durable
+    return JSONResponse(status_code=503, content={"detail": f"State could not be saved: {exc}"})
 
 
 # === API Endpoints ===
@@ -209,79 +394,101 @@ async def health():
 # Deployments
 
 @app.post("/api/deployments", response_model=Deployment, status_code=201, tags=["Deployments"])
-async def create_deployment(
-    dep: DeploymentCreate,
-    background_tasks: BackgroundTasks
-):
+async def create_deployment(dep: DeploymentCreate):
     """Create a new Kubernetes deployment."""
-    dep_id = str(uuid.uuid4())
+    created = await backend.create_deployment(new_deployment_record(dep))
+    await commit()
+    return created
+
+
+def new_deployment_record(dep: DeploymentCreate) -> dict:
     now = datetime.utcnow().isoformat()
-    
-    deployment = {
-        "id": dep_id,
+    return {
+        "id": str(uuid.uuid4()),
         "name": dep.name,
         "image": dep.image,
         "replicas": dep.replicas,
         "namespace": dep.namespace,
+        "labels": {"app": dep.name, **dep.labels},
         "status": "pending",
         "ready_replicas": 0,
+        "updated_replicas": 0,
         "created_at": now,
         "updated_at": now,
-        "manifest": generate_deployment_manifest(dep),
+        "env": dict(dep.env),
+        "port": dep.port,
+        "cpu_limit": dep.cpu_limit,
+        "memory_limit": dep.memory_limit,
     }
-    
-    deployments[dep_id] = deployment
-    background_tasks.add_task(simulate_deployment_rollout, dep_id)
-    
-    return deployment
 
 
 @app.get("/api/deployments", response_model=list[Deployment], tags=["Deployments"])
-async def list_deployments(namespace: Optional[str] = None):
-    """List all deployments."""
-    result = list(deployments.values())
-    if namespace:
-        result = [d for d in result if d["namespace"] == namespace]
-    return result
+async def list_deployments(
+    namespace: Optional[str] = None,
+    label_selector: Optional[str] = Query(default=None, alias="labelSelector"),
+    field_selector: Optional[str] = Query(default=None, alias="fieldSelector"),
+    limit: Optional[int] = Query(default=None, ge=1),
+    continue_token: Optional[str] = Query(default=None, alias="continue"),
+    watch: bool = False,
+    resource_version: Optional[int] = Query(default=None, alias="resourceVersion"),
+    timeout_seconds: Optional[int] = Query(default=None, alias="timeoutSeconds", ge=1),
+    last_event_id: Optional[int] = Header(default=None),
+):
+    """
+    List deployments, or with `watch=true` stream changes to them.
+    
+    Supports `labelSelector`, `fieldSelector` (metadata.name,
+    metadata.namespace, status.phase) and `limit`/`continue` paging.
+    """
+    if watch:
+        if label_selector or field_selector:
+            raise HTTPException(status_code=400, detail="Selectors are not supported with watch")
+        since = resource_version if resource_version is not None else last_event_id
+        result = store.list_deployments(namespace or None)
+        return watch_response("Deployment", result, since, timeout_seconds, namespace=namespace or None)
+    return list_response("Deployment", namespace, label_selector, field_selector, limit, continue_token)
 
 
 @app.get("/api/deployments/{deployment_id}", response_model=Deployment, tags=["Deployments"])
-async def get_deployment(deployment_id: str):
-    """Get deployment details."""
+async def get_deployment(
+    deployment_id: str,
+    watch: bool = False,
+    resource_version: Optional[int] = Query(default=None, alias="resourceVersion"),
+    timeout_seconds: Optional[int] = Query(default=None, alias="timeoutSeconds", ge=1),
+    last_event_id: Optional[int] = Header(default=None),
+):
+    """Get deployment details, or with `watch=true` stream its changes."""
     if deployment_id not in deployments:
         raise HTTPException(status_code=404, detail="Deployment not found")
+    if watch:
+        since = resource_version if resource_version is not None else last_event_id
+        return watch_response(
+            "Deployment", [deployments[deployment_id]], since, timeout_seconds, object_id=deployment_id
+        )
     return deployments[deployment_id]
 
 
 @app.patch("/api/deployments/{deployment_id}", response_model=Deployment, tags=["Deployments"])
-async def update_deployment(
-    deployment_id: str,
-    update: DeploymentUpdate,
-    background_tasks: BackgroundTasks
-):
-    """Update a deployment (rolling update)."""
+async def update_deployment(deployment_id: str, update: DeploymentUpdate):
+    """
+    Update a deployment (rolling update).
+    
+    With `resource_version` set, the update is only applied if the
+    deployment is still at that version, and fails with 409 otherwise.
+    """
     if deployment_id not in deployments:
         raise HTTPException(status_code=404, detail="Deployment not found")
     
-    dep = deployments[deployment_id]
-    dep["updated_at"] = datetime.utcnow().isoformat()
-    
-    if update.image:
-        dep["image"] = update.image
-        dep["status"] = "updating"
-        background_tasks.add_task(simulate_deployment_rollout, deployment_id)
-    
-    if update.replicas:
-        dep["replicas"] = update.replicas
-        dep["status"] = "scaling"
-        background_tasks.add_task(simulate_deployment_rollout, deployment_id)
-    
-    if update.env:
-        dep["manifest"]["spec"]["template"]["spec"]["containers"][0]["env"] = [
-            {"name": k, "value": v} for k, v in update.env.items()
-        ]
-    
-    return dep
+    updated = await backend.update_deployment(
+        deployment_id,
+        updated_at=datetime.utcnow().isoformat(),
+        image=update.image,
+        replicas=update.replicas,
+        env=update.env,
+        expected_version=update.resource_version,
+    )
+    await commit()
+    return updated
 
 
 @app.delete("/api/deployments/{deployment_id}", tags=["Deployments"])
@@ -290,12 +497,9 @@ async def delete_deployment(deployment_id: str):
     if deployment_id not in deployments:
         raise HTTPException(status_code=404, detail="Deployment not found")
     
-    del deployments[deployment_id]
-    
-    # Also delete associated services
-    to_delete = [sid for sid, s in services.items() if s["deployment_id"] == deployment_id]
-    for sid in to_delete:
-        del services[sid]
+    # Also deletes associated services
+    await backend.delete_deployment(deployment_id)
+    await commit()
     
     return {"message": "Deployment deleted"}
 
@@ -307,27 +511,44 @@ async def get_deployment_pods(deployment_id: str):
         raise HTTPException(status_code=404, detail="Deployment not found")
     
     dep = deployments[deployment_id]
-    pods = []
-    
-    for i in range(dep["ready_replicas"]):
-        pods.append(PodStatus(
-            name=f"{dep['name']}-{uuid.uuid4().hex[:8]}",
-            status="Running" if i < dep["ready_replicas"] else "Pending",
-            ready=i < dep["ready_replicas"],
-            restarts=0,
-            age="2m",
-        ))
-    
-    return pods
+    return JSONResponse(store.pods[deployment_id].rows(dep["name"], time.time()))
 
 
 @app.get("/api/deployments/{deployment_id}/manifest", tags=["Deployments"])
-async def get_deployment_manifest(deployment_id: str):
-    """Get the Kubernetes manifest for a deployment."""
+async def get_deployment_manifest(
+    deployment_id: str,
+    format: Optional[Literal["json", "yaml"]] = None,
+    accept: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+):
+    """Get the Kubernetes manifest for a deployment, as JSON or YAML."""
     if deployment_id not in deployments:
         raise HTTPException(status_code=404, detail="Deployment not found")
     
-    return deployments[deployment_id]["manifest"]
+    return manifest_response(deployments[deployment_id], "Deployment", format, accept, if_none_match)
+
+
+def manifest_response(
+    obj: dict,
+    kind: str,
+    format: Optional[str],
+    accept: Optional[str],
+    if_none_match: Optional[str],
+) -> Response:
+    """
+    Serve an object's cached manifest with its ETag.
+    
+    The format comes from `format`, else from the Accept header, else JSON.
+    A matching If-None-Match gets an empty 304.
+    """
+    if format is None:
+        format = "yaml" if accept and "yaml" in accept else "json"
+    
+    body, etag = manifest_cache.get(obj, kind, format)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept"}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type=MEDIA_TYPES[format], headers=headers)
 
 
 # Services
@@ -338,11 +559,15 @@ async def create_service(svc: ServiceCreate):
     if svc.deployment_id not in deployments:
         raise HTTPException(status_code=400, detail="Deployment not found")
     
-    svc_id = str(uuid.uuid4())
     dep = deployments[svc.deployment_id]
-    
-    service = {
-        "id": svc_id,
+    created = await backend.create_service(new_service_record(svc, dep))
+    await commit()
+    return created
+
+
+def new_service_record(svc: ServiceCreate, dep: dict) -> dict:
+    return {
+        "id": str(uuid.uuid4()),
         "name": svc.name,
         "deployment_id": svc.deployment_id,
         "port": svc.port,
@@ -350,17 +575,69 @@ async def create_service(svc: ServiceCreate):
         "type": svc.type,
         "external_ip": "192.168.1.100" if svc.type == "LoadBalancer" else None,
         "created_at": datetime.utcnow().isoformat(),
-        "manifest": generate_service_manifest(svc, dep["name"]),
+        "namespace": dep["namespace"],
+        "labels": dict(svc.labels),
+        "selector": {"app": dep["name"]},
     }
-    
-    services[svc_id] = service
-    return service
 
 
 @app.get("/api/services", response_model=list[Service], tags=["Services"])
-async def list_services():
-    """List all services."""
-    return list(services.values())
+async def list_services(
+    namespace: Optional[str] = None,
+    label_selector: Optional[str] = Query(default=None, alias="labelSelector"),
+    field_selector: Optional[str] = Query(default=None, alias="fieldSelector"),
+    limit: Optional[int] = Query(default=None, ge=1),
+    continue_token: Optional[str] = Query(default=None, alias="continue"),
+    watch: bool = False,
+    resource_version: Optional[int] = Query(default=None, alias="resourceVersion"),
+    timeout_seconds: Optional[int] = Query(default=None, alias="timeoutSeconds", ge=1),
+    last_event_id: Optional[int] = Header(default=None),
+):
+    """
+    List services, or with `watch=true` stream changes to them.
+    
+    Supports `labelSelector`, `fieldSelector` (metadata.name,
+    metadata.namespace, spec.type, spec.deploymentId) and
+    `limit`/`continue` paging.
+    """
+    if watch:
+        if label_selector or field_selector:
+            raise HTTPException(status_code=400, detail="Selectors are not supported with watch")
+        since = resource_version if resource_version is not None else last_event_id
+        result = store.list_services(namespace or None)
+        return watch_response("Service", result, since, timeout_seconds, namespace=namespace or None)
+    return list_response("Service", namespace, label_selector, field_selector, limit, continue_token)
+
+
+@app.get("/api/services/{service_id}/manifest", tags=["Services"])
+async def get_service_manifest(
+    service_id: str,
+    format: Optional[Literal["json", "yaml"]] = None,
+    accept: Optional[str] = Header(default=None),
+    if_none_match: Optional[str] = Header(default=None),
+):
+    """Get the Kubernetes manifest for a service, as JSON or YAML."""
+    if service_id not in services:
+        raise HTTPException(status_code=404, detail="Service not found")
+    
+    return manifest_response(services[service_id], "Service", format, accept, if_none_match)
+
+
+@app.patch("/api/services/{service_id}", response_model=Service, tags=["Services"])
+async def update_service(service_id: str, update: ServiceUpdate):
+    """
+    Update a service's ports, type or labels.
+    
+    With `resource_version` set, the update is only applied if the
+    service is still at that version, and fails with 409 otherwise.
+    """
+    if service_id not in services:
+        raise HTTPException(status_code=404, detail="Service not found")
+    
+    spec = update.model_dump(exclude_unset=True, exclude={"resource_version"})
+    updated = await backend.update_service(service_id, expected_version=update.resource_version, **spec)
+    await commit()
+    return updated
 
 
 @app.delete("/api/services/{service_id}", tags=["Services"])
@@ -369,10 +646,265 @@ async def delete_service(service_id: str):
     if service_id not in services:
         raise HTTPException(status_code=404, detail="Service not found")
     
-    del services[service_id]
+    await backend.delete_service(service_id)
+    await commit()
     return {"message": "Service deleted"}
 
 
+# Bulk apply
+
+def parse_apply_body(body: bytes, content_type: str) -> list:
+    """
+    Raw items of an apply request: a YAML stream, a JSON list, or a JSON
+    object with an ``items`` list.
+    
+    Raises:
+        HTTPException: 400 if the body can't be parsed
+    """
+    try:
+        if "yaml" in content_type:
+            items = [doc for doc in yaml.safe_load_all(body) if doc is not None]
+        else:
+            items = json.loads(body)
+    except (yaml.YAMLError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid request body: {e}")
+    if isinstance(items, dict):
+        items = items.get("items")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Expected a list of items")
+    if len(items) > MAX_APPLY_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_APPLY_ITEMS} items per request")
+    return items
+
+
+def validate_apply_items(raw_items: list) -> tuple[list, dict[int, str]]:
+    """
+    Validate a whole batch in one pass.
+    
+    Besides each item's schema, checks that no object appears twice and
+    that every service's deployment exists or is part of the batch.
+    
+    Returns:
+        (items, errors by item index); invalid items are None in `items`
+    """
+    items: list = []
+    errors: dict[int, str] = {}
+    seen: set[tuple[str, str, str]] = set()
+    for i, raw in enumerate(raw_items):
+        try:
+            item = apply_item_adapter.validate_python(raw)
+        except ValidationError as e:
+            items.append(None)
+            errors[i] = "; ".join(
+                f"{'.'.join(map(str, err['loc'])) or 'item'}: {err['msg']}" for err in e.errors()
+            )
+            continue
+        key = (item.kind, item.namespace, item.name)
+        if key in seen:
+            items.append(None)
+            errors[i] = f"Duplicate {item.kind} {item.namespace}/{item.name}"
+            continue
+        seen.add(key)
+        items.append(item)
+    
+    for i, item in enumerate(items):
+        if isinstance(item, ServiceApply) and ("Deployment", item.namespace, item.deployment) not in seen \
+                and store.find_deployment(item.namespace, item.deployment) is None:
+            items[i] = None
+            errors[i] = f"Deployment {item.namespace}/{item.deployment} not found"
+    return items, errors
+
+
+# Spec fields apply compares and sets, per kind
+APPLY_FIELDS = {
+    "Deployment": ("image", "replicas", "env", "labels"),
+    "Service": ("port", "target_port", "type", "labels"),
+}
+
+
+def undo_info(kind: str, obj: dict, previous: Optional[dict] = None) -> dict:
+    """What `undo_apply` needs: the object, the spec this apply left it with, and the spec before."""
+    undo = {"kind": kind, "id": obj["id"], "applied": {key: obj[key] for key in APPLY_FIELDS[kind]}}
+    if previous is not None:
+        undo["previous"] = previous
+    return undo
+
+
+async def apply_item(item, rollouts: list[str]) -> tuple[str, dict, Optional[dict]]:
+    """
+    Create or update one object.
+    
+    Updates only go through if the object is still at the version the
+    comparison was made against. Rollouts of deployments are appended to
+    `rollouts` for the caller to enqueue together.
+    
+    Returns:
+        (action, object, undo info) where action is created, updated or
+        unchanged, and undo info is what `undo_apply` needs to revert it
+    
+    Raises:
+        ConflictError: The object changed while it was being applied
+    """
+    now = datetime.utcnow().isoformat()
+    if isinstance(item, DeploymentApply):
+        existing = store.find_deployment(item.namespace, item.name)
+        if existing is None:
+            dep = await backend.create_deployment(new_deployment_record(item), rollouts=rollouts)
+            return "created", dep, undo_info("Deployment", dep)
+        
+        env, labels = existing["env"], existing["labels"]
+        wanted_labels = {"app": item.name, **item.labels}
+        if (item.image, item.replicas, item.env, wanted_labels) == (
+            existing["image"], existing["replicas"], env, labels
+        ):
+            return "unchanged", existing, None
+        previous = {"image": existing["image"], "replicas": existing["replicas"], "env": env, "labels": labels}
+        dep = await backend.update_deployment(
+            existing["id"],
+            updated_at=now,
+            image=item.image if item.image != existing["image"] else None,
+            replicas=item.replicas if item.replicas != existing["replicas"] else None,
+            env=item.env if item.env != env else None,
+            labels=wanted_labels if wanted_labels != labels else None,
+            expected_version=existing["resource_version"],
+            rollouts=rollouts,
+        )
+        return "updated", dep, undo_info("Deployment", dep, previous)
+    
+    dep = store.find_deployment(item.namespace, item.deployment)
+    existing = next((s for s in store.services_of(dep["id"]) if s["name"] == item.name), None)
+    spec = {"port": item.port, "target_port": item.target_port, "type": item.type, "labels": item.labels}
+    if existing is None:
+        svc = ServiceCreate(deployment_id=dep["id"], **spec, name=item.name)
+        created = await backend.create_service(new_service_record(svc, dep))
+        return "created", created, undo_info("Service", created)
+    previous = {key: existing[key] for key in spec}
+    if previous == spec:
+        return "unchanged", existing, None
+    svc = await backend.update_service(existing["id"], expected_version=existing["resource_version"], **spec)
+    return "updated", svc, undo_info("Service", svc, previous)
+
+
+async def undo_apply(action: str, undo: dict, rollouts: list[str]) -> str:
+    """
+    Revert one applied item (transactional mode).
+    
+    An object another request has changed since (or deleted) is left as
+    it is rather than overwritten with what it was before this apply.
+    
+    Returns:
+        rolled_back, or conflict if the object was left alone
+    """
+    objects = deployments if undo["kind"] == "Deployment" else services
+    obj = objects.get(undo["id"])
+    if obj is None or any(obj[key] != value for key, value in undo["applied"].items()):
+        return "conflict"
+    version = obj["resource_version"]
+    try:
+        if undo["kind"] == "Deployment":
+            if action == "created":
+                await backend.delete_deployment(undo["id"])
+            else:
+                await backend.update_deployment(
+                    undo["id"],
+                    updated_at=datetime.utcnow().isoformat(),
+                    expected_version=version,
+                    rollouts=rollouts,
+                    **undo["previous"],
+                )
+        elif action == "created":
+            await backend.delete_service(undo["id"])
+        else:
+            await backend.update_service(undo["id"], expected_version=version, **undo["previous"])
+    except ConflictError:
+        return "conflict"
+    return "rolled_back"
+
+
+def item_ref(item) -> dict:
+    """Kind, namespace and name of an item, as far as they can be read."""
+    if isinstance(item, BaseModel):
+        return {"kind": item.kind, "namespace": item.namespace, "name": item.name}
+    if not isinstance(item, dict):
+        return {}
+    return {key: item[key] for key in ("kind", "namespace", "name") if isinstance(item.get(key), str)}
+
+
+def apply_result(index: int, ref: dict, action: str, obj: Optional[dict] = None, error: Optional[str] = None) -> str:
+    result = {"index": index, **ref, "action": action}
+    if obj is not None:
+        result["id"] = obj["id"]
+    if error is not None:
+        result["error"] = error
+    return json.dumps(result) + "\n"
+
+
+@app.post("/api/apply", tags=["Apply"])
+async def apply(
+    request: Request,
+    mode: Literal["transactional", "best-effort"] = "transactional",
+):
+    """
+    Create or update many deployments and services in one request.
+    
+    The body is a YAML stream (``Content-Type: application/yaml``) or a
+    JSON list of items, each with ``kind: Deployment`` (fields of
+    ``DeploymentCreate``) or ``kind: Service`` (referring to its deployment
+    by name). Objects are matched by namespace and name. The whole batch is
+    validated first: in transactional mode any invalid item rejects it
+    with 422, and an apply error undoes the items already applied. In
+    best-effort mode invalid or failing items are skipped.
+    
+    Results stream back as one JSON line per item:
+    ``{"index", "kind", "namespace", "name", "action", "id"}`` with action
+    created, updated, unchanged, failed, conflict or rolled_back. An item
+    whose object another request changed meanwhile is a conflict, and is
+    handled like a failure; undo leaves such objects alone and reports
+    them as conflicts too. Rollouts of the whole batch are enqueued
+    together once it has been applied.
+    """
+    raw_items = parse_apply_body(await request.body(), request.headers.get("content-type", ""))
+    items, errors = validate_apply_items(raw_items)
+    if errors and mode == "transactional":
+        raise HTTPException(
+            status_code=422,
+            detail=[{"index": i, "error": error} for i, error in sorted(errors.items())],
+        )
+    
+    # Deployments before the services that refer to them
+    order = sorted(range(len(items)), key=lambda i: isinstance(items[i], ServiceApply))
+    
+    async def results():
+        applied = []
+        rollouts: list[str] = []  # this apply's deployments, enqueued together at the end
+        try:
+            for i in order:
+                item = items[i]
+                if item is None:
+                    yield apply_result(i, item_ref(raw_items[i]), "failed", error=errors[i])
+                    continue
+                try:
+                    action, obj, undo = await apply_item(item, rollouts)
+                except (KubeError, KeyError, ConflictError) as e:
+                    failure = "conflict" if isinstance(e, ConflictError) else "failed"
+                    yield apply_result(i, item_ref(item), failure, error=str(e))
+                    if mode == "best-effort":
+                        continue
+                    for j, action, undo in reversed(applied):
+                        outcome = await undo_apply(action, undo, rollouts)
+                        error = "Changed by another request since; left as is" if outcome == "conflict" else None
+                        yield apply_result(j, item_ref(items[j]), outcome, error=error)
+                    return
+                if undo is not None:
+                    applied.append((i, action, undo))
+                yield apply_result(i, item_ref(item), action, obj)
+        finally:
+            controller.enqueue_many(dep_id for dep_id in rollouts if dep_id in deployments)
+            await commit()
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
 # Namespaces (mock)
 
 @app.get("/api/namespaces", tags=["Namespaces"])
@@ -396,7 +928,7 @@ async def get_cluster_info():
         "platform": "GKE",
         "nodes": 3,
         "namespaces": 4,
-        "pods_running": sum(d["ready_replicas"] for d in deployments.values()),
+        "pods_running": store.pods_running,
         "services": len(services),
     }
 
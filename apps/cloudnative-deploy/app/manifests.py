@@ -0,0 +1,154 @@
+"""
+Kubernetes manifests.
+
+Manifests are rendered from a record's current spec when first asked
+for, and the serialized JSON / YAML bytes are cached together with a
+content-hash ETag. A cache entry belongs to one resource version of its
+object, so any change to the object invalidates it without bookkeeping.
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Optional
+
+import yaml
+
+
+_YAML_DUMPER = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+
+def deployment_manifest(dep: dict) -> dict:
+    """Render a Kubernetes Deployment manifest from a deployment record."""
+    if "manifest" in dep:
+        return dep["manifest"]  # mirrored from a cluster as-is
+    return {
+        "apiVersion": "apps/v1",
+        "kind": "Deployment",
+        "metadata": {
+            "name": dep["name"],
+            "namespace": dep["namespace"],
+            "labels": dep["labels"],
+        },
+        "spec": {
+            "replicas": dep["replicas"],
+            "selector": {"matchLabels": {"app": dep["name"]}},
+            "template": {
+                "metadata": {"labels": {"app": dep["name"]}},
+                "spec": {
+                    "containers": [
+                        {
+                            "name": dep["name"],
+                            "image": dep["image"],
+                            "ports": [{"containerPort": dep["port"]}] if dep["port"] else [],
+                            "env": [
+                                {"name": k, "value": v}
+                                for k, v in dep["env"].items()
+                            ],
+                            "resources": {
+                                "limits": {
+                                    "cpu": dep["cpu_limit"],
+                                    "memory": dep["memory_limit"],
+                                },
+                            },
+                        }
+                    ]
+                },
+            },
+        },
+    }
+
+
+def service_manifest(svc: dict) -> dict:
+    """Render a Kubernetes Service manifest from a service record."""
+    if "manifest" in svc:
+        return svc["manifest"]
+    return {
+        "apiVersion": "v1",
+        "kind": "Service",
+        "metadata": {
+            "name": svc["name"],
+            "namespace": svc["namespace"],
+            **({"labels": svc["labels"]} if svc["labels"] else {}),
+        },
+        "spec": {
+            "type": svc["type"],
+            "selector": svc["selector"],
+            "ports": [
+                {
+                    "port": svc["port"],
+                    "targetPort": svc["target_port"],
+                }
+            ],
+        },
+    }
+
+
+MEDIA_TYPES = {"json": "application/json", "yaml": "application/yaml"}
+
+
+def _serialize(manifest: dict, fmt: str) -> bytes:
+    if fmt == "yaml":
+        return yaml.dump(manifest, Dumper=_YAML_DUMPER, sort_keys=False).encode()
+    return json.dumps(manifest, separators=(",", ":")).encode()
+
+
+class ManifestCache:
+    """
+    Serialized manifests per object, format and resource version.
+
+    Holds at most `max_entries` objects, least recently used first out.
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        # object id -> (resource version, {format: (body, etag)})
+        self._entries: OrderedDict[str, tuple[int, dict[str, tuple[bytes, str]]]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, obj: dict, kind: str, fmt: str = "json") -> tuple[bytes, str]:
+        """
+        Serialized manifest of an object.
+
+        Args:
+            obj: Deployment or service record
+            kind: "Deployment" or "Service"
+            fmt: "json" or "yaml"
+
+        Returns:
+            (body, quoted ETag)
+        """
+        version = obj.get("resource_version", 0)
+        entry = self._entries.get(obj["id"])
+        if entry is None or entry[0] != version:
+            entry = (version, {})
+            self._entries[obj["id"]] = entry
+        # Replacing a key keeps its old position, so move it on every read
+        self._entries.move_to_end(obj["id"])
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+        forms = entry[1]
+        if fmt not in forms:
+            render = deployment_manifest if kind == "Deployment" else service_manifest
+            body = _serialize(render(obj), fmt)
+            forms[fmt] = (body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        return forms[fmt]
+
+    def discard(self, object_id: str) -> None:
+        self._entries.pop(object_id, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header covers `etag` (weak comparison)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+    return etag in candidates
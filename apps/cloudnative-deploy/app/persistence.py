@@ -0,0 +1,314 @@
+"""
+Durable local state.
+
+Every store change is appended to a write-ahead log as one checksummed
+line holding the object's new state as JSON. Appending only buffers the
+line; a single flusher task writes the buffer in groups, with one fsync
+per group, so concurrent writers share the cost of a disk flush. After `snapshot_every` changes the whole
+store is written to a snapshot, the log is continued in a new segment,
+and the segments the snapshot covers are deleted.
+
+On startup, `recover` loads the snapshot and replays the log written
+after it. Snapshots use the same line format as the log.
+
+If a write or fsync fails, the log stops: whatever it had not yet
+written may be lost, so every `commit` from then on raises `LogWriteError`
+instead of reporting changes as durable.
+"""
+
+import asyncio
+import gc
+import json
+import logging
+import os
+import zlib
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+from app.pods import PodTable
+from app.store import ObjectStore
+
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_FILE = "snapshot.jsonl"
+
+
+class LogWriteError(Exception):
+    """The log could not be written, so changes are no longer being made durable."""
+
+
+class CorruptStateError(Exception):
+    """The snapshot is damaged; recovering would silently drop objects."""
+
+
+# A log line is "<crc32> <version> <event type> <kind> <id> <JSON>". The plain
+# header fields let recovery skip parsing the JSON of superseded entries.
+
+def _encode(rv: int, event_type: str, kind: str, object_id: str, payload: dict) -> bytes:
+    data = b"%d %s %s %s %s" % (
+        rv, event_type.encode(), kind.encode(), object_id.encode(),
+        json.dumps(payload, separators=(",", ":")).encode(),
+    )
+    return b"%08x %s\n" % (zlib.crc32(data), data)
+
+
+def _decode(line: bytes) -> Optional[tuple[int, str, str, str, bytes]]:
+    """(version, event type, kind, id, JSON) of a log line, or None if it is torn or corrupt."""
+    checksum, _, data = line.rstrip(b"\n").partition(b" ")
+    try:
+        if int(checksum, 16) != zlib.crc32(data):
+            return None
+        rv, event_type, kind, object_id, payload = data.split(b" ", 4)
+        return int(rv), event_type.decode(), kind.decode(), object_id.decode(), payload
+    except ValueError:
+        return None
+
+
+def _pods(entry: dict) -> Optional[PodTable]:
+    return PodTable.load(entry["pods"]) if "pods" in entry else None
+
+
+def _fsync_directory(directory: Path) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class StateLog:
+    """
+    Write-ahead log and snapshots of an `ObjectStore`.
+
+    Args:
+        directory: Where the snapshot and log segments live
+        store: Store to recover into and log changes of
+        commit_interval: Seconds a group waits for more changes before it is flushed
+        snapshot_every: Logged changes between snapshots
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        store: ObjectStore,
+        commit_interval: float = 0.002,
+        snapshot_every: int = 100_000,
+    ):
+        self.directory = Path(directory)
+        self.store = store
+        self.commit_interval = commit_interval
+        self.snapshot_every = snapshot_every
+        self._buffer: list[bytes] = []
+        self._buffered_version = 0  # version of the last change appended
+        self._committed_version = 0  # version of the last change on disk
+        self._since_snapshot = 0
+        self._segment: Optional[BinaryIO] = None
+        self._wake = asyncio.Event()
+        self._committed = asyncio.Condition()
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._failed: Optional[Exception] = None  # the write that stopped the log
+        self._snapshotting = asyncio.Lock()
+
+    def _segments(self) -> list[Path]:
+        # Named by the first version they may hold, zero-padded to sort in order
+        return sorted(self.directory.glob("wal-*.log"))
+
+    def _open_segment(self) -> Path:
+        path = self.directory / f"wal-{self.store.resource_version + 1:020d}.log"
+        if self._segment is None or Path(self._segment.name) != path:
+            if self._segment is not None:
+                self._segment.close()
+            self._segment = open(path, "ab")
+        return path
+
+    # Recovery
+
+    def recover(self) -> int:
+        """
+        Load the snapshot and the log after it into the store, then start logging.
+
+        A torn entry at the end of a segment (a crash mid-write) is cut
+        off, together with anything after it in that segment.
+
+        Returns:
+            Number of log entries replayed on top of the snapshot
+
+        Raises:
+            CorruptStateError: A snapshot line fails its checksum
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # Fold the snapshot and log into each object's last state first, so
+        # every surviving object is indexed once however often it changed
+        latest: dict[str, bytes] = {}  # id -> JSON of its last state
+        version = snapshot_version = 0
+        replayed = 0
+        gc.disable()  # many small long-lived objects: collections would only slow loading down
+        try:
+            snapshot = self.directory / SNAPSHOT_FILE
+            if snapshot.exists():
+                with open(snapshot, "rb") as f:
+                    version = snapshot_version = json.loads(f.readline())["resource_version"]
+                    for number, line in enumerate(f, start=2):
+                        entry = _decode(line)
+                        if entry is None:
+                            # Snapshots are renamed into place once complete, so this isn't a torn write
+                            raise CorruptStateError(f"{snapshot}: line {number} is corrupt")
+                        _, _, _, object_id, payload = entry
+                        latest[object_id] = payload
+
+            for segment in self._segments():
+                offset = 0
+                with open(segment, "rb") as f:
+                    for line in f:
+                        entry = _decode(line)
+                        if entry is None:
+                            logger.warning("Cutting torn write-ahead log entry from %s", segment.name)
+                            os.truncate(segment, offset)
+                            break
+                        offset += len(line)
+                        rv, event_type, _, object_id, payload = entry
+                        if rv <= snapshot_version:
+                            continue
+                        if event_type == "DELETED":
+                            latest.pop(object_id, None)
+                        else:
+                            latest[object_id] = payload
+                        version = max(version, rv)
+                        replayed += 1
+
+            for payload in latest.values():
+                entry = json.loads(payload)
+                self.store.restore(entry["kind"], entry["object"], _pods(entry))
+            self.store.resource_version = max(self.store.resource_version, version)
+        finally:
+            gc.enable()
+
+        self._buffered_version = self._committed_version = self.store.resource_version
+        self._since_snapshot = replayed
+        self._open_segment()
+        self.store.listeners.append(self._append)
+        return replayed
+
+    # Logging
+
+    def _append(self, event_type: str, kind: str, obj: dict, rv: int) -> None:
+        if self._failed is not None:
+            return  # nothing will write it
+        payload = {"kind": kind, "object": obj}
+        if kind == "Deployment" and event_type != "DELETED":
+            payload["pods"] = self.store.pods[obj["id"]].dump()
+        self._buffer.append(_encode(rv, event_type, kind, obj["id"], payload))
+        self._buffered_version = rv
+        self._wake.set()
+
+    def start(self) -> None:
+        """Start the flusher (needs a running event loop)."""
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while not self._closing:
+                await self._wake.wait()
+                if not self._closing:
+                    await asyncio.sleep(self.commit_interval)  # let the group fill up
+                self._wake.clear()
+                await self._flush()
+                if self._since_snapshot >= self.snapshot_every:
+                    await self.snapshot()
+        except Exception as exc:
+            # After a failed fsync the kernel may have dropped the pages, so
+            # retrying could report lost changes as durable: stop instead
+            logger.exception("Write-ahead log failed; changes are no longer persisted")
+            async with self._committed:
+                self._failed = exc
+                self._buffer.clear()
+                self._committed.notify_all()
+
+    @staticmethod
+    def _write(segment: BinaryIO, data: bytes) -> None:
+        segment.write(data)
+        segment.flush()
+        os.fsync(segment.fileno())
+
+    async def _flush(self) -> None:
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        version = self._buffered_version
+        await asyncio.to_thread(self._write, self._segment, b"".join(lines))
+        self._since_snapshot += len(lines)
+        async with self._committed:
+            self._committed_version = version
+            self._committed.notify_all()
+
+    async def commit(self) -> None:
+        """
+        Wait until every change made so far is on disk.
+
+        Raises:
+            LogWriteError: The log stopped before they were written
+        """
+        version = self._buffered_version
+        if self._committed_version >= version:
+            return
+        self._wake.set()
+        async with self._committed:
+            await self._committed.wait_for(
+                lambda: self._committed_version >= version or self._failed is not None
+            )
+        if self._committed_version < version:
+            raise LogWriteError(str(self._failed)) from self._failed
+
+    # Snapshots
+
+    async def snapshot(self) -> None:
+        """Write the whole store to a snapshot and drop the log segments it covers."""
+        async with self._snapshotting:
+            await self._snapshot()
+
+    async def _snapshot(self) -> None:
+        version = self.store.resource_version
+        # Shallow copies are enough: nested values are replaced, never mutated in place
+        objects = [
+            {"kind": "Deployment", "object": dict(dep), "pods": self.store.pods[dep["id"]].dump()}
+            for dep in self.store.list_deployments()
+        ] + [{"kind": "Service", "object": dict(svc)} for svc in self.store.list_services()]
+
+        # Changes from here on go to a new segment; the older ones end at `version`
+        current = self._open_segment()
+        covered = [path for path in self._segments() if path != current]
+        await asyncio.to_thread(self._write_snapshot, version, objects)
+        for path in covered:
+            path.unlink()
+        self._since_snapshot = 0
+        logger.info("Snapshot of %d objects at version %d", len(objects), version)
+
+    def _write_snapshot(self, version: int, objects: list[dict]) -> None:
+        path = self.directory / SNAPSHOT_FILE
+        partial = path.with_suffix(".tmp")
+        with open(partial, "wb") as f:
+            f.write(json.dumps({"resource_version": version}).encode() + b"\n")
+            f.writelines(
+                _encode(version, "ADDED", entry["kind"], entry["object"]["id"], entry) for entry in objects
+            )
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(partial, path)
+        _fsync_directory(self.directory)
+
+    async def close(self) -> None:
+        """Stop the flusher, flush what is left and snapshot for a quick next start."""
+        self.store.listeners.remove(self._append)
+        if self._task is not None:
+            # Let the flusher finish its current write rather than cancelling it mid-way
+            self._closing = True
+            self._wake.set()
+            await self._task
+            self._task = None
+        if self._failed is None:
+            await self._flush()
+            await self.snapshot()
+        self._segment.close()
+        self._segment = None
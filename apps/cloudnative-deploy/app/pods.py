@@ -0,0 +1,136 @@
+"""
+Simulated pods.
+
+Each deployment's pods live in a `PodTable`: one typed array per column
+(name suffix, template revision, start time, restarts, readiness) rather
+than one object per pod. The rollout controller adds and retires pods,
+so names and ages stay the same from one listing to the next. A new pod
+is Pending and not ready until the controller's next step finds it up.
+"""
+
+import random
+import zlib
+from array import array
+from datetime import datetime, timezone
+from typing import Optional
+
+
+# Alphabet Kubernetes uses for generated name suffixes (no vowels, no 0/1/3)
+_SUFFIX_ALPHABET = "bcdfghjklmnpqrstvwxz2456789"
+
+
+def _suffix(value: int, length: int = 5) -> str:
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, len(_SUFFIX_ALPHABET))
+        chars.append(_SUFFIX_ALPHABET[digit])
+    return "".join(chars)
+
+
+def format_age(seconds: float) -> str:
+    """Age the way kubectl shows it: 45s, 12m, 5h, 3d."""
+    seconds = max(int(seconds), 0)
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
+
+
+class PodTable:
+    """
+    The pods of one deployment.
+
+    `revision` is the deployment's current pod template revision; pods
+    started from an older revision are outdated and get replaced during
+    a rollout.
+    """
+
+    __slots__ = ("revision", "_suffixes", "_revisions", "_started", "_restarts", "_ready")
+
+    def __init__(self, revision: int = 1):
+        self.revision = revision
+        self._suffixes = array("L")
+        self._revisions = array("L")
+        self._started = array("d")
+        self._restarts = array("L")
+        self._ready = array("B")  # 0 while Pending, 1 once Running and ready
+
+    def _columns(self) -> tuple[array, ...]:
+        return self._suffixes, self._revisions, self._started, self._restarts, self._ready
+
+    def __len__(self) -> int:
+        return len(self._suffixes)
+
+    @property
+    def updated(self) -> int:
+        """Number of pods running the current revision."""
+        return self._revisions.count(self.revision)
+
+    @property
+    def ready(self) -> int:
+        """Number of pods that are up and ready."""
+        return self._ready.count(1)
+
+    def mark_ready(self) -> None:
+        """Every Pending pod has come up (the controller's next step after starting them)."""
+        for index, ready in enumerate(self._ready):
+            if not ready:
+                self._ready[index] = 1
+
+    def revise(self) -> None:
+        """Start a new pod template revision, making every pod outdated."""
+        self.revision += 1
+
+    def add(self, now: float) -> None:
+        """Start a pod on the current revision; it is Pending until `mark_ready`."""
+        self._suffixes.append(random.getrandbits(32))
+        self._revisions.append(self.revision)
+        self._started.append(now)
+        self._restarts.append(0)
+        self._ready.append(0)
+
+    def remove(self, index: int) -> None:
+        for column in self._columns():
+            del column[index]
+
+    def outdated(self) -> Optional[int]:
+        """Index of the oldest pod on an earlier revision, if any."""
+        for index, revision in enumerate(self._revisions):
+            if revision != self.revision:
+                return index
+        return None
+
+    def dump(self) -> dict:
+        """The table as plain data, for persisting."""
+        return {
+            "revision": self.revision,
+            "pods": [list(pod) for pod in zip(*self._columns())],
+        }
+
+    @classmethod
+    def load(cls, data: dict) -> "PodTable":
+        """A table from `dump` output."""
+        table = cls(data["revision"])
+        for pod in data["pods"]:
+            for column, value in zip(table._columns(), pod):
+                column.append(value)
+        return table
+
+    def rows(self, deployment_name: str, now: float) -> list[dict]:
+        """The pods as API objects."""
+        hashes: dict[int, str] = {}
+        rows = []
+        for suffix, revision, started, restarts, ready in zip(*self._columns()):
+            if revision not in hashes:
+                # Stands in for the pod-template-hash of the pod's ReplicaSet
+                hashes[revision] = f"{zlib.crc32(f'{deployment_name}:{revision}'.encode()):08x}"
+            rows.append({
+                "name": f"{deployment_name}-{hashes[revision]}-{_suffix(suffix)}",
+                "status": "Running" if ready else "Pending",
+                "ready": bool(ready),
+                "restarts": restarts,
+                "age": format_age(now - started),
+                "started_at": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+                "revision": revision,
+            })
+        return rows
@@ -0,0 +1,335 @@
+"""
+In-memory object store.
+
+Holds deployment and service records and the deployments' pods, and
+keeps lookup indexes and cluster counters up to date as they change, so
+listing a namespace, selecting by label or field, paging through a
+listing, finding a deployment's services or reading cluster totals costs
+the size of the answer rather than the number of objects.
+"""
+
+from bisect import bisect_right, insort
+from typing import Callable, Iterable, Optional
+
+from app.listing import Requirement
+from app.pods import PodTable
+
+
+# (event type, kind, object, resource version) -> None
+Listener = Callable[[str, str, dict, int], None]
+
+# Fields a field selector can use, per kind: selector field -> record key
+SELECTABLE_FIELDS = {
+    "Deployment": {
+        "metadata.name": "name",
+        "metadata.namespace": "namespace",
+        "status.phase": "status",
+    },
+    "Service": {
+        "metadata.name": "name",
+        "metadata.namespace": "namespace",
+        "spec.type": "type",
+        "spec.deploymentId": "deployment_id",
+    },
+}
+
+# Position of an object in listings: creation order, ties broken by id
+ListKey = tuple[str, str]
+
+
+def list_key(obj: dict) -> ListKey:
+    return obj["created_at"], obj["id"]
+
+
+class ConflictError(Exception):
+    """A write was based on a version of an object that is no longer current."""
+
+
+def check_version(obj: dict, expected_version: Optional[int]) -> None:
+    """
+    Compare-and-swap precondition: `obj` is still at `expected_version` (None always passes).
+
+    Raises:
+        ConflictError: The object has changed since
+    """
+    if expected_version is not None and obj["resource_version"] != expected_version:
+        raise ConflictError(
+            f"{obj['name']} is at resourceVersion {obj['resource_version']}, not {expected_version}; "
+            "read it again and retry"
+        )
+
+
+class ObjectStore:
+    """
+    Deployment and service records plus indexes maintained on every write.
+
+    All writes go through the methods below; the `deployments` and
+    `services` dicts are for reads only. Every write bumps the store's
+    `resource_version`, stamps it on the object and is reported to the
+    listeners as an ADDED, MODIFIED or DELETED event.
+    """
+
+    def __init__(self):
+        self.deployments: dict[str, dict] = {}
+        self.services: dict[str, dict] = {}
+        self._objects = {"Deployment": self.deployments, "Service": self.services}
+        # Sorted list keys per kind, the stable order listings are paged in
+        self._order: dict[str, list[ListKey]] = {kind: [] for kind in self._objects}
+        # (kind, "field" | "label", key, value) -> ids; (kind, label key) -> ids
+        self._index: dict[tuple[str, str, str, str], set[str]] = {}
+        self._label_keys: dict[tuple[str, str], set[str]] = {}
+        self._by_name: dict[tuple[str, str], str] = {}  # (namespace, name) -> id
+        # Insertion-ordered id sets (dict keys) so services keep creation order
+        self._services_by_deployment: dict[str, dict[str, None]] = {}
+        self.pods: dict[str, PodTable] = {}  # deployment id -> its simulated pods
+        self.pods_running = 0
+        self.resource_version = 0
+        self.listeners: list[Listener] = []
+        self._restoring = False
+
+    def _changed(self, event_type: str, kind: str, obj: dict) -> None:
+        if self._restoring:
+            # Persisted objects keep their version, and listeners already saw them
+            self.resource_version = max(self.resource_version, obj["resource_version"])
+            return
+        self.resource_version += 1
+        obj["resource_version"] = self.resource_version
+        for listener in self.listeners:
+            listener(event_type, kind, obj, self.resource_version)
+
+    def clear(self) -> None:
+        self.deployments.clear()
+        self.services.clear()
+        for keys in self._order.values():
+            keys.clear()
+        self._index.clear()
+        self._label_keys.clear()
+        self._by_name.clear()
+        self._services_by_deployment.clear()
+        self.pods.clear()
+        self.pods_running = 0
+        self.resource_version = 0
+
+    def restore(self, kind: str, obj: dict, pods: Optional[PodTable] = None) -> None:
+        """
+        Put back a persisted object, keeping its version and without notifying listeners.
+
+        Args:
+            kind: "Deployment" or "Service"
+            obj: The object as persisted
+            pods: A deployment's pods as persisted
+        """
+        self._restoring = True
+        try:
+            if kind == "Deployment":
+                self.add_deployment(obj)
+                if pods is not None:
+                    self.pods[obj["id"]] = pods
+            else:
+                self.add_service(obj)
+        finally:
+            self._restoring = False
+
+    # Listing
+
+    def _link(self, kind: str, obj: dict) -> None:
+        insort(self._order[kind], list_key(obj))
+        for field, key in SELECTABLE_FIELDS[kind].items():
+            self._index.setdefault((kind, "field", field, str(obj[key])), set()).add(obj["id"])
+        for key, value in obj.get("labels", {}).items():
+            self._index.setdefault((kind, "label", key, value), set()).add(obj["id"])
+            self._label_keys.setdefault((kind, key), set()).add(obj["id"])
+
+    def _unlink(self, kind: str, obj: dict) -> None:
+        order = self._order[kind]
+        del order[bisect_right(order, list_key(obj)) - 1]
+        entries = [((kind, "field", field, str(obj[key])), self._index)
+                   for field, key in SELECTABLE_FIELDS[kind].items()]
+        for key, value in obj.get("labels", {}).items():
+            entries += [((kind, "label", key, value), self._index), ((kind, key), self._label_keys)]
+        for entry, index in entries:
+            ids = index[entry]
+            ids.discard(obj["id"])
+            if not ids:
+                del index[entry]
+
+    def _update(self, kind: str, obj: dict, changes: dict) -> None:
+        """Apply changes to an object, re-indexing it only if indexed fields change."""
+        indexed = {"created_at", "labels", *SELECTABLE_FIELDS[kind].values()}
+        if any(key in indexed and obj.get(key) != value for key, value in changes.items()):
+            self._unlink(kind, obj)
+            obj.update(changes)
+            self._link(kind, obj)
+        else:
+            obj.update(changes)
+
+    def select(
+        self,
+        kind: str,
+        labels: Iterable[Requirement] = (),
+        fields: Iterable[Requirement] = (),
+    ) -> Optional[set[str]]:
+        """
+        Ids of the objects matching every requirement, read off the indexes.
+
+        Args:
+            kind: "Deployment" or "Service"
+            labels: Label selector requirements
+            fields: Field selector requirements (fields of `SELECTABLE_FIELDS`)
+
+        Returns:
+            Matching ids, or None when there are no requirements (everything matches)
+        """
+        include: list[set[str]] = []
+        exclude: list[set[str]] = []
+        terms = [("label", r) for r in labels] + [("field", r) for r in fields]
+        for source, req in terms:
+            if req.op in ("exists", "!exists"):
+                ids = self._label_keys.get((kind, req.key), set())
+            else:
+                ids = set().union(*(self._index.get((kind, source, req.key, v), ()) for v in req.values))
+            (include if req.op in ("=", "in", "exists") else exclude).append(ids)
+
+        if not include and not exclude:
+            return None
+        if include:
+            include.sort(key=len)
+            matched = include[0].intersection(*include[1:])
+        else:
+            matched = set(self._objects[kind])
+        return matched.difference(*exclude)
+
+    def page(
+        self,
+        kind: str,
+        ids: Optional[set[str]] = None,
+        after: Optional[tuple] = None,
+        limit: Optional[int] = None,
+    ) -> tuple[list[dict], int]:
+        """
+        Objects in list order, optionally restricted to `ids`.
+
+        Args:
+            kind: "Deployment" or "Service"
+            ids: Ids to list, as returned by `select`; None lists all
+            after: List key of the last object of the previous page
+            limit: Maximum number of objects
+
+        Returns:
+            (objects, number of matching objects after them)
+        """
+        objects = self._objects[kind]
+        order = self._order[kind]
+        start = 0 if after is None else bisect_right(order, tuple(after))
+        if ids is None:
+            keys = order[start:]
+        elif len(ids) * 8 < len(order) - start:
+            # Few matches: sorting them beats scanning the whole order
+            keys = sorted(list_key(objects[i]) for i in ids)
+            keys = keys[bisect_right(keys, tuple(after)):] if after is not None else keys
+        else:
+            keys = [key for key in order[start:] if key[1] in ids]
+        end = len(keys) if limit is None else min(limit, len(keys))
+        return [objects[key[1]] for key in keys[:end]], len(keys) - end
+
+    # Deployments
+
+    def add_deployment(self, dep: dict) -> dict:
+        self.deployments[dep["id"]] = dep
+        self.pods[dep["id"]] = PodTable()
+        self._link("Deployment", dep)
+        self._by_name[dep["namespace"], dep["name"]] = dep["id"]
+        self.pods_running += dep["ready_replicas"]
+        self._changed("ADDED", "Deployment", dep)
+        return dep
+
+    def update_deployment(self, deployment_id: str, expected_version: Optional[int] = None, **changes) -> dict:
+        """
+        Apply field changes to a deployment.
+
+        Raises:
+            KeyError: No such deployment
+            ConflictError: It is no longer at `expected_version`
+        """
+        dep = self.deployments[deployment_id]
+        check_version(dep, expected_version)
+        if "ready_replicas" in changes:
+            self.pods_running += changes["ready_replicas"] - dep["ready_replicas"]
+        self._update("Deployment", dep, changes)
+        self._changed("MODIFIED", "Deployment", dep)
+        return dep
+
+    def remove_deployment(self, deployment_id: str) -> Optional[dict]:
+        """Remove a deployment together with the services exposing it."""
+        dep = self.deployments.pop(deployment_id, None)
+        if dep is None:
+            return None
+        self._unlink("Deployment", dep)
+        del self.pods[deployment_id]
+        if self._by_name.get((dep["namespace"], dep["name"])) == deployment_id:
+            del self._by_name[dep["namespace"], dep["name"]]
+        self.pods_running -= dep["ready_replicas"]
+        for service_id in list(self._services_by_deployment.get(deployment_id, ())):
+            self.remove_service(service_id)
+        self._changed("DELETED", "Deployment", dep)
+        return dep
+
+    def find_deployment(self, namespace: str, name: str) -> Optional[dict]:
+        deployment_id = self._by_name.get((namespace, name))
+        return None if deployment_id is None else self.deployments[deployment_id]
+
+    def _list_namespace(self, kind: str, namespace: Optional[str]) -> list[dict]:
+        if namespace is None:
+            return self.page(kind)[0]
+        ids = self.select(kind, fields=[Requirement("metadata.namespace", "=", frozenset([namespace]))])
+        return self.page(kind, ids)[0]
+
+    def list_deployments(self, namespace: Optional[str] = None) -> list[dict]:
+        return self._list_namespace("Deployment", namespace)
+
+    # Services
+
+    def add_service(self, svc: dict) -> dict:
+        self.services[svc["id"]] = svc
+        self._link("Service", svc)
+        self._services_by_deployment.setdefault(svc["deployment_id"], {})[svc["id"]] = None
+        self._changed("ADDED", "Service", svc)
+        return svc
+
+    def update_service(self, service_id: str, expected_version: Optional[int] = None, **changes) -> dict:
+        """
+        Apply field changes to a service.
+
+        Raises:
+            KeyError: No such service
+            ConflictError: It is no longer at `expected_version`
+        """
+        svc = self.services[service_id]
+        check_version(svc, expected_version)
+        if "deployment_id" in changes and changes["deployment_id"] != svc["deployment_id"]:
+            self._unlink_service(svc)
+            self._services_by_deployment.setdefault(changes["deployment_id"], {})[service_id] = None
+        self._update("Service", svc, changes)
+        self._changed("MODIFIED", "Service", svc)
+        return svc
+
+    def _unlink_service(self, svc: dict) -> None:
+        siblings = self._services_by_deployment[svc["deployment_id"]]
+        del siblings[svc["id"]]
+        if not siblings:
+            del self._services_by_deployment[svc["deployment_id"]]
+
+    def remove_service(self, service_id: str) -> Optional[dict]:
+        svc = self.services.pop(service_id, None)
+        if svc is None:
+            return None
+        self._unlink("Service", svc)
+        self._unlink_service(svc)
+        self._changed("DELETED", "Service", svc)
+        return svc
+
+    def list_services(self, namespace: Optional[str] = None) -> list[dict]:
+        return self._list_namespace("Service", namespace)
+
+    def services_of(self, deployment_id: str) -> list[dict]:
+        return [self.services[i] for i in self._services_by_deployment.get(deployment_id, ())]
@@ -0,0 +1,172 @@
+"""
+Watch streams.
+
+Every change to a stored object is published once as an ADDED, MODIFIED
+or DELETED event stamped with the store's resource version. Recent events
+are kept in a ring buffer so a client can resume from the last version it
+saw; each watcher gets a bounded queue and is cut off, with an ERROR
+event telling it where to resume, if it falls too far behind.
+"""
+
+import asyncio
+import json
+from collections import deque
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterable, Optional
+
+
+class ExpiredError(Exception):
+    """The requested resource version is older than the buffered history."""
+
+
+@dataclass
+class Event:
+    resource_version: int
+    type: str
+    kind: str
+    object_id: str
+    namespace: Optional[str]
+    data: str  # JSON, serialized once and shared by every watcher
+
+
+@dataclass(eq=False)
+class Watcher:
+    kind: str
+    object_id: Optional[str] = None
+    namespace: Optional[str] = None
+    queue: asyncio.Queue = field(default_factory=asyncio.Queue)
+    resource_version: int = 0  # last version delivered
+    overflowed: bool = False
+
+    def matches(self, event: Event) -> bool:
+        return (
+            event.kind == self.kind
+            and (self.object_id is None or event.object_id == self.object_id)
+            and (self.namespace is None or event.namespace == self.namespace)
+        )
+
+
+class WatchHub:
+    """
+    Fans store changes out to watchers.
+
+    Args:
+        history: Events kept for resuming
+        queue_size: Events a watcher may have pending before it's dropped
+    """
+
+    def __init__(self, history: int = 1024, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._history: deque[Event] = deque(maxlen=history)
+        self._watchers: set[Watcher] = set()
+        self.resource_version = 0
+
+    @property
+    def watchers(self) -> int:
+        return len(self._watchers)
+
+    def clear(self) -> None:
+        self._history.clear()
+        self.resource_version = 0
+
+    def publish(self, event_type: str, kind: str, obj: dict, resource_version: int) -> None:
+        event = Event(
+            resource_version=resource_version,
+            type=event_type,
+            kind=kind,
+            object_id=obj["id"],
+            namespace=obj.get("namespace"),
+            data=json.dumps({"type": event_type, "object": obj}),
+        )
+        self.resource_version = resource_version
+        self._history.append(event)
+        for watcher in list(self._watchers):
+            if not watcher.matches(event):
+                continue
+            try:
+                watcher.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too slow: stop feeding it; it resumes from where it got to
+                watcher.overflowed = True
+                self._watchers.discard(watcher)
+
+    def subscribe(
+        self,
+        kind: str,
+        since: Optional[int] = None,
+        object_id: Optional[str] = None,
+        namespace: Optional[str] = None,
+    ) -> Watcher:
+        """
+        Register a watcher, pre-filled with the buffered events after `since`.
+
+        Raises:
+            ExpiredError: Events after `since` are no longer buffered
+        """
+        watcher = Watcher(kind, object_id, namespace, asyncio.Queue(self.queue_size))
+        watcher.resource_version = self.resource_version if since is None else since
+        if since is not None and since < self.resource_version:
+            oldest = self._history[0].resource_version if self._history else self.resource_version + 1
+            if since < oldest - 1:
+                raise ExpiredError(f"resourceVersion {since} is too old; oldest available is {oldest}")
+            backlog = [e for e in self._history if e.resource_version > since and watcher.matches(e)]
+            if len(backlog) > self.queue_size:
+                raise ExpiredError(f"resourceVersion {since} is too far behind; list again")
+            for event in backlog:
+                watcher.queue.put_nowait(event)
+        self._watchers.add(watcher)
+        return watcher
+
+    def unsubscribe(self, watcher: Watcher) -> None:
+        self._watchers.discard(watcher)
+
+    async def stream(
+        self,
+        watcher: Watcher,
+        initial: Iterable[str] = (),
+        timeout: Optional[float] = None,
+        heartbeat: float = 15.0,
+    ) -> AsyncIterator[str]:
+        """
+        Server-sent events for a watcher.
+
+        Args:
+            watcher: From `subscribe`
+            initial: Pre-rendered SSE messages sent first
+            timeout: Close the stream after this many seconds
+            heartbeat: Seconds of silence before a keep-alive comment
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        try:
+            for message in initial:
+                yield message
+            while True:
+                if watcher.overflowed and watcher.queue.empty():
+                    yield sse_message("ERROR", json.dumps({
+                        "type": "ERROR",
+                        "object": {
+                            "code": 410,
+                            "message": f"watcher fell behind; resume from resourceVersion {watcher.resource_version}",
+                        },
+                    }))
+                    return
+                wait = heartbeat if deadline is None else min(heartbeat, deadline - loop.time())
+                if wait <= 0:
+                    return
+                try:
+                    async with asyncio.timeout(wait):
+                        event = await watcher.queue.get()
+                except TimeoutError:
+                    if deadline is None or loop.time() < deadline:
+                        yield ": keep-alive\n\n"
+                    continue
+                watcher.resource_version = event.resource_version
+                yield sse_message(event.type, event.data, event.resource_version)
+        finally:
+            self.unsubscribe(watcher)
+
+
+def sse_message(event_type: str, data: str, event_id: Optional[int] = None) -> str:
+    prefix = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{prefix}event: {event_type}\ndata: {data}\n\n"
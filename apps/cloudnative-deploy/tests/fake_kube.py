@@ -0,0 +1,166 @@
+"""
+A small fake Kubernetes API server for testing the Kubernetes backend.
+
+Serves deployments and services with list, watch (newline-delimited JSON,
+ended after `timeoutSeconds`), create, strategic-merge patch (refused
+with 409 when its metadata.resourceVersion is stale) and delete, and
+records every request it receives.
+"""
+
+import asyncio
+import copy
+import json
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+
+RESOURCES = {
+    "deployments": ("apps/v1", "Deployment", "/apis/apps/v1"),
+    "services": ("v1", "Service", "/api/v1"),
+}
+
+
+# Key each list's items are merged by, as in the real API's strategic merge
+MERGE_KEYS = {"containers": "name", "env": "name", "ports": "port"}
+REPLACE = {"$patch": "replace"}
+
+
+def _merge(target: dict, patch: dict) -> dict:
+    """
+    Strategic merge for the shapes used here: keyed lists merge item by
+    item unless they carry a `$patch: replace` directive, null deletes.
+    """
+    for key, value in patch.items():
+        if isinstance(value, list) and REPLACE in value:
+            target[key] = [item for item in value if item != REPLACE]
+        elif key in MERGE_KEYS and isinstance(value, list):
+            merge_key = MERGE_KEYS[key]
+            by_key = {item.get(merge_key): item for item in target.get(key, [])}
+            for item in value:
+                _merge(by_key.setdefault(item.get(merge_key), {}), item)
+            target[key] = list(by_key.values())
+        elif value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+    return target
+
+
+class FakeKubeAPI:
+    def __init__(self):
+        self.objects: dict[str, dict[tuple[str, str], dict]] = {r: {} for r in RESOURCES}
+        self.events: list[tuple[int, str, dict]] = []  # (resource version, resource, event)
+        self.oldest_version = 0  # versions before this are "compacted"
+        self.version = 100
+        self.requests: list[tuple[str, str]] = []
+        self.write_latency = 0.0  # seconds each POST, PATCH or DELETE takes
+        self._changed = asyncio.Condition()
+        self.app = self._build_app()
+
+    def _record(self, resource: str, event_type: str, obj: dict) -> None:
+        self.version += 1
+        obj["metadata"]["resourceVersion"] = str(self.version)
+        self.events.append((self.version, resource, {"type": event_type, "object": copy.deepcopy(obj)}))
+
+    async def notify(self) -> None:
+        async with self._changed:
+            self._changed.notify_all()
+
+    def put(self, resource: str, obj: dict) -> dict:
+        """Create an object directly, as another client of the cluster would."""
+        api_version, kind, _ = RESOURCES[resource]
+        obj = {"apiVersion": api_version, "kind": kind, **copy.deepcopy(obj)}
+        meta = obj["metadata"]
+        meta.setdefault("namespace", "default")
+        meta["uid"] = str(uuid.uuid4())
+        meta["creationTimestamp"] = "2024-01-01T00:00:00Z"
+        self.objects[resource][meta["namespace"], meta["name"]] = obj
+        self._record(resource, "ADDED", obj)
+        return obj
+
+    def modify(self, resource: str, namespace: str, name: str, patch: dict) -> dict:
+        obj = _merge(self.objects[resource][namespace, name], copy.deepcopy(patch))
+        self._record(resource, "MODIFIED", obj)
+        return obj
+
+    def remove(self, resource: str, namespace: str, name: str) -> dict:
+        obj = self.objects[resource].pop((namespace, name))
+        self._record(resource, "DELETED", obj)
+        return obj
+
+    def compact(self) -> None:
+        """Forget the event history, so older watches get 410 Gone."""
+        self.events.clear()
+        self.oldest_version = self.version + 1
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.api_route("/{path:path}", methods=["GET", "POST", "PATCH", "DELETE"])
+        async def handle(path: str, request: Request):
+            self.requests.append((request.method, "/" + path))
+            parts = path.split("/")
+            resource = next(r for r in RESOURCES if r in parts)
+            rest = parts[parts.index(resource) + 1:]
+            namespace = parts[parts.index("namespaces") + 1] if "namespaces" in parts else None
+
+            if request.method == "GET" and not rest:
+                if request.query_params.get("watch"):
+                    return await self._watch(resource, request)
+                items = [
+                    o for (ns, _), o in self.objects[resource].items() if namespace in (None, ns)
+                ]
+                return {"items": items, "metadata": {"resourceVersion": str(self.version)}}
+
+            if request.method != "GET":
+                await asyncio.sleep(self.write_latency)
+
+            if request.method == "POST":
+                body = await request.json()
+                body["metadata"]["namespace"] = namespace
+                if (namespace, body["metadata"]["name"]) in self.objects[resource]:
+                    return JSONResponse({"message": "already exists"}, status_code=409)
+                obj = self.put(resource, body)
+                await self.notify()
+                return JSONResponse(obj, status_code=201)
+
+            key = (namespace, rest[0])
+            if key not in self.objects[resource]:
+                return JSONResponse({"message": f"{resource} {rest[0]} not found"}, status_code=404)
+            if request.method == "PATCH":
+                patch = await request.json()
+                expected = patch.get("metadata", {}).get("resourceVersion")
+                if expected is not None and expected != self.objects[resource][key]["metadata"]["resourceVersion"]:
+                    return JSONResponse({"message": "the object has been modified"}, status_code=409)
+                obj = self.modify(resource, *key, patch)
+            elif request.method == "DELETE":
+                obj = self.remove(resource, *key)
+            else:
+                return self.objects[resource][key]
+            await self.notify()
+            return obj
+
+        return app
+
+    async def _watch(self, resource: str, request: Request) -> Response:
+        since = int(request.query_params["resourceVersion"])
+        if since < self.oldest_version - 1:
+            gone = {"type": "ERROR", "object": {"kind": "Status", "code": 410, "message": "too old"}}
+            return Response(json.dumps(gone) + "\n", media_type="application/json")
+
+        timeout = float(request.query_params.get("timeoutSeconds", 1))
+
+        def pending():
+            return [e for v, r, e in self.events if v > since and r == resource]
+
+        try:
+            async with asyncio.timeout(timeout), self._changed:
+                await self._changed.wait_for(pending)
+        except TimeoutError:
+            pass
+        body = "".join(json.dumps(e) + "\n" for e in pending())
+        return Response(body, media_type="application/json")
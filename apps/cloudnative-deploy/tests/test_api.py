@@ -2,9 +2,14 @@
 Tests for CloudNative Deploy API.
 """
 
+import asyncio
+import json
+
 import pytest
 from httpx import AsyncClient, ASGITransport
-from app.main import app, deployments, services
+from app.kube import KubeError
+from app.main import app, backend, controller, manifest_cache, store, watch_hub
+from app.store import ConflictError
 
 
 @pytest.fixture
@@ -15,8 +20,10 @@ def anyio_backend():
 @pytest.fixture(autouse=True)
 def clear_state():
     """Clear state before each test."""
-    deployments.clear()
-    services.clear()
+    store.clear()
+    controller.clear()
+    watch_hub.clear()
+    manifest_cache.clear()
 
 
 @pytest.fixture
@@ -26,6 +33,14 @@ async def client():
         yield client
 
 
+def _settle():
+    """Run every queued rollout to completion without waiting."""
+    now = controller._clock()
+    while controller.pending:
+        now += controller.interval
+        controller.run_pending(now)
+
+
 @pytest.mark.anyio
 async def test_health_check(client: AsyncClient):
     """Test health endpoint."""
@@ -127,6 +142,53 @@ async def test_delete_deployment(client: AsyncClient):
     assert get_resp.status_code == 404
 
 
+@pytest.mark.anyio
+async def test_deployment_pods(client: AsyncClient):
+    """Test that pods keep their names across listings and are replaced by a rollout."""
+    create_resp = await client.post(
+        "/api/deployments",
+        json={"name": "pods-test", "image": "nginx:1.24", "replicas": 3}
+    )
+    dep_id = create_resp.json()["id"]
+    _settle()
+    
+    pods = (await client.get(f"/api/deployments/{dep_id}/pods")).json()
+    assert len(pods) == 3
+    assert all(p["status"] == "Running" and p["name"].startswith("pods-test-") for p in pods)
+    again = (await client.get(f"/api/deployments/{dep_id}/pods")).json()
+    assert [p["name"] for p in again] == [p["name"] for p in pods]
+    
+    await client.patch(f"/api/deployments/{dep_id}", json={"image": "nginx:1.25", "replicas": 2})
+    _settle()
+    updated = (await client.get(f"/api/deployments/{dep_id}/pods")).json()
+    assert len(updated) == 2
+    assert not {p["name"] for p in updated} & {p["name"] for p in pods}
+    assert {p["revision"] for p in updated} == {2}
+
+
+@pytest.mark.anyio
+async def test_new_pods_become_ready_on_next_step(client: AsyncClient):
+    """Test that a started pod is Pending until the controller's next step."""
+    dep_id = (await client.post(
+        "/api/deployments", json={"name": "ready-test", "image": "nginx:1.24", "replicas": 1}
+    )).json()["id"]
+    now = controller._clock()
+    controller.run_pending(now)  # schedules the first step
+    now += controller.interval
+    controller.run_pending(now)
+    
+    pods = (await client.get(f"/api/deployments/{dep_id}/pods")).json()
+    assert [(p["status"], p["ready"]) for p in pods] == [("Pending", False)]
+    dep = (await client.get(f"/api/deployments/{dep_id}")).json()
+    assert dep["ready_replicas"] == 0 and dep["status"] != "running"
+    
+    controller.run_pending(now + controller.interval)
+    pods = (await client.get(f"/api/deployments/{dep_id}/pods")).json()
+    assert [(p["status"], p["ready"]) for p in pods] == [("Running", True)]
+    dep = (await client.get(f"/api/deployments/{dep_id}")).json()
+    assert dep["ready_replicas"] == 1 and dep["status"] == "running"
+
+
 @pytest.mark.anyio
 async def test_get_deployment_manifest(client: AsyncClient):
     """Test getting deployment manifest."""
@@ -145,6 +207,51 @@ async def test_get_deployment_manifest(client: AsyncClient):
     assert manifest["spec"]["replicas"] == 2
 
 
+@pytest.mark.anyio
+async def test_manifest_etag(client: AsyncClient):
+    """Manifests carry an ETag, answer If-None-Match with 304 and follow updates."""
+    create_resp = await client.post(
+        "/api/deployments",
+        json={"name": "etag-test", "image": "nginx:1.24", "env": {"MODE": "prod"}}
+    )
+    dep_id = create_resp.json()["id"]
+    url = f"/api/deployments/{dep_id}/manifest"
+    
+    first = await client.get(url)
+    etag = first.headers["etag"]
+    cached = await client.get(url, headers={"If-None-Match": f'W/{etag}, "other"'})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    
+    yaml_resp = await client.get(url, headers={"Accept": "application/yaml"})
+    assert yaml_resp.headers["content-type"].startswith("application/yaml")
+    assert "image: nginx:1.24" in yaml_resp.text
+    assert yaml_resp.headers["etag"] != etag
+    
+    await client.patch(f"/api/deployments/{dep_id}", json={"image": "nginx:1.25", "env": {"MODE": "dev"}})
+    updated = await client.get(url, headers={"If-None-Match": etag})
+    assert updated.status_code == 200
+    container = updated.json()["spec"]["template"]["spec"]["containers"][0]
+    assert container["image"] == "nginx:1.25"
+    assert container["env"] == [{"name": "MODE", "value": "dev"}]
+
+
+@pytest.mark.anyio
+async def test_get_service_manifest(client: AsyncClient):
+    """Service manifests select their deployment's pods."""
+    dep_resp = await client.post("/api/deployments", json={"name": "svc-manifest", "image": "nginx"})
+    svc_resp = await client.post(
+        "/api/services",
+        json={"name": "svc-manifest", "deployment_id": dep_resp.json()["id"], "port": 80, "target_port": 8080}
+    )
+    svc_id = svc_resp.json()["id"]
+    
+    response = await client.get(f"/api/services/{svc_id}/manifest?format=yaml")
+    assert response.status_code == 200
+    assert "app: svc-manifest" in response.text
+    assert "targetPort: 8080" in response.text
+
+
 @pytest.mark.anyio
 async def test_create_service(client: AsyncClient):
     """Test creating a service."""
@@ -194,3 +301,395 @@ async def test_cluster_info(client: AsyncClient):
     info = response.json()
     assert "version" in info
     assert "nodes" in info
+
+
+@pytest.mark.anyio
+async def test_rollout_completes(client: AsyncClient, monkeypatch):
+    """Test that the controller brings a deployment to running."""
+    monkeypatch.setattr(controller, "interval", 0.01)
+    create_resp = await client.post(
+        "/api/deployments",
+        json={"name": "rolling", "image": "nginx:1.0", "replicas": 3}
+    )
+    dep_id = create_resp.json()["id"]
+    
+    for _ in range(100):
+        dep = (await client.get(f"/api/deployments/{dep_id}")).json()
+        if dep["status"] == "running":
+            break
+        await asyncio.sleep(0.01)
+    assert dep["status"] == "running"
+    assert dep["ready_replicas"] == dep["updated_replicas"] == 3
+    assert not controller.is_active(dep_id)
+
+
+@pytest.mark.anyio
+async def test_update_runs_single_rollout(client: AsyncClient):
+    """Test that changing image and replicas together starts one rollout."""
+    create_resp = await client.post(
+        "/api/deployments",
+        json={"name": "app", "image": "nginx:1.0"}
+    )
+    dep_id = create_resp.json()["id"]
+    
+    await client.patch(f"/api/deployments/{dep_id}", json={"image": "nginx:2.0", "replicas": 4})
+    await client.patch(f"/api/deployments/{dep_id}", json={"replicas": 5})
+    assert controller.pending == 1
+    
+    await client.delete(f"/api/deployments/{dep_id}")
+    controller.run_pending()
+    assert controller.pending == 0
+
+
+@pytest.mark.anyio
+async def test_update_with_resource_version(client: AsyncClient):
+    """Test that updates based on a stale resourceVersion are rejected."""
+    create_resp = await client.post(
+        "/api/deployments",
+        json={"name": "app", "image": "nginx:1.0"}
+    )
+    dep = create_resp.json()
+    
+    response = await client.patch(
+        f"/api/deployments/{dep['id']}",
+        json={"replicas": 3, "resource_version": dep["resource_version"]}
+    )
+    assert response.status_code == 200
+    version = response.json()["resource_version"]
+    
+    response = await client.patch(
+        f"/api/deployments/{dep['id']}",
+        json={"replicas": 4, "resource_version": dep["resource_version"]}
+    )
+    assert response.status_code == 409
+    assert (await client.get(f"/api/deployments/{dep['id']}")).json()["replicas"] == 3
+    
+    # Changing nothing writes nothing
+    response = await client.patch(f"/api/deployments/{dep['id']}", json={"replicas": 3})
+    assert response.json()["resource_version"] == version
+
+
+@pytest.mark.anyio
+async def test_update_service(client: AsyncClient):
+    """Test changing a service's type and ports."""
+    dep_resp = await client.post(
+        "/api/deployments",
+        json={"name": "web", "image": "nginx:latest"}
+    )
+    svc = (await client.post(
+        "/api/services",
+        json={"name": "web", "deployment_id": dep_resp.json()["id"], "port": 80, "target_port": 8080}
+    )).json()
+    
+    response = await client.patch(
+        f"/api/services/{svc['id']}",
+        json={"type": "LoadBalancer", "port": 443, "resource_version": svc["resource_version"]}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["type"], data["port"], data["target_port"]) == ("LoadBalancer", 443, 8080)
+    assert data["external_ip"] is not None
+    
+    response = await client.patch(
+        f"/api/services/{svc['id']}",
+        json={"port": 80, "resource_version": svc["resource_version"]}
+    )
+    assert response.status_code == 409
+    assert (await client.patch("/api/services/nonexistent", json={"port": 80})).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_namespace_and_service_indexes(client: AsyncClient):
+    """Test namespace listings, cascading service deletes and cluster counters."""
+    ids = {}
+    for name, namespace in [("web", "prod"), ("api", "prod"), ("web", "staging")]:
+        resp = await client.post(
+            "/api/deployments",
+            json={"name": name, "image": "nginx:latest", "namespace": namespace}
+        )
+        ids[name, namespace] = resp.json()["id"]
+    
+    prod = (await client.get("/api/deployments", params={"namespace": "prod"})).json()
+    assert [d["name"] for d in prod] == ["web", "api"]
+    assert (await client.get("/api/deployments", params={"namespace": "dev"})).json() == []
+    
+    dep_id = ids["web", "prod"]
+    for port in (80, 443):
+        await client.post(
+            "/api/services",
+            json={"name": f"web-{port}", "deployment_id": dep_id, "port": port, "target_port": 8080}
+        )
+    await client.post(
+        "/api/services",
+        json={"name": "api", "deployment_id": ids["api", "prod"], "port": 80, "target_port": 8080}
+    )
+    
+    _settle()
+    info = (await client.get("/api/cluster/info")).json()
+    assert info["pods_running"] == 3
+    assert info["services"] == 3
+    
+    await client.delete(f"/api/deployments/{dep_id}")
+    assert [s["name"] for s in (await client.get("/api/services")).json()] == ["api"]
+    prod = (await client.get("/api/deployments", params={"namespace": "prod"})).json()
+    assert [d["name"] for d in prod] == ["api"]
+    info = (await client.get("/api/cluster/info")).json()
+    assert info["pods_running"] == 2
+    assert info["services"] == 1
+
+
+@pytest.mark.anyio
+async def test_list_selectors_and_pages(client: AsyncClient):
+    """Test label and field selectors and continue-token paging."""
+    for i in range(5):
+        await client.post(
+            "/api/deployments",
+            json={
+                "name": f"app-{i}",
+                "image": "nginx:latest",
+                "labels": {"tier": "web" if i % 2 == 0 else "worker"},
+            }
+        )
+    
+    web = (await client.get("/api/deployments", params={"labelSelector": "tier=web"})).json()
+    assert [d["name"] for d in web] == ["app-0", "app-2", "app-4"]
+    assert web[0]["labels"] == {"app": "app-0", "tier": "web"}
+    others = (await client.get(
+        "/api/deployments", params={"labelSelector": "tier notin (web),app", "fieldSelector": "metadata.name!=app-1"}
+    )).json()
+    assert [d["name"] for d in others] == ["app-3"]
+    
+    names, token, pages = [], None, 0
+    while True:
+        params = {"limit": 2, **({"continue": token} if token else {})}
+        response = await client.get("/api/deployments", params=params)
+        names += [d["name"] for d in response.json()]
+        pages += 1
+        token = response.headers.get("x-continue")
+        if token is None:
+            break
+        assert int(response.headers["x-remaining-item-count"]) == 5 - len(names)
+    assert names == [f"app-{i}" for i in range(5)]
+    assert pages == 3
+    
+    for params in ({"labelSelector": "tier in (web"}, {"fieldSelector": "spec.image=nginx"}, {"continue": "bogus"}):
+        assert (await client.get("/api/deployments", params=params)).status_code == 400
+
+
+def _sse_events(body: str) -> list[dict]:
+    events = []
+    for block in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in block.splitlines() if not line.startswith(":"))
+        if fields:
+            events.append({"id": fields.get("id"), **json.loads(fields["data"])})
+    return events
+
+
+@pytest.mark.anyio
+async def test_watch_deployment(client: AsyncClient, monkeypatch):
+    """Test following a rollout through a watch stream."""
+    monkeypatch.setattr(controller, "interval", 0.01)
+    create_resp = await client.post(
+        "/api/deployments",
+        json={"name": "watched", "image": "nginx:latest", "replicas": 2}
+    )
+    dep = create_resp.json()
+    
+    response = await client.get(
+        f"/api/deployments/{dep['id']}",
+        params={"watch": "true", "timeoutSeconds": 1},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    
+    events = _sse_events(response.text)
+    assert events[0]["type"] == "ADDED"
+    assert events[1]["type"] == "BOOKMARK"
+    modified = events[2:]
+    assert modified and all(e["type"] == "MODIFIED" for e in modified)
+    assert modified[-1]["object"]["status"] == "running"
+    versions = [int(e["id"]) for e in modified]
+    assert versions == sorted(versions) and versions[0] > dep["resource_version"]
+
+
+@pytest.mark.anyio
+async def test_watch_resume(client: AsyncClient, monkeypatch):
+    """Test resuming a watch from a resource version."""
+    monkeypatch.setattr(controller, "interval", 60)
+    first = (await client.post("/api/deployments", json={"name": "a", "image": "nginx"})).json()
+    await client.post("/api/deployments", json={"name": "b", "image": "nginx", "namespace": "other"})
+    await client.delete(f"/api/deployments/{first['id']}")
+    
+    response = await client.get(
+        "/api/deployments",
+        params={"watch": "true", "resourceVersion": first["resource_version"], "timeoutSeconds": 1},
+    )
+    events = _sse_events(response.text)
+    assert [(e["type"], e["object"]["name"]) for e in events] == [("ADDED", "b"), ("DELETED", "a")]
+    
+    response = await client.get(
+        "/api/deployments",
+        params={"watch": "true", "namespace": "other", "timeoutSeconds": 1},
+        headers={"Last-Event-ID": str(first["resource_version"])},
+    )
+    assert [e["object"]["name"] for e in _sse_events(response.text)] == ["b"]
+
+
+RELEASE = """
+kind: Deployment
+name: web
+image: nginx:1.0
+replicas: 2
+---
+kind: Deployment
+name: worker
+image: worker:1.0
+---
+kind: Service
+name: web
+deployment: web
+port: 80
+target_port: 8080
+"""
+
+
+async def _apply(client: AsyncClient, body, mode: str = "transactional"):
+    if isinstance(body, str):
+        response = await client.post(
+            "/api/apply", params={"mode": mode}, content=body,
+            headers={"Content-Type": "application/yaml"},
+        )
+    else:
+        response = await client.post("/api/apply", params={"mode": mode}, json=body)
+    lines = [json.loads(line) for line in response.text.splitlines()] if response.status_code == 200 else []
+    return response, lines
+
+
+@pytest.mark.anyio
+async def test_apply_creates_then_updates(client: AsyncClient):
+    """Test applying a YAML release twice."""
+    response, results = await _apply(client, RELEASE)
+    assert response.status_code == 200
+    assert [(r["kind"], r["name"], r["action"]) for r in results] == [
+        ("Deployment", "web", "created"),
+        ("Deployment", "worker", "created"),
+        ("Service", "web", "created"),
+    ]
+    assert controller.pending == 2
+    services = (await client.get("/api/services")).json()
+    assert services[0]["deployment_id"] == results[0]["id"]
+    
+    response, results = await _apply(client, RELEASE.replace("worker:1.0", "worker:2.0"))
+    assert [r["action"] for r in results] == ["unchanged", "updated", "unchanged"]
+    worker = (await client.get(f"/api/deployments/{results[1]['id']}")).json()
+    assert worker["image"] == "worker:2.0"
+    assert worker["status"] == "updating"
+    assert len((await client.get("/api/deployments")).json()) == 2
+
+
+@pytest.mark.anyio
+async def test_apply_validates_whole_batch(client: AsyncClient):
+    """Test that one invalid item rejects a transactional batch."""
+    items = [
+        {"kind": "Deployment", "name": "ok", "image": "nginx"},
+        {"kind": "Deployment", "name": "bad", "image": "nginx", "replicas": 0},
+        {"kind": "Service", "name": "orphan", "deployment": "missing", "port": 80, "target_port": 80},
+    ]
+    response, _ = await _apply(client, items)
+    assert response.status_code == 422
+    assert [e["index"] for e in response.json()["detail"]] == [1, 2]
+    assert (await client.get("/api/deployments")).json() == []
+    
+    response, results = await _apply(client, items, mode="best-effort")
+    assert [(r["index"], r["action"]) for r in results] == [(0, "created"), (1, "failed"), (2, "failed")]
+    assert results[1]["name"] == "bad"
+    assert [d["name"] for d in (await client.get("/api/deployments")).json()] == ["ok"]
+    
+    response, _ = await _apply(client, "kind: [unclosed")
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_apply_rolls_back(client: AsyncClient, monkeypatch):
+    """Test that a failure mid-batch undoes a transactional apply."""
+    await _apply(client, RELEASE)
+    
+    async def fail(record):
+        raise KubeError(500, "apiserver unavailable")
+    
+    monkeypatch.setattr(backend, "create_service", fail)
+    release = RELEASE.replace("worker:1.0", "worker:2.0").replace("name: web\ndeployment", "name: api\ndeployment")
+    release += "---\nkind: Deployment\nname: extra\nimage: extra:1.0\n"
+    response, results = await _apply(client, release)
+    assert [(r["name"], r["action"]) for r in results] == [
+        ("web", "unchanged"),
+        ("worker", "updated"),
+        ("extra", "created"),
+        ("api", "failed"),
+        ("extra", "rolled_back"),
+        ("worker", "rolled_back"),
+    ]
+    deployments = (await client.get("/api/deployments")).json()
+    assert sorted((d["name"], d["image"]) for d in deployments) == [("web", "nginx:1.0"), ("worker", "worker:1.0")]
+
+
+@pytest.mark.anyio
+async def test_apply_leaves_other_changes_alone(client: AsyncClient, monkeypatch):
+    """Test that undo skips objects other requests changed meanwhile."""
+    _, results = await _apply(client, RELEASE)
+    worker_id = results[1]["id"]
+    
+    async def fail(record):
+        # Another request scales the worker while this apply is under way
+        store.update_deployment(worker_id, replicas=7)
+        raise KubeError(500, "apiserver unavailable")
+    
+    monkeypatch.setattr(backend, "create_service", fail)
+    release = RELEASE.replace("worker:1.0", "worker:2.0").replace("name: web\ndeployment", "name: api\ndeployment")
+    response, results = await _apply(client, release)
+    assert [(r["name"], r["action"]) for r in results][-2:] == [("api", "failed"), ("worker", "conflict")]
+    worker = (await client.get(f"/api/deployments/{worker_id}")).json()
+    assert (worker["image"], worker["replicas"]) == ("worker:2.0", 7)
+
+
+@pytest.mark.anyio
+async def test_apply_reports_conflicts_per_item(client: AsyncClient, monkeypatch):
+    """Test that a concurrent change to one item doesn't end the stream."""
+    await _apply(client, RELEASE)
+    
+    async def conflict(*args, **kwargs):
+        raise ConflictError("worker is at resourceVersion 9, not 8; read it again and retry")
+    
+    monkeypatch.setattr(backend, "update_deployment", conflict)
+    release = RELEASE.replace("worker:1.0", "worker:2.0") + "---\nkind: Deployment\nname: extra\nimage: extra:1.0\n"
+    response, results = await _apply(client, release, mode="best-effort")
+    assert response.status_code == 200
+    assert [(r["name"], r["action"]) for r in results] == [
+        ("web", "unchanged"), ("worker", "conflict"), ("extra", "created"), ("web", "unchanged"),
+    ]
+    assert "resourceVersion" in results[1]["error"]
+
+
+@pytest.mark.anyio
+async def test_apply_doesnt_hold_other_rollouts(client: AsyncClient, monkeypatch):
+    """Test that rollouts from other requests start while an apply is still streaming."""
+    release_service = asyncio.Event()
+    create_service = backend.create_service
+    
+    async def slow_create_service(record):
+        await release_service.wait()
+        return await create_service(record)
+    
+    monkeypatch.setattr(backend, "create_service", slow_create_service)
+    applying = asyncio.create_task(_apply(client, RELEASE))
+    while not store.find_deployment("default", "worker"):
+        await asyncio.sleep(0.01)
+    
+    response = await client.post("/api/deployments", json={"name": "other", "image": "nginx:1.0"})
+    assert controller.is_active(response.json()["id"])
+    assert not controller.is_active(store.find_deployment("default", "web")["id"])
+    
+    release_service.set()
+    await applying
+    assert controller.is_active(store.find_deployment("default", "web")["id"])
+    assert controller.pending == 3
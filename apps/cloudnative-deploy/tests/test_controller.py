@@ -0,0 +1,74 @@
+"""
+Tests for the rollout controller.
+"""
+
+from app.controller import RolloutController
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _controller(remaining: dict[str, int]):
+    """Controller whose objects need `remaining[id]` steps each."""
+    steps = []
+    
+    def step(object_id: str) -> bool:
+        steps.append(object_id)
+        remaining[object_id] -= 1
+        return remaining[object_id] > 0
+    
+    clock = FakeClock()
+    return RolloutController(step, interval=1.0, clock=clock), clock, steps
+
+
+def test_steps_once_per_interval():
+    """Test that each object advances one step per interval."""
+    controller, clock, steps = _controller({"a": 3, "b": 1})
+    controller.enqueue_many(["a", "b"])
+    
+    assert controller.run_pending() == 1.0
+    assert steps == []
+    
+    clock.now = 1.0
+    assert controller.run_pending() == 2.0
+    assert sorted(steps) == ["a", "b"]
+    
+    clock.now = 2.0
+    assert controller.run_pending() == 3.0
+    clock.now = 3.0
+    assert controller.run_pending() is None
+    assert steps[2:] == ["a", "a"]
+    assert controller.pending == 0
+
+
+def test_duplicates_share_one_rollout():
+    """Test that re-queueing an object doesn't start a second rollout."""
+    controller, clock, steps = _controller({"a": 2})
+    for _ in range(3):
+        controller.enqueue("a")
+        controller.run_pending()
+    assert len(controller._timers) == 1
+    
+    clock.now = 1.0
+    controller.enqueue("a")
+    controller.run_pending()
+    assert steps == ["a"]
+    assert controller.pending == 1
+
+
+def test_cancel():
+    """Test that cancelled objects are not stepped."""
+    controller, clock, steps = _controller({"a": 5, "b": 5})
+    controller.enqueue_many(["a", "b"])
+    controller.run_pending()
+    
+    controller.cancel("a")
+    clock.now = 1.0
+    controller.run_pending()
+    assert steps == ["b"]
+    assert not controller.is_active("a")
@@ -0,0 +1,194 @@
+"""
+Tests for the Kubernetes backend, against a fake API server.
+"""
+
+import asyncio
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+
+import app.main as main
+from app.kube import KubeClient, KubernetesBackend
+from app.store import ConflictError, ObjectStore
+from tests.fake_kube import FakeKubeAPI
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _deployment(name: str, replicas: int = 2, ready: int = 0) -> dict:
+    return {
+        "metadata": {"name": name, "labels": {"app": name}},
+        "spec": {
+            "replicas": replicas,
+            "template": {"spec": {"containers": [{"name": name, "image": "nginx:1.0"}]}},
+        },
+        "status": {"readyReplicas": ready, "updatedReplicas": ready},
+    }
+
+
+async def _eventually(predicate, timeout: float = 2.0):
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    assert predicate()
+
+
+@pytest.fixture
+async def cluster():
+    fake = FakeKubeAPI()
+    fake.put("deployments", _deployment("existing", replicas=2, ready=2))
+    client = KubeClient("http://kube", transport=ASGITransport(app=fake.app))
+    backend = KubernetesBackend(ObjectStore(), client, watch_timeout=0.2)
+    await backend.start()
+    yield fake, backend
+    await backend.stop()
+
+
+@pytest.mark.anyio
+async def test_informer_mirrors_cluster(cluster):
+    """Test the initial list and following changes through watches."""
+    fake, backend = cluster
+    store = backend.store
+    [dep] = store.deployments.values()
+    assert dep["name"] == "existing" and dep["status"] == "running"
+    
+    fake.put("deployments", _deployment("new", replicas=3))
+    fake.modify("deployments", "default", "existing", {"status": {"readyReplicas": 1}})
+    await fake.notify()
+    await _eventually(lambda: len(store.deployments) == 2 and dep["ready_replicas"] == 1)
+    assert dep["status"] == "scaling"
+    
+    fake.remove("deployments", "default", "existing")
+    await fake.notify()
+    await _eventually(lambda: dep["id"] not in store.deployments)
+
+
+@pytest.mark.anyio
+async def test_relist_after_expired_watch(cluster):
+    """Test that a 410 Gone watch falls back to a fresh list."""
+    fake, backend = cluster
+    store = backend.store
+    
+    fake.remove("deployments", "default", "existing")
+    fake.put("deployments", _deployment("replacement"))
+    fake.compact()
+    
+    await _eventually(lambda: [d["name"] for d in store.deployments.values()] == ["replacement"])
+    assert ("GET", "/apis/apps/v1/deployments") in fake.requests[1:]
+
+
+@pytest.mark.anyio
+async def test_endpoints_use_cluster(cluster, monkeypatch):
+    """Test that writes reach the API server and reads are served from the cache."""
+    fake, backend = cluster
+    monkeypatch.setattr(main, "backend", backend)
+    monkeypatch.setattr(main, "store", backend.store)
+    monkeypatch.setattr(main, "deployments", backend.store.deployments)
+    monkeypatch.setattr(main, "services", backend.store.services)
+    
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+        response = await client.post(
+            "/api/deployments", json={"name": "web", "image": "nginx:1.0", "replicas": 2}
+        )
+        assert response.status_code == 201
+        dep_id = response.json()["id"]
+        assert ("default", "web") in fake.objects["deployments"]
+        
+        response = await client.patch(f"/api/deployments/{dep_id}", json={"image": "nginx:2.0"})
+        container = fake.objects["deployments"]["default", "web"]["spec"]["template"]["spec"]["containers"][0]
+        assert container["image"] == "nginx:2.0"
+        assert container["resources"]["limits"]["cpu"] == "500m"
+        
+        response = await client.post(
+            "/api/services",
+            json={"name": "web", "deployment_id": dep_id, "port": 80, "target_port": 8080},
+        )
+        assert response.json()["deployment_id"] == dep_id
+        
+        writes = len(fake.requests)
+        for path in ("/api/deployments", f"/api/deployments/{dep_id}", "/api/services", "/api/cluster/info"):
+            assert (await client.get(path)).status_code == 200
+        assert [r for r in fake.requests[writes:] if "watch" not in r[1]] == []
+        assert all(method == "GET" for method, _ in fake.requests[writes:])
+        
+        response = await client.delete(f"/api/deployments/{dep_id}")
+        assert response.status_code == 200
+        assert fake.objects["deployments"].keys() == {("default", "existing")}
+        assert fake.objects["services"] == {}
+        
+        response = await client.post(
+            "/api/deployments", json={"name": "existing", "image": "nginx:1.0"}
+        )
+        assert response.status_code == 409
+
+
+@pytest.mark.anyio
+async def test_concurrent_updates_coalesce(cluster):
+    """Test that a burst of updates to one deployment becomes at most two patches."""
+    fake, backend = cluster
+    [dep] = backend.store.deployments.values()
+    version = dep["resource_version"]
+    fake.write_latency = 0.05
+    writes = len(fake.requests)
+    
+    await asyncio.gather(*(
+        backend.update_deployment(dep["id"], updated_at="now", replicas=replicas) for replicas in range(3, 8)
+    ))
+    patches = [r for r in fake.requests[writes:] if r[0] == "PATCH"]
+    assert len(patches) == 2  # the first change, then the rest merged
+    assert fake.objects["deployments"]["default", "existing"]["spec"]["replicas"] == 7
+    assert dep["replicas"] == 7
+    
+    with pytest.raises(ConflictError):
+        await backend.update_deployment(dep["id"], updated_at="now", replicas=2, expected_version=version)
+    assert not backend._patching and not backend._queued
+
+
+@pytest.mark.anyio
+async def test_patches_replace_lists(cluster, monkeypatch):
+    """Test that changed ports and removed env vars don't linger on the cluster."""
+    fake, backend = cluster
+    monkeypatch.setattr(main, "backend", backend)
+    monkeypatch.setattr(main, "store", backend.store)
+    monkeypatch.setattr(main, "deployments", backend.store.deployments)
+    monkeypatch.setattr(main, "services", backend.store.services)
+    
+    async with AsyncClient(transport=ASGITransport(app=main.app), base_url="http://test") as client:
+        response = await client.post(
+            "/api/deployments", json={"name": "web", "image": "nginx:1.0", "env": {"A": "1", "B": "2"}}
+        )
+        dep_id = response.json()["id"]
+        await client.patch(f"/api/deployments/{dep_id}", json={"env": {"A": "1"}})
+        container = fake.objects["deployments"]["default", "web"]["spec"]["template"]["spec"]["containers"][0]
+        assert container["env"] == [{"name": "A", "value": "1"}]
+        assert container["image"] == "nginx:1.0"
+        
+        response = await client.post(
+            "/api/services",
+            json={"name": "web", "deployment_id": dep_id, "port": 80, "target_port": 8080},
+        )
+        response = await client.patch(f"/api/services/{response.json()['id']}", json={"port": 443})
+        assert response.status_code == 200
+        assert fake.objects["services"]["default", "web"]["spec"]["ports"] == [{"port": 443, "targetPort": 8080}]
+
+
+@pytest.mark.anyio
+async def test_conditional_patch_checks_cluster_version(cluster):
+    """Test that a change the watch hasn't delivered yet still fails a conditional update."""
+    fake, backend = cluster
+    [dep] = backend.store.deployments.values()
+    
+    fake.modify("deployments", "default", "existing", {"spec": {"replicas": 4}})  # another client
+    with pytest.raises(ConflictError):
+        await backend.update_deployment(
+            dep["id"], updated_at="now", replicas=3, expected_version=dep["resource_version"]
+        )
+    assert fake.objects["deployments"]["default", "existing"]["spec"]["replicas"] == 4
+    assert not backend._patching and not backend._queued
+    
+    await backend.update_deployment(dep["id"], updated_at="now", replicas=3)
+    assert fake.objects["deployments"]["default", "existing"]["spec"]["replicas"] == 3
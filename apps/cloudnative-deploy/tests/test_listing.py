@@ -0,0 +1,75 @@
+"""
+Tests for selectors and paging.
+"""
+
+import pytest
+
+from app.listing import Requirement, decode_continue, encode_continue, parse_label_selector
+from app.store import ObjectStore, list_key
+
+
+def _deployment(i: int, **labels) -> dict:
+    return {
+        "id": f"dep-{i}",
+        "name": f"app-{i}",
+        "namespace": "prod" if i % 2 else "default",
+        "labels": labels,
+        "status": "running",
+        "ready_replicas": 0,
+        "created_at": f"2024-01-01T00:00:{i:02d}",
+    }
+
+
+def test_parse_label_selector():
+    """Test the equality, set and existence forms."""
+    assert parse_label_selector("a=1, b!=2,c in (x, y),!d,e") == [
+        Requirement("a", "=", frozenset(["1"])),
+        Requirement("b", "!=", frozenset(["2"])),
+        Requirement("c", "in", frozenset(["x", "y"])),
+        Requirement("d", "!exists"),
+        Requirement("e", "exists"),
+    ]
+    for bad in ("a in (1", "!a in (1)", "a b"):
+        with pytest.raises(ValueError):
+            parse_label_selector(bad)
+
+
+def test_select_follows_updates():
+    """Test that the indexes follow label changes and removals."""
+    store = ObjectStore()
+    for i in range(6):
+        store.add_deployment(_deployment(i, tier="web" if i < 3 else "db"))
+    
+    web = parse_label_selector("tier=web")
+    assert store.select("Deployment", web) == {"dep-0", "dep-1", "dep-2"}
+    
+    store.update_deployment("dep-1", labels={"tier": "db", "canary": "true"})
+    store.remove_deployment("dep-2")
+    assert store.select("Deployment", web) == {"dep-0"}
+    assert store.select("Deployment", parse_label_selector("!canary,tier=db")) == {"dep-3", "dep-4", "dep-5"}
+    prod = [Requirement("metadata.namespace", "=", frozenset(["prod"]))]
+    assert store.select("Deployment", parse_label_selector("tier!=web"), prod) == {"dep-1", "dep-3", "dep-5"}
+
+
+def test_pages_are_stable():
+    """Test that paging continues after the last key, even as objects come and go."""
+    store = ObjectStore()
+    for i in range(10):
+        store.add_deployment(_deployment(i))
+    
+    page, remaining = store.page("Deployment", limit=4)
+    assert [d["id"] for d in page] == ["dep-0", "dep-1", "dep-2", "dep-3"]
+    assert remaining == 6
+    
+    token = encode_continue(store.resource_version, list_key(page[-1]))
+    store.remove_deployment("dep-4")
+    store.add_deployment(_deployment(10))
+    _, after = decode_continue(token)
+    page, remaining = store.page("Deployment", after=after, limit=4)
+    assert [d["id"] for d in page] == ["dep-5", "dep-6", "dep-7", "dep-8"]
+    assert remaining == 2
+    
+    odd = store.select("Deployment", fields=[Requirement("metadata.namespace", "=", frozenset(["prod"]))])
+    page, remaining = store.page("Deployment", odd, after=after)
+    assert [d["id"] for d in page] == ["dep-5", "dep-7", "dep-9"]
+    assert remaining == 0
@@ -0,0 +1,33 @@
+"""
+Tests for the manifest cache.
+"""
+
+from app.manifests import ManifestCache
+
+
+def _service(i: int, version: int = 1) -> dict:
+    return {
+        "id": f"svc-{i}",
+        "name": f"svc-{i}",
+        "namespace": "default",
+        "labels": {},
+        "type": "ClusterIP",
+        "selector": {"app": f"app-{i}"},
+        "port": 80,
+        "target_port": 8080,
+        "resource_version": version,
+    }
+
+
+def test_new_versions_count_as_recent():
+    """Test that re-rendering an object for a new version moves it to the back of the LRU."""
+    cache = ManifestCache(max_entries=2)
+    cache.get(_service(0), "Service")
+    cache.get(_service(1), "Service")
+    
+    # svc-0 changes and is read again, so svc-1 is now the least recent
+    body, etag = cache.get(_service(0, version=2), "Service")
+    cache.get(_service(2), "Service")
+    
+    assert list(cache._entries) == ["svc-0", "svc-2"]
+    assert cache.get(_service(0, version=2), "Service") == (body, etag)
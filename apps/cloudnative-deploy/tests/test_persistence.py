@@ -0,0 +1,175 @@
+"""
+Tests for the write-ahead log and snapshots.
+"""
+
+import asyncio
+
+import pytest
+
+from app.backend import LocalBackend
+from app.controller import RolloutController
+from app.persistence import SNAPSHOT_FILE, CorruptStateError, LogWriteError, StateLog
+from app.store import ObjectStore
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _deployment(i: int, status: str = "running") -> dict:
+    return {
+        "id": f"dep-{i}",
+        "name": f"app-{i}",
+        "namespace": "default",
+        "labels": {"app": f"app-{i}"},
+        "image": "nginx:1.0",
+        "replicas": 1,
+        "status": status,
+        "ready_replicas": 0,
+        "updated_replicas": 0,
+        "created_at": f"2024-01-01T00:00:{i:02d}",
+    }
+
+
+def _service(i: int, deployment_id: str) -> dict:
+    return {
+        "id": f"svc-{i}",
+        "name": f"svc-{i}",
+        "deployment_id": deployment_id,
+        "namespace": "default",
+        "labels": {},
+        "type": "ClusterIP",
+        "created_at": f"2024-01-01T00:01:{i:02d}",
+    }
+
+
+def _state(store: ObjectStore) -> tuple:
+    return (
+        store.deployments,
+        store.services,
+        {i: pods.dump() for i, pods in store.pods.items()},
+        store.resource_version,
+        store.pods_running,
+    )
+
+
+def _write_changes(store: ObjectStore) -> None:
+    for i in range(4):
+        store.add_deployment(_deployment(i))
+        store.pods[f"dep-{i}"].add(1000.0 + i)
+        store.update_deployment(f"dep-{i}", ready_replicas=1)  # as a rollout step would
+    store.add_service(_service(0, "dep-0"))
+    store.add_service(_service(1, "dep-1"))
+    store.pods["dep-2"].revise()
+    store.update_deployment("dep-2", image="nginx:2.0", status="updating", updated_replicas=0)
+    store.remove_deployment("dep-1")
+
+
+@pytest.mark.anyio
+async def test_recover_from_log(tmp_path):
+    """Test that replaying the log rebuilds objects, pods and versions."""
+    store = ObjectStore()
+    log = StateLog(str(tmp_path), store)
+    assert log.recover() == 0
+    log.start()
+    _write_changes(store)
+    await log.commit()
+    expected = _state(store)
+
+    # A crash: no snapshot, and half of an entry at the end of the log
+    with open(log._segment.name, "ab") as f:
+        f.write(b'0badc0de {"rv": 99, "type": "ADD')
+    log._closing = True
+    log._wake.set()
+    await log._task
+
+    recovered = ObjectStore()
+    assert StateLog(str(tmp_path), recovered).recover() == 13
+    assert _state(recovered) == expected
+    assert [s["id"] for s in recovered.services_of("dep-0")] == ["svc-0"]
+
+
+@pytest.mark.anyio
+async def test_snapshot_covers_log(tmp_path):
+    """Test that snapshots replace the log they cover and recovery combines both."""
+    store = ObjectStore()
+    log = StateLog(str(tmp_path), store, snapshot_every=5)
+    log.recover()
+    log.start()
+    _write_changes(store)
+    await log.commit()
+    await log.snapshot()
+    store.update_deployment("dep-3", replicas=3, status="scaling")
+    await log.commit()
+    expected = _state(store)
+
+    assert len(list(tmp_path.glob("wal-*.log"))) == 1
+    recovered = ObjectStore()
+    assert StateLog(str(tmp_path), recovered).recover() == 1
+    assert _state(recovered) == expected
+
+    await log.close()
+    recovered = ObjectStore()
+    assert StateLog(str(tmp_path), recovered).recover() == 0
+    assert _state(recovered) == expected
+
+
+@pytest.mark.anyio
+async def test_failed_write_fails_commits(tmp_path):
+    """Test that a failed fsync stops the log and fails waiting commits instead of hanging them."""
+    store = ObjectStore()
+    log = StateLog(str(tmp_path), store)
+    log.recover()
+    log.start()
+    store.add_deployment(_deployment(0))
+    await log.commit()
+
+    def fail(segment, data):
+        raise OSError(5, "Input/output error")
+
+    log._write = fail
+    store.add_deployment(_deployment(1))
+    with pytest.raises(LogWriteError):
+        await asyncio.wait_for(log.commit(), timeout=1)
+    assert log._task.done()
+    store.add_deployment(_deployment(2))
+    with pytest.raises(LogWriteError):
+        await log.commit()
+    await log.close()
+
+    recovered = ObjectStore()
+    StateLog(str(tmp_path), recovered).recover()
+    assert list(recovered.deployments) == ["dep-0"]
+
+
+@pytest.mark.anyio
+async def test_corrupt_snapshot_refuses_to_load(tmp_path):
+    """Test that a damaged snapshot line stops recovery rather than dropping the object."""
+    store = ObjectStore()
+    log = StateLog(str(tmp_path), store)
+    log.recover()
+    log.start()
+    _write_changes(store)
+    await log.close()
+
+    snapshot = tmp_path / SNAPSHOT_FILE
+    lines = snapshot.read_bytes().splitlines(keepends=True)
+    lines[2] = lines[2].replace(b"nginx", b"NGINX")
+    snapshot.write_bytes(b"".join(lines))
+    with pytest.raises(CorruptStateError, match="line 3"):
+        StateLog(str(tmp_path), ObjectStore()).recover()
+
+
+@pytest.mark.anyio
+async def test_unfinished_rollouts_resume():
+    """Test that recovered deployments still rolling out are put back in the queue."""
+    store = ObjectStore()
+    store.add_deployment(_deployment(0))
+    store.add_deployment(_deployment(1, status="updating"))
+    controller = RolloutController(lambda object_id: False)
+
+    await LocalBackend(store, controller).start()
+    assert controller.pending == 1
+    assert controller.is_active("dep-1")
+    await controller.stop()
@@ -0,0 +1,46 @@
+"""
+Tests for pod tables.
+"""
+
+from app.pods import PodTable, format_age
+
+
+def test_format_age():
+    """Test kubectl-style ages."""
+    assert [format_age(s) for s in (-1, 59, 60, 7199, 86400 * 3 + 5)] == ["0s", "59s", "1m", "1h", "3d"]
+
+
+def test_revisions():
+    """Test that a new revision outdates every pod, oldest first."""
+    pods = PodTable()
+    for now in (100.0, 200.0):
+        pods.add(now)
+    assert pods.updated == 2 and pods.outdated() is None
+    
+    pods.revise()
+    assert pods.updated == 0 and pods.outdated() == 0
+    pods.remove(0)
+    pods.add(300.0)
+    assert pods.updated == 1 and pods.outdated() == 0
+    
+    rows = pods.rows("web", now=400.0)
+    assert [(r["age"], r["revision"]) for r in rows] == [("3m", 1), ("1m", 2)]
+    assert rows[0]["name"].split("-")[1] != rows[1]["name"].split("-")[1]  # per-revision hash
+    assert rows == pods.rows("web", now=400.0)
+
+
+def test_new_pods_start_pending():
+    """Test that a pod is Pending until marked ready, and readiness survives a dump."""
+    pods = PodTable()
+    pods.add(100.0)
+    pods.mark_ready()
+    pods.add(200.0)
+    assert pods.ready == 1
+    assert [(r["status"], r["ready"]) for r in pods.rows("web", now=300.0)] == [
+        ("Running", True), ("Pending", False)
+    ]
+    
+    restored = PodTable.load(pods.dump())
+    assert restored.rows("web", now=300.0) == pods.rows("web", now=300.0)
+    pods.mark_ready()
+    assert pods.ready == 2 and {r["status"] for r in pods.rows("web", now=300.0)} == {"Running"}
@@ -0,0 +1,69 @@
+"""
+Tests for watch streams.
+"""
+
+import asyncio
+
+import pytest
+
+from app.watch import ExpiredError, WatchHub
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _publish(hub: WatchHub, versions: range, kind: str = "Deployment"):
+    for rv in versions:
+        hub.publish("MODIFIED", kind, {"id": f"obj-{rv % 2}", "namespace": "default"}, rv)
+
+
+@pytest.mark.anyio
+async def test_resume_from_history():
+    """Test that a watcher resuming from a version gets what it missed."""
+    hub = WatchHub(history=10)
+    _publish(hub, range(1, 6))
+    
+    watcher = hub.subscribe("Deployment", since=2, object_id="obj-1")
+    versions = [watcher.queue.get_nowait().resource_version for _ in range(watcher.queue.qsize())]
+    assert versions == [3, 5]
+    
+    _publish(hub, range(6, 8))
+    assert watcher.queue.get_nowait().resource_version == 7
+
+
+@pytest.mark.anyio
+async def test_expired_version():
+    """Test that versions evicted from the ring buffer are refused."""
+    hub = WatchHub(history=3)
+    _publish(hub, range(1, 8))
+    
+    with pytest.raises(ExpiredError):
+        hub.subscribe("Deployment", since=2)
+    assert hub.subscribe("Deployment", since=4).queue.qsize() == 3
+
+
+@pytest.mark.anyio
+async def test_slow_watcher_is_cut_off():
+    """Test that a watcher falling behind gets an ERROR and frees its slot."""
+    hub = WatchHub(queue_size=2)
+    watcher = hub.subscribe("Deployment")
+    _publish(hub, range(1, 5))
+    assert hub.watchers == 0
+    
+    messages = [m async for m in hub.stream(watcher, timeout=1)]
+    assert [m.split("\n")[0] for m in messages] == ["id: 1", "id: 2", "event: ERROR"]
+    assert "resume from resourceVersion 2" in messages[-1]
+
+
+@pytest.mark.anyio
+async def test_stream_unsubscribes_on_close():
+    """Test that closing a stream early removes its watcher."""
+    hub = WatchHub()
+    watcher = hub.subscribe("Service")
+    stream = hub.stream(watcher, heartbeat=0.01)
+    
+    assert await asyncio.wait_for(stream.__anext__(), 1) == ": keep-alive\n\n"
+    await stream.aclose()
+    assert hub.watchers == 0
@@ -5,15 +5,47 @@ A FastAPI-based RAG (Retrieval-Augmented Generation) system for
 answering questions about uploaded documents.
 """
 
-from fastapi import FastAPI, HTTPException, UploadFile, File, Depends
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Depends, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Literal, Optional
+from contextlib import asynccontextmanager
+from functools import partial
+import json
+import os
 import uuid
 from datetime import datetime
 
-from app.services.document import DocumentService
+from app.services.document import (
+    DocumentService,
+    SUPPORTED_EXTENSIONS,
+    is_archive,
+    iter_archive,
+)
 from app.services.rag import RAGService
+from app.services.ratelimit import (
+    DEFAULT_SLOTS,
+    FairQueue,
+    LocalBuckets,
+    RateLimiter,
+    RateLimitMiddleware,
+    SharedBuckets,
+    client_key,
+    parse_limits,
+    parse_weights,
+)
+from app.services.session import SessionStore
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Documents uploaded before a restart come back from the blob manifest
+    # and are rebuilt from their originals in the background
+    if document_service.restore():
+        document_service.start_reindex()
+    yield
+
 
 app = FastAPI(
     title="DocuMind AI",
@@ -36,15 +68,32 @@ Upload documents, ask questions, and get instant **cited answers** powered by RA
     version="0.1.0",
     docs_url="/docs",
     redoc_url="/redoc",
+    lifespan=lifespan,
     openapi_tags=[
         {"name": "Health", "description": "API health check"},
         {"name": "Documents", "description": "Document upload and management"},
         {"name": "Q&A", "description": "Ask questions about your documents"},
+        {"name": "Sessions", "description": "Multi-turn conversations"},
+        {"name": "Maintenance", "description": "Rebuild derived data"},
         {"name": "Collections", "description": "Organize documents into groups"},
     ],
 )
 
-# CORS middleware
+# Per-client rate limits; DOCUMIND_RATE_LIMIT_STATE shares buckets across workers
+rate_limit_state = os.getenv("DOCUMIND_RATE_LIMIT_STATE")
+rate_limiter = RateLimiter(
+    limits=parse_limits(os.getenv("DOCUMIND_RATE_LIMITS", "")),
+    buckets=SharedBuckets(rate_limit_state) if rate_limit_state else LocalBuckets(),
+)
+client_weights = parse_weights(os.getenv("DOCUMIND_CLIENT_WEIGHTS", ""))
+app.add_middleware(
+    RateLimitMiddleware,
+    limiter=rate_limiter,
+    queues={budget: FairQueue(slots, client_weights) for budget, slots in DEFAULT_SLOTS.items()},
+)
+
+# CORS middleware, added last so it wraps the limiter: 429s carry CORS
+# headers and preflight requests are answered without using up tokens
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -61,7 +110,8 @@ app.add_middleware(
 
 # Services (would use dependency injection in production)
 document_service = DocumentService()
-rag_service = RAGService()
+rag_service = RAGService(document_service=document_service)
+session_store = SessionStore()
 
 
 # Pydantic models
@@ -79,10 +129,23 @@ class DocumentUploadResponse(BaseModel):
     message: str
 
 
+class DocumentFilters(BaseModel):
+    filename: Optional[str] = None
+    extension: Optional[str] = None
+    status: Optional[Literal["processing", "processed", "failed"]] = None
+    uploaded_after: Optional[str] = None
+    uploaded_before: Optional[str] = None
+
+
 class QuestionRequest(BaseModel):
     question: str = Field(..., min_length=3, max_length=1000)
     document_id: Optional[str] = None
     collection_id: Optional[str] = None
+    document_ids: Optional[list[str]] = Field(default=None, max_length=64)
+    collection_ids: Optional[list[str]] = Field(default=None, max_length=64)
+    filters: Optional[DocumentFilters] = None
+    mode: Literal["auto", "llm", "extractive"] = "auto"
+    timeout_ms: Optional[int] = Field(default=None, ge=1, le=120_000)
 
 
 class AnswerResponse(BaseModel):
@@ -90,6 +153,8 @@ class AnswerResponse(BaseModel):
     sources: list[dict]
     confidence: float
     document_id: Optional[str]
+    mode: Optional[str] = None
+    scopes: Optional[list[dict]] = None
 
 
 class DocumentInfo(BaseModel):
@@ -98,6 +163,7 @@ class DocumentInfo(BaseModel):
     pages: int
     uploaded_at: str
     status: str
+    pages_indexed: Optional[int] = None
 
 
 # Routes
@@ -121,13 +187,12 @@ async def upload_document(file: UploadFile = File(...)):
     if not file.filename:
         raise HTTPException(status_code=400, detail="No file provided")
     
-    allowed_extensions = {".pdf", ".docx", ".txt", ".md"}
     extension = "." + file.filename.split(".")[-1].lower() if "." in file.filename else ""
     
-    if extension not in allowed_extensions:
+    if extension not in SUPPORTED_EXTENSIONS:
         raise HTTPException(
             status_code=400, 
-            detail=f"Unsupported file type. Allowed: {', '.join(allowed_extensions)}"
+            detail=f"Unsupported file type. Allowed: {', '.join(SUPPORTED_EXTENSIONS)}"
         )
     
     try:
@@ -137,10 +202,63 @@ async def upload_document(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/documents/bulk", tags=["Documents"])
+async def bulk_upload_documents(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    collection_id: Optional[str] = Form(None),
+):
+    """
+    Upload many documents at once.
+    
+    Accepts several files, or a single ZIP/TAR archive whose members are
+    streamed out one by one. Files are extracted in parallel and results
+    are streamed back as NDJSON, one line per file, in completion order.
+    Every file costs an upload token, like a single upload; the request
+    stops at the file the client's budget can't cover.
+    """
+    if collection_id and collection_id not in document_service._collections:
+        raise HTTPException(status_code=404, detail="Collection not found")
+    
+    if len(files) == 1 and files[0].filename and is_archive(files[0].filename):
+        source = iter_archive(files[0].file, files[0].filename)
+    else:
+        source = ((f.filename or "unknown", f.file.read()) for f in files)
+    
+    # The rate limiter charged the request itself, which covers the first file
+    admit = partial(rate_limiter.admit, client_key(request.scope), "upload")
+    
+    async def results():
+        try:
+            async for result in document_service.ingest_many(source, collection_id, admit):
+                yield json.dumps(result) + "\n"
+        except ValueError as e:
+            # Corrupt archives surface mid-stream, after the 200 is sent
+            yield json.dumps({"status": "failed", "message": str(e)}) + "\n"
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
 @app.get("/api/documents", response_model=list[DocumentInfo], tags=["Documents"])
-async def list_documents():
-    """List all uploaded documents."""
-    return document_service.list_documents()
+async def list_documents(
+    filename: Optional[str] = None,
+    extension: Optional[str] = None,
+    status: Optional[Literal["processing", "processed", "failed"]] = None,
+    collection_id: Optional[str] = None,
+    uploaded_after: Optional[str] = Query(None, description="ISO timestamp, inclusive"),
+    uploaded_before: Optional[str] = Query(None, description="ISO timestamp, exclusive"),
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+):
+    """List uploaded documents, oldest first, optionally filtered."""
+    return document_service.list_documents(
+        filename=filename,
+        extension=extension,
+        status=status,
+        collection_id=collection_id,
+        uploaded_after=uploaded_after,
+        uploaded_before=uploaded_before,
+        limit=limit,
+    )
 
 
 @app.get("/api/documents/{document_id}", response_model=DocumentInfo, tags=["Documents"])
@@ -168,12 +286,20 @@ async def ask_question(request: QuestionRequest):
     
     Uses RAG (Retrieval-Augmented Generation) to find relevant 
     context and generate accurate, cited answers.
+    
+    `document_ids` / `collection_ids` search several scopes at once,
+    concurrently; the response then reports each scope's timing.
     """
     try:
         result = await rag_service.answer_question(
             question=request.question,
             document_id=request.document_id,
             collection_id=request.collection_id,
+            mode=request.mode,
+            timeout=request.timeout_ms / 1000 if request.timeout_ms else None,
+            document_ids=request.document_ids,
+            collection_ids=request.collection_ids,
+            filters=request.filters.model_dump(exclude_none=True) if request.filters else None,
         )
         return AnswerResponse(**result)
     except ValueError as e:
@@ -182,6 +308,127 @@ async def ask_question(request: QuestionRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Session endpoints
+class SessionCreate(BaseModel):
+    document_id: Optional[str] = None
+    collection_id: Optional[str] = None
+
+
+class SessionQuestion(BaseModel):
+    question: str = Field(..., min_length=1, max_length=1000)
+    mode: Literal["auto", "llm", "extractive"] = "auto"
+    timeout_ms: Optional[int] = Field(default=None, ge=1, le=120_000)
+
+
+class SessionAnswer(AnswerResponse):
+    session_id: str
+    rewritten_question: str
+    retrieval: str
+
+
+class SessionInfo(BaseModel):
+    id: str
+    document_id: Optional[str]
+    collection_id: Optional[str]
+    created_at: str
+    turns: list[dict]
+    cached_chunks: int
+
+
+@app.post("/api/sessions", response_model=SessionInfo, tags=["Sessions"])
+async def create_session(data: SessionCreate):
+    """
+    Start a conversation, optionally scoped to a document or collection.
+    
+    Sessions expire after 30 minutes without a question.
+    """
+    if data.document_id and not document_service.get_document(data.document_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    if data.collection_id and data.collection_id not in document_service._collections:
+        raise HTTPException(status_code=404, detail="Collection not found")
+    return session_store.create(data.document_id, data.collection_id).to_dict()
+
+
+@app.get("/api/sessions/{session_id}", response_model=SessionInfo, tags=["Sessions"])
+async def get_session(session_id: str):
+    """Get a conversation and its turns so far."""
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return session.to_dict()
+
+
+@app.delete("/api/sessions/{session_id}", tags=["Sessions"])
+async def delete_session(session_id: str):
+    """End a conversation."""
+    if not session_store.delete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"message": "Session deleted successfully"}
+
+
+@app.post("/api/sessions/{session_id}/ask", response_model=SessionAnswer, tags=["Sessions"])
+async def ask_in_session(session_id: str, request: SessionQuestion):
+    """
+    Ask the next question of a conversation.
+    
+    Follow-ups ("and what about section 4?") are rewritten against the
+    previous question, and chunks retrieved by earlier turns are reused
+    unless the question needs new material.
+    """
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    try:
+        result = await rag_service.answer_in_session(
+            session,
+            request.question,
+            mode=request.mode,
+            timeout=request.timeout_ms / 1000 if request.timeout_ms else None,
+        )
+        return SessionAnswer(**result)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Maintenance endpoints
+class ReindexRequest(BaseModel):
+    chunk_size: Optional[int] = Field(default=None, ge=100, le=20_000)
+    chunk_overlap: Optional[int] = Field(default=None, ge=0)
+    concurrency: Optional[int] = Field(default=None, ge=1, le=64)
+    pause_ms: int = Field(default=0, ge=0, le=10_000)
+
+
+@app.post("/api/maintenance/reindex", status_code=202, tags=["Maintenance"])
+async def start_reindex(data: ReindexRequest):
+    """
+    Rebuild all chunks, embeddings and indexes from the stored originals.
+    
+    Runs in the background; the live index keeps serving until the
+    rebuilt one is swapped in. Poll `GET /api/maintenance/reindex`.
+    """
+    chunk_size = data.chunk_size or document_service.chunk_size
+    chunk_overlap = document_service.chunk_overlap if data.chunk_overlap is None else data.chunk_overlap
+    if chunk_overlap >= chunk_size:
+        raise HTTPException(status_code=400, detail="chunk_overlap must be smaller than chunk_size")
+    try:
+        return document_service.start_reindex(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            concurrency=data.concurrency,
+            pause=data.pause_ms / 1000,
+        )
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.get("/api/maintenance/reindex", tags=["Maintenance"])
+async def get_reindex_status():
+    """Progress of the current or last re-index."""
+    return document_service.reindex_status
+
+
 # Collections endpoints
 class CollectionCreate(BaseModel):
     name: str = Field(..., min_length=1, max_length=100)
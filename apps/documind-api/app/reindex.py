@@ -0,0 +1,73 @@
+"""
+Re-index maintenance command.
+
+Asks a running DocuMind API to rebuild all derived data from the stored
+originals (see `DocumentService.reindex`) and follows its progress.
+
+Usage:
+    python -m app.reindex [--url http://localhost:8000] [--chunk-size 800]
+        [--chunk-overlap 150] [--concurrency 2] [--pause-ms 10]
+"""
+
+import argparse
+import json
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Optional
+
+
+def _request(url: str, body: Optional[dict] = None) -> dict:
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(
+        url, data=data, headers={"Content-Type": "application/json"}, method="POST" if data else "GET"
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Rebuild DocuMind indexes from stored originals.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--chunk-size", type=int)
+    parser.add_argument("--chunk-overlap", type=int)
+    parser.add_argument("--concurrency", type=int, help="extractions in flight (default: half the pool)")
+    parser.add_argument("--pause-ms", type=int, default=0, help="pause after each document")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between progress checks")
+    args = parser.parse_args()
+
+    endpoint = args.url.rstrip("/") + "/api/maintenance/reindex"
+    options = {
+        "chunk_size": args.chunk_size,
+        "chunk_overlap": args.chunk_overlap,
+        "concurrency": args.concurrency,
+        "pause_ms": args.pause_ms,
+    }
+    try:
+        status = _request(endpoint, {k: v for k, v in options.items() if v is not None})
+    except urllib.error.HTTPError as e:
+        print(f"error: {json.load(e).get('detail', e.reason)}", file=sys.stderr)
+        return 1
+    except urllib.error.URLError as e:
+        print(f"error: cannot reach {args.url}: {e.reason}", file=sys.stderr)
+        return 1
+
+    while status["state"] == "running":
+        time.sleep(args.poll)
+        status = _request(endpoint)
+        if "total" in status:
+            print(f"\r{status['done']}/{status['total']} documents "
+                  f"({status['resumed']} from checkpoint)", end="", flush=True)
+    print()
+
+    if status["state"] == "failed":
+        print(f"error: {status['error']}", file=sys.stderr)
+        return 1
+    print(f"re-indexed {status['documents']} documents into {status['chunks']} chunks "
+          f"(chunk size {status['chunk_size']}, overlap {status['chunk_overlap']})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
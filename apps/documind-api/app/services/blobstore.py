@@ -0,0 +1,145 @@
+"""
+Content-addressed blob store for uploaded originals.
+
+Each upload is stored once under its SHA-256 digest, so derived data
+(text, chunks, embeddings, indexes) can be rebuilt from the originals
+without asking anyone to re-upload. Identical uploads share one blob.
+
+A manifest next to the blobs records which documents each one belongs
+to, so a restarted process can still rebuild them.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from typing import Optional
+
+
+class BlobManifest:
+    """
+    Append-only JSON lines of document uploads and deletes.
+
+    Only what is needed to bring a document back is kept: its id, file
+    name, upload time and blob digest.
+    """
+
+    FIELDS = ("id", "filename", "uploaded_at", "blob")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, document: dict) -> None:
+        self._append({"add": {field: document[field] for field in self.FIELDS}})
+
+    def remove(self, document_id: str) -> None:
+        self._append({"remove": document_id})
+
+    def _append(self, record: dict) -> None:
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def load(self) -> list[dict]:
+        """
+        Documents that haven't been deleted, in upload order.
+
+        The file is rewritten to hold just those, dropping deletes and
+        a torn last line.
+        """
+        documents: dict[str, dict] = {}
+        if not os.path.exists(self.path):
+            return []
+        with self._lock:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break  # torn by a crash mid-append
+                    if "add" in record:
+                        documents[record["add"]["id"]] = record["add"]
+                    else:
+                        documents.pop(record["remove"], None)
+
+            partial = self.path + ".tmp"
+            with open(partial, "w", encoding="utf-8") as f:
+                f.writelines(json.dumps({"add": doc}) + "\n" for doc in documents.values())
+            os.replace(partial, self.path)
+        return list(documents.values())
+
+
+class BlobStore:
+    """
+    Files named by their SHA-256, fanned out over 256 subdirectories.
+
+    Writes go to a temporary file that is renamed into place, so a blob
+    is either absent or complete, never torn.
+
+    Without a `root` the blobs only need to live as long as the process:
+    they go to a temporary directory that is removed by `close`, when the
+    store is garbage collected, or at interpreter exit.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self._scratch = None if root else tempfile.TemporaryDirectory(prefix="documind-blobs-")
+        self.root = root or self._scratch.name
+        os.makedirs(self.root, exist_ok=True)
+        # Blobs live in two-character subdirectories, so this can't collide with one
+        self.manifest = BlobManifest(os.path.join(self.root, "manifest.jsonl"))
+
+    def close(self) -> None:
+        """Remove the temporary directory, if the store made one."""
+        if self._scratch is not None:
+            self._scratch.cleanup()
+            self._scratch = None
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, content: bytes) -> str:
+        """
+        Store content if it isn't stored yet.
+
+        Returns:
+            Hex SHA-256 digest addressing the blob
+        """
+        digest = hashlib.sha256(content).hexdigest()
+        path = self._path(digest)
+        if os.path.exists(path):
+            return digest
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return digest
+
+    def get(self, digest: str) -> bytes:
+        """
+        Read a blob.
+
+        Raises:
+            KeyError: No blob with that digest
+        """
+        try:
+            with open(self._path(digest), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise KeyError(digest) from None
+
+    def __contains__(self, digest: str) -> bool:
+        return os.path.exists(self._path(digest))
+
+    def delete(self, digest: str) -> bool:
+        try:
+            os.remove(self._path(digest))
+            return True
+        except FileNotFoundError:
+            return False
@@ -0,0 +1,152 @@
+"""
+Near-duplicate chunk detection.
+
+MinHash signatures over word shingles, bucketed by LSH banding, find
+chunks that are near-identical to one already indexed (boilerplate
+headers, legal footers, template sections). Only the first chunk of each
+cluster - the representative - goes into the vector index; the others
+are kept as back-references on it so they can still be cited.
+"""
+
+import zlib
+from collections import defaultdict
+from typing import Optional
+
+import numpy as np
+
+from app.services.embedding import tokenize
+
+
+class NearDuplicateIndex:
+    """
+    LSH index of representative chunks.
+
+    With ``bands`` bands of ``num_perm / bands`` rows, two chunks with
+    Jaccard similarity s share a bucket with probability
+    ``1 - (1 - s^rows)^bands``; candidates are then confirmed against
+    ``threshold`` using the full signatures.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.9,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 3,
+        seed: int = 1,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+
+        # Multiply-shift hash family: h_i(x) = (a_i * x + b_i) >> 32, a_i odd
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2**32, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2**32, size=num_perm, dtype=np.uint64)
+
+        self._next_id = 0
+        self._signatures: dict[int, np.ndarray] = {}
+        self._representatives: dict[int, dict] = {}
+        self._buckets: list[dict[bytes, list[int]]] = [defaultdict(list) for _ in range(bands)]
+
+        # document_id -> representatives it owns / is a duplicate of
+        self._owned: dict[str, set[int]] = defaultdict(set)
+        self._duplicated_in: dict[str, set[int]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._representatives)
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of the text's word shingles."""
+        tokens = tokenize(text)
+        size = self.shingle_size
+        shingles = (
+            [" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)]
+            if len(tokens) >= size
+            else [" ".join(tokens)]
+        )
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode()) for s in set(shingles)), dtype=np.uint64
+        )
+        # (num_perm, shingles) in one shot, min over shingles
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) >> np.uint64(32)
+        return permuted.min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        return [band.tobytes() for band in np.split(signature, self.bands)]
+
+    def find(self, signature: np.ndarray) -> Optional[dict]:
+        """Metadata of a representative near-identical to `signature`, if any."""
+        seen = set()
+        for band, key in enumerate(self._band_keys(signature)):
+            for rep_id in self._buckets[band].get(key, ()):
+                if rep_id in seen:
+                    continue
+                seen.add(rep_id)
+                if np.mean(self._signatures[rep_id] == signature) >= self.threshold:
+                    return self._representatives[rep_id]
+        return None
+
+    def add_representative(self, signature: np.ndarray, metadata: dict) -> None:
+        """
+        Register an indexed chunk as a cluster representative.
+
+        `metadata` is the dict stored in the vector index; duplicates are
+        appended to its ``duplicates`` list.
+        """
+        rep_id = self._next_id
+        self._next_id += 1
+        metadata.setdefault("duplicates", [])
+        metadata["_rep_id"] = rep_id
+
+        self._signatures[rep_id] = signature
+        self._representatives[rep_id] = metadata
+        self._owned[metadata["document_id"]].add(rep_id)
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band][key].append(rep_id)
+
+    def add_duplicate(self, representative: dict, reference: dict) -> None:
+        """Record `reference` (document_id, chunk_index, page, text) as a duplicate."""
+        representative["duplicates"].append(reference)
+        self._duplicated_in[reference["document_id"]].add(representative["_rep_id"])
+
+    def linked_documents(self, document_id: str) -> set[str]:
+        """Documents whose representatives stand in for chunks of `document_id`."""
+        return {
+            self._representatives[rep_id]["document_id"]
+            for rep_id in self._duplicated_in.get(document_id, ())
+        }
+
+    def remove_document(self, document_id: str) -> list[list[dict]]:
+        """
+        Forget a deleted document.
+
+        Its back-references are dropped from other representatives, and
+        its own representatives are unregistered.
+
+        Returns:
+            For each removed representative that still had duplicates in
+            other documents, those duplicates (the caller must index the
+            first one as the new representative)
+        """
+        for rep_id in self._duplicated_in.pop(document_id, ()):
+            rep = self._representatives.get(rep_id)
+            if rep is not None:
+                rep["duplicates"] = [d for d in rep["duplicates"] if d["document_id"] != document_id]
+
+        orphans = []
+        for rep_id in self._owned.pop(document_id, ()):
+            rep = self._representatives.pop(rep_id)
+            signature = self._signatures.pop(rep_id)
+            for band, key in enumerate(self._band_keys(signature)):
+                self._buckets[band][key].remove(rep_id)
+            survivors = [d for d in rep["duplicates"] if d["document_id"] != document_id]
+            for survivor in survivors:
+                self._duplicated_in[survivor["document_id"]].discard(rep_id)
+            if survivors:
+                orphans.append(survivors)
+        return orphans
@@ -4,19 +4,203 @@ Document processing service.
 Handles file uploads, text extraction, and chunking for the RAG pipeline.
 """
 
+import asyncio
+import heapq
+import json
+import math
+import os
+import tarfile
+import tempfile
+import time
 import uuid
+import zipfile
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-from typing import Optional
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Iterable, Iterator, Optional, Union
 from fastapi import UploadFile
+import numpy as np
+
+from app.services.blobstore import BlobStore
+from app.services.dedup import NearDuplicateIndex
+from app.services.embedding import HashingEmbedder
+from app.services.embedding_cache import CachedEmbedder, EmbeddingCache
+from app.services.metadata import DocumentIndex
+from app.services.routing import RoutingIndex
+from app.services.snippets import sentence_index
+from app.services.vectorstore import VectorStore
+
+
+SUPPORTED_EXTENSIONS = {".pdf", ".docx", ".txt", ".md"}
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2")
+
+# Archive members larger than this are skipped rather than read into memory
+MAX_MEMBER_BYTES = 50 * 1024 * 1024
+
+
+def is_supported(filename: str) -> bool:
+    """Whether a file name has an extension we can extract."""
+    return os.path.splitext(filename.lower())[1] in SUPPORTED_EXTENSIONS
+
+
+def is_archive(filename: str) -> bool:
+    """Whether a file name looks like a ZIP or TAR archive."""
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+def iter_archive(fileobj: BinaryIO, filename: str) -> Iterator[tuple[str, bytes]]:
+    """
+    Stream (member name, bytes) pairs out of a ZIP or TAR archive.
+    
+    Members are read one at a time, so only a single member is held in
+    memory. Directories and oversized members are not yielded.
+    
+    Args:
+        fileobj: Seekable file object for ZIP, any readable stream for TAR
+        filename: Archive name, used to pick the format
+    """
+    try:
+        if filename.lower().endswith(".zip"):
+            with zipfile.ZipFile(fileobj) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or info.file_size > MAX_MEMBER_BYTES:
+                        continue
+                    with archive.open(info) as member:
+                        yield info.filename, member.read()
+            return
+        
+        # Stream mode reads members sequentially without seeking
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for info in archive:
+                if not info.isfile() or info.size > MAX_MEMBER_BYTES:
+                    continue
+                member = archive.extractfile(info)
+                if member is not None:
+                    yield info.name, member.read()
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+        raise ValueError(f"Invalid archive: {e}") from e
+
+
+def _scan_checkpoint(path: Optional[str]) -> dict[str, int]:
+    """
+    Offset of each original's record in an interrupted re-index's checkpoint.
+    
+    Records are read one at a time and their text isn't kept; a torn last
+    line from a crash mid-write is cut off so new records start cleanly.
+    """
+    offsets: dict[str, int] = {}
+    if not path or not os.path.exists(path):
+        return offsets
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            try:
+                offsets[json.loads(line)["blob"]] = offset
+            except json.JSONDecodeError:
+                break
+            offset += len(line)
+    os.truncate(path, offset)
+    return offsets
+
+
+def _read_checkpoint(path: str, offset: int) -> tuple[list[str], int]:
+    """(page texts, page count) of the record at `offset`."""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        record = json.loads(f.readline())
+    return record["page_texts"], record["pages"]
+
+
+def _append_checkpoint(path: str, blob: str, page_texts: list[str], pages: int) -> int:
+    """Append a record; returns its offset."""
+    with open(path, "ab") as f:
+        offset = f.seek(0, os.SEEK_END)
+        f.write(json.dumps({"blob": blob, "pages": pages, "page_texts": page_texts}).encode() + b"\n")
+    return offset
 
 
 class DocumentService:
     """Service for document management and processing."""
     
-    def __init__(self):
+    def __init__(
+        self,
+        vector_store: Optional[VectorStore] = None,
+        embedder: Optional[HashingEmbedder] = None,
+        extraction_workers: Optional[int] = None,
+        pdf_shard_pages: int = 25,
+        compaction_threshold: float = 0.25,
+        embedding_cache: Optional[EmbeddingCache] = None,
+        dedup_threshold: Optional[float] = 0.9,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        route_top_n: int = 8,
+        search_workers: Optional[int] = None,
+        blob_store: Optional[BlobStore] = None,
+    ):
         # In production, use a database
         self._documents: dict[str, dict] = {}
         self._collections: dict[str, dict] = {}
+        self._index = DocumentIndex()
+        
+        data_dir = os.getenv("DOCUMIND_DATA_DIR")
+        self.embedder = embedder or HashingEmbedder()
+        self.vector_store = vector_store or VectorStore(
+            dim=self.embedder.dim,
+            quantization=os.getenv("DOCUMIND_VECTOR_QUANTIZATION", "none"),
+            storage_dir=data_dir,
+        )
+        
+        # Originals are kept so derived data can be rebuilt without re-uploads
+        self.blob_store = blob_store or BlobStore(
+            os.path.join(data_dir, "blobs") if data_dir else None
+        )
+        self._blob_refs: Counter = Counter()
+        self._data_dir = data_dir
+        
+        # Chunk embeddings go through the persistent cache when there is a data dir
+        if embedding_cache is None and data_dir:
+            embedding_cache = EmbeddingCache(os.path.join(data_dir, "embeddings.cache"))
+        self.embedding_cache = embedding_cache
+        self._chunk_embedder = (
+            CachedEmbedder(self.embedder, embedding_cache)
+            if embedding_cache is not None
+            else self.embedder
+        )
+        
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        
+        # Near-duplicate chunks across the corpus share one indexed row
+        self._dedup = (
+            NearDuplicateIndex(threshold=dedup_threshold) if dedup_threshold else None
+        )
+        
+        # Per-document summaries for routing collection-wide questions
+        self._routing = RoutingIndex(self.embedder.dim)
+        self.route_top_n = route_top_n
+        
+        # CPU-bound text extraction runs on a process pool, started on first use
+        self.extraction_workers = extraction_workers or int(
+            os.getenv("DOCUMIND_EXTRACTION_WORKERS", os.cpu_count() or 1)
+        )
+        self._pool: Optional[Executor] = None
+        
+        # Multi-scope questions search each scope on its own thread (NumPy
+        # releases the GIL during scoring)
+        self.search_workers = search_workers or min(8, os.cpu_count() or 1)
+        self._search_pool: Optional[ThreadPoolExecutor] = None
+        
+        # Large PDFs are extracted in page-range shards of this size
+        self.pdf_shard_pages = pdf_shard_pages
+        self._indexing_tasks: set[asyncio.Task] = set()
+        
+        # Deletes tombstone index rows; compact once this fraction is garbage
+        self.compaction_threshold = compaction_threshold
+        self._compaction: Optional[asyncio.Task] = None
+        
+        # Background rebuild of all derived data (see `reindex`)
+        self._reindex: Optional[asyncio.Task] = None
+        self.reindex_status: dict = {"state": "idle"}
     
     async def process_document(self, file: UploadFile) -> dict:
         """
@@ -25,8 +209,8 @@ class DocumentService:
         1. Save the file
         2. Extract text based on file type
         3. Chunk the text
-        4. Generate embeddings (placeholder)
-        5. Store in vector database (placeholder)
+        4. Generate embeddings
+        5. Store in the vector index
         
         Args:
             file: Uploaded file
@@ -34,64 +218,455 @@ class DocumentService:
         Returns:
             Document metadata
         """
-        doc_id = str(uuid.uuid4())
         content = await file.read()
+        return await self.ingest(file.filename or "unknown", content)
+    
+    async def ingest(
+        self,
+        filename: str,
+        content: bytes,
+        collection_id: Optional[str] = None,
+    ) -> dict:
+        """
+        Ingest raw file bytes.
         
-        # Extract text based on file type
-        filename = file.filename or "unknown"
-        extension = filename.split(".")[-1].lower() if "." in filename else ""
-        
-        text = ""
-        pages = 1
+        Text extraction runs on the extraction pool so the event loop
+        stays free while PDFs and DOCX files are parsed. PDFs longer than
+        one shard are searchable as soon as their first shard is indexed;
+        the remaining page ranges are extracted in parallel and indexed in
+        the background as each completes.
         
-        if extension == "pdf":
-            text, pages = self._extract_pdf(content)
-        elif extension == "docx":
-            text = self._extract_docx(content)
-        elif extension in ("txt", "md"):
-            text = content.decode("utf-8")
+        Args:
+            filename: Original file name (extension selects the extractor)
+            content: File bytes
+            collection_id: Optional collection to add the document to
+            
+        Returns:
+            Document metadata
+        """
+        doc_id = str(uuid.uuid4())
+        extension = filename.split(".")[-1].lower() if "." in filename else ""
         
-        # Chunk the text for embeddings
-        chunks = self._chunk_text(text)
+        loop = asyncio.get_running_loop()
+        page_texts, pages = await loop.run_in_executor(
+            self._get_pool(), DocumentService._extract, extension, content, self.pdf_shard_pages
+        )
+        blob = await loop.run_in_executor(None, self.blob_store.put, content)
+        self._blob_refs[blob] += 1
         
         # Store document metadata
-        self._documents[doc_id] = {
+        doc = {
             "id": doc_id,
             "filename": filename,
             "pages": pages,
+            "pages_indexed": 0,
             "uploaded_at": datetime.utcnow().isoformat(),
-            "status": "processed",
-            "chunk_count": len(chunks),
-            "text_length": len(text),
+            "blob": blob,
+            "status": "processing",
+            "chunk_count": 0,
+            "duplicate_chunks": 0,
+            "text_length": 0,
         }
+        self._documents[doc_id] = doc
+        self._index.add(doc)
+        self.blob_store.manifest.add(doc)
+        self._index_pages(doc_id, page_texts, first_page=1)
+        
+        if collection_id:
+            self.add_to_collection(collection_id, doc_id)
+        
+        if len(page_texts) < pages:
+            task = asyncio.create_task(
+                self._index_remaining_pages(doc_id, content, start=len(page_texts))
+            )
+            self._indexing_tasks.add(task)
+            task.add_done_callback(self._indexing_tasks.discard)
+            message = (
+                f"Indexing {pages} pages in the background. "
+                f"{doc['pages_indexed']} pages searchable now."
+            )
+        else:
+            self._set_status(doc, "processed")
+            message = f"Document processed successfully. {doc['chunk_count']} chunks created."
         
         return {
             "id": doc_id,
             "filename": filename,
             "pages": pages,
-            "status": "processed",
-            "message": f"Document processed successfully. {len(chunks)} chunks created.",
+            "status": doc["status"],
+            "message": message,
         }
     
-    def _extract_pdf(self, content: bytes) -> tuple[str, int]:
-        """Extract text from PDF file."""
+    async def _index_remaining_pages(self, doc_id: str, content: bytes, start: int) -> None:
+        """
+        Extract the remaining page shards in parallel, indexing each as it lands.
+        
+        If any shard fails the document is marked failed rather than left
+        processed with pages missing; the other shards are cancelled.
+        """
+        doc = self._documents[doc_id]
+        loop = asyncio.get_running_loop()
+        pool = self._get_pool()
+        
+        # Workers read the PDF from disk instead of each receiving a copy of the bytes
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(content)
+            path = f.name
+        
+        async def extract_shard(first: int) -> tuple[int, list[str]]:
+            last = min(first + self.pdf_shard_pages, doc["pages"])
+            page_texts, _ = await loop.run_in_executor(
+                pool, DocumentService._extract_pdf, path, first, last
+            )
+            return first, page_texts
+        
+        shards = [
+            asyncio.ensure_future(extract_shard(first))
+            for first in range(start, doc["pages"], self.pdf_shard_pages)
+        ]
         try:
-            from pypdf import PdfReader
-            import io
+            for shard in asyncio.as_completed(shards):
+                first, page_texts = await shard
+                if doc_id not in self._documents:
+                    return
+                self._index_pages(doc_id, page_texts, first_page=first + 1)
+            self._set_status(doc, "processed")
+        except Exception:
+            self._set_status(doc, "failed")
+        finally:
+            for shard in shards:
+                shard.cancel()
+            await asyncio.gather(*shards, return_exceptions=True)
+            os.remove(path)
+    
+    def _set_status(self, doc: dict, status: str) -> None:
+        doc["status"] = status
+        self._index.update(doc)
+    
+    async def wait_for_indexing(self) -> None:
+        """Wait for all background indexing to finish."""
+        while self._indexing_tasks:
+            await asyncio.gather(*self._indexing_tasks, return_exceptions=True)
+    
+    async def ingest_many(
+        self,
+        files: Iterable[tuple[str, bytes]],
+        collection_id: Optional[str] = None,
+        admit: Optional[Callable[[], Awaitable[float]]] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Ingest many files, yielding one result per file as it completes.
+        
+        `files` is consumed lazily and at most ``2 * extraction_workers``
+        files are in flight, so an archive is never held in memory whole.
+        A slot is freed before the next file is read, and reading (which
+        for archives means decompressing) happens on a worker thread so
+        the event loop stays free.
+        
+        Args:
+            files: (filename, content) pairs, e.g. from `iter_archive`
+            collection_id: Optional collection to add every document to
+            admit: Charges each file after the first to the caller's
+                budget, returning seconds until it could be afforded (0
+                when charged). Once it is over budget the file is
+                reported as ``rate_limited`` and no more are read.
             
-            reader = PdfReader(io.BytesIO(content))
-            pages = len(reader.pages)
-            text = ""
+        Yields:
+            Per-file result dicts with ``filename`` and ``status``
+        """
+        limit = 2 * self.extraction_workers
+        pending: set[asyncio.Task] = set()
+        files = iter(files)
+        read = 0
+        loop = asyncio.get_running_loop()
+        
+        try:
+            while True:
+                if len(pending) >= limit:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                item = await loop.run_in_executor(None, next, files, None)
+                if item is None:
+                    break
+                filename, content = item
+                if admit is not None and read:
+                    retry_after = await admit()
+                    if retry_after > 0:
+                        yield {
+                            "filename": filename,
+                            "status": "rate_limited",
+                            "message": f"Upload budget exhausted; retry after {math.ceil(retry_after)}s",
+                        }
+                        break
+                read += 1
+                if not is_supported(filename):
+                    yield {"filename": filename, "status": "skipped", "message": "Unsupported file type"}
+                    continue
+                pending.add(asyncio.create_task(self._ingest_one(filename, content, collection_id)))
             
-            for page in reader.pages:
-                text += page.extract_text() or ""
-                text += "\n\n"
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+    
+    async def _ingest_one(self, filename: str, content: bytes, collection_id: Optional[str]) -> dict:
+        """Ingest one file, reporting failures as a result instead of raising."""
+        try:
+            return await self.ingest(filename, content, collection_id)
+        except Exception as e:
+            return {"filename": filename, "status": "failed", "message": str(e)}
+    
+    def _get_pool(self) -> Executor:
+        """Lazily start the extraction pool."""
+        if self._pool is None:
+            try:
+                self._pool = ProcessPoolExecutor(max_workers=self.extraction_workers)
+            except (OSError, NotImplementedError):
+                # No process support (e.g. serverless sandboxes without /dev/shm)
+                self._pool = ThreadPoolExecutor(max_workers=self.extraction_workers)
+        return self._pool
+    
+    @staticmethod
+    def _extract(extension: str, content: bytes, pdf_pages: Optional[int] = None) -> tuple[list[str], int]:
+        """
+        Extract per-page text from file bytes; runs in a pool worker.
+        
+        Returns:
+            (page texts, total page count). For PDFs only the first
+            `pdf_pages` pages are extracted; other formats are one page.
+        """
+        if extension == "pdf":
+            try:
+                return DocumentService._extract_pdf(content, 0, pdf_pages)
+            except Exception:
+                # Unreadable PDFs are accepted as empty documents
+                return [], 0
+        if extension == "docx":
+            return [DocumentService._extract_docx(content)], 1
+        if extension in ("txt", "md"):
+            return [content.decode("utf-8")], 1
+        return [], 1
+    
+    def _index_pages(self, doc_id: str, page_texts: list[str], first_page: int) -> None:
+        """Chunk, embed and index a run of consecutive pages."""
+        doc = self._documents[doc_id]
+        metadata = []
+        
+        for page, text in enumerate(page_texts, start=first_page):
+            for chunk in self._chunk_text(text, self.chunk_size, self.chunk_overlap):
+                metadata.append({
+                    "document_id": doc_id,
+                    "chunk_index": doc["chunk_count"],
+                    "page": page,
+                    "text": chunk,
+                    # Sentence offsets and term postings, so citations never rescan the text
+                    **sentence_index(chunk),
+                })
+                doc["chunk_count"] += 1
+            doc["text_length"] += len(text)
+        
+        vectors = self._store_chunks(metadata)
+        self._routing.update(doc_id, vectors, "\n".join(page_texts))
+        doc["pages_indexed"] += len(page_texts)
+    
+    def _store_chunks(self, metadata: list[dict]) -> Optional[np.ndarray]:
+        """
+        Embed and index chunks.
+        
+        Chunks near-identical to an indexed representative are recorded
+        as back-references on it instead of getting their own vector.
+        
+        Returns:
+            Embeddings of the chunks that were indexed, if any
+        """
+        if self._dedup is not None:
+            unique = []
+            for meta in metadata:
+                signature = self._dedup.signature(meta["text"])
+                representative = self._dedup.find(signature)
+                if representative is None:
+                    self._dedup.add_representative(signature, meta)
+                    unique.append(meta)
+                else:
+                    self._dedup.add_duplicate(representative, dict(meta))
+                    self._documents[meta["document_id"]]["duplicate_chunks"] += 1
+            metadata = unique
+        
+        if not metadata:
+            return None
+        vectors = self._chunk_embedder.embed([m["text"] for m in metadata])
+        self.vector_store.add(vectors, metadata)
+        return vectors
+    
+    def search(
+        self,
+        query: str,
+        document_id: Optional[str] = None,
+        collection_id: Optional[str] = None,
+        k: int = 5,
+        query_vector: Optional[np.ndarray] = None,
+        filters: Optional[dict] = None,
+    ) -> list[dict]:
+        """
+        Find the chunks most similar to a query.
+        
+        Args:
+            query: Natural language query
+            document_id: Optional document to restrict the search to
+            collection_id: Optional collection to restrict the search to
+            k: Number of chunks to return
+            query_vector: The query's embedding, if already computed
+            filters: Metadata pre-filters (filename, extension, status,
+                uploaded_after, uploaded_before) narrowing the documents
+                searched, resolved from the secondary indexes
             
-            return text, pages
-        except Exception:
-            return "", 0
+        Returns:
+            Chunk dicts (document_id, chunk_index, text, score), best first
+        """
+        document_ids = None
+        if document_id:
+            document_ids = {document_id}
+        elif collection_id:
+            collection = self._collections.get(collection_id)
+            document_ids = set(collection["document_ids"]) if collection else set()
+        
+        if filters:
+            allowed = set(self._index.query(**filters))
+            document_ids = allowed if document_ids is None else document_ids & allowed
+            if not document_ids:
+                return []
+        
+        if query_vector is None:
+            query_vector = self.embedder.embed_query(query)
+        
+        # Two-stage retrieval: only search the chunks of the most promising documents
+        if not document_id and document_ids and len(document_ids) > self.route_top_n:
+            document_ids = set(
+                self._routing.route(query_vector, query, document_ids, self.route_top_n)
+            )
+        
+        # Chunks of these documents may live on as duplicates of other documents' rows
+        linked = set()
+        if document_ids and self._dedup is not None:
+            for doc_id in document_ids:
+                linked |= self._dedup.linked_documents(doc_id)
+            linked -= document_ids
+        if not linked:
+            return self.vector_store.search(query_vector, k=k, document_ids=document_ids)
+        
+        results = []
+        for hit in self.vector_store.search(query_vector, k=4 * k, document_ids=document_ids | linked):
+            if hit["document_id"] not in document_ids:
+                reference = next(
+                    (d for d in hit["duplicates"] if d["document_id"] in document_ids), None
+                )
+                if reference is None:
+                    continue
+                # Cite the duplicate in the requested document
+                hit = {**hit, **reference}
+            results.append(hit)
+        return results[:k]
+    
+    async def search_scopes(
+        self,
+        query: str,
+        scopes: list[tuple[str, str]],
+        k: int = 5,
+        filters: Optional[dict] = None,
+    ) -> tuple[list[dict], list[dict]]:
+        """
+        Search several documents and collections at once.
+        
+        Each scope is searched concurrently on the search pool, off the
+        event loop; their best-first top-k lists are k-way merged into one
+        global top-k, so a wide question costs about as much as its
+        slowest scope.
+        
+        Args:
+            query: Natural language query
+            scopes: ("document", id) or ("collection", id) pairs
+            k: Number of chunks to return
+            filters: Metadata pre-filters, as in `search`
+            
+        Returns:
+            (chunk dicts best first, per-scope timings in scope order)
+        """
+        if self._search_pool is None:
+            self._search_pool = ThreadPoolExecutor(
+                max_workers=self.search_workers, thread_name_prefix="documind-search"
+            )
+        loop = asyncio.get_running_loop()
+        query_vector = await loop.run_in_executor(self._search_pool, self.embedder.embed_query, query)
+        
+        def search_one(scope: tuple[str, str]) -> tuple[list[dict], float]:
+            kind, scope_id = scope
+            started = time.perf_counter()
+            hits = self.search(
+                query,
+                document_id=scope_id if kind == "document" else None,
+                collection_id=scope_id if kind == "collection" else None,
+                k=k,
+                query_vector=query_vector,
+                filters=filters,
+            )
+            return hits, time.perf_counter() - started
+        
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._search_pool, search_one, scope) for scope in scopes)
+        )
+        
+        merged, seen = [], set()
+        for hit in heapq.merge(*(hits for hits, _ in results), key=lambda h: -h["score"]):
+            # A chunk reachable through several scopes is returned once
+            key = (hit["document_id"], hit["chunk_index"])
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(hit)
+            if len(merged) == k:
+                break
+        
+        timings = [
+            {"scope": kind, "id": scope_id, "hits": len(hits), "ms": round(1000 * elapsed, 3)}
+            for (kind, scope_id), (hits, elapsed) in zip(scopes, results)
+        ]
+        return merged, timings
+    
+    @staticmethod
+    def _extract_pdf(
+        source: Union[bytes, str],
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> tuple[list[str], int]:
+        """
+        Extract text from a page range of a PDF file.
+        
+        Args:
+            source: PDF bytes, or a path to the PDF on disk
+            start: First page (0-based, inclusive)
+            end: Last page (exclusive); defaults to the end of the document
+            
+        Returns:
+            (page texts for the range, total page count)
+        
+        Raises:
+            Exception: Whatever pypdf raises for an unreadable file or page
+        """
+        from pypdf import PdfReader
+        import io
+        
+        reader = PdfReader(io.BytesIO(source) if isinstance(source, bytes) else source)
+        pages = len(reader.pages)
+        end = pages if end is None else min(end, pages)
+        
+        return [reader.pages[i].extract_text() or "" for i in range(start, end)], pages
     
-    def _extract_docx(self, content: bytes) -> str:
+    @staticmethod
+    def _extract_docx(content: bytes) -> str:
         """Extract text from DOCX file."""
         try:
             from docx import Document
@@ -135,20 +710,332 @@ class DocumentService:
         
         return [c for c in chunks if c]
     
-    def list_documents(self) -> list[dict]:
-        """Get all documents."""
-        return list(self._documents.values())
+    def list_documents(
+        self,
+        filename: Optional[str] = None,
+        extension: Optional[str] = None,
+        status: Optional[str] = None,
+        collection_id: Optional[str] = None,
+        uploaded_after: Optional[str] = None,
+        uploaded_before: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> list[dict]:
+        """
+        Get documents, oldest first, optionally filtered.
+        
+        Filters are answered from the secondary indexes (see
+        `DocumentIndex.query`), not by scanning every document.
+        """
+        ids = self._index.query(
+            filename=filename,
+            extension=extension,
+            status=status,
+            collection_id=collection_id,
+            uploaded_after=uploaded_after,
+            uploaded_before=uploaded_before,
+            limit=limit,
+        )
+        return [self._documents[doc_id] for doc_id in ids]
     
     def get_document(self, doc_id: str) -> Optional[dict]:
         """Get a specific document."""
         return self._documents.get(doc_id)
     
     def delete_document(self, doc_id: str) -> bool:
-        """Delete a document."""
-        if doc_id in self._documents:
-            del self._documents[doc_id]
-            return True
-        return False
+        """
+        Delete a document.
+        
+        Its chunks are tombstoned in the vector index in O(1); once enough
+        of the index is garbage, a background compaction reclaims it.
+        """
+        if doc_id not in self._documents:
+            return False
+        
+        doc = self._documents.pop(doc_id)
+        # Off the manifest before the original goes, so a crash can't leave it pointing nowhere
+        self.blob_store.manifest.remove(doc_id)
+        self._release_blob(doc.get("blob"))
+        for collection_id in self._index.remove(doc):
+            collection = self._collections[collection_id]
+            collection["document_ids"].remove(doc_id)
+            collection["document_count"] -= 1
+        self._drop_chunks(doc_id)
+        
+        if self.vector_store.garbage_ratio >= self.compaction_threshold:
+            self._schedule_compaction()
+        return True
+    
+    def _drop_chunks(self, doc_id: str) -> None:
+        """Remove a document from the vector, routing and dedup indexes."""
+        self.vector_store.delete_document(doc_id)
+        self._routing.remove(doc_id)
+        if self._dedup is not None:
+            self._promote_duplicates(self._dedup.remove_document(doc_id))
+    
+    def _promote_duplicates(self, orphans: list[list[dict]]) -> None:
+        """Index the first surviving duplicate of each orphaned cluster as its new representative."""
+        promoted = []
+        for survivors in orphans:
+            first, rest = dict(survivors[0]), survivors[1:]
+            self._documents[first["document_id"]]["duplicate_chunks"] -= 1
+            self._dedup.add_representative(self._dedup.signature(first["text"]), first)
+            for reference in rest:
+                self._dedup.add_duplicate(first, reference)
+            promoted.append(first)
+        
+        if promoted:
+            vectors = self._chunk_embedder.embed([m["text"] for m in promoted])
+            self.vector_store.add(vectors, promoted)
+            for meta, vector in zip(promoted, vectors):
+                self._routing.update(meta["document_id"], vector[None, :])
+    
+    def _schedule_compaction(self) -> None:
+        """Start a background compaction unless one is already running."""
+        if self._compaction is not None and not self._compaction.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # No event loop (sync callers); the next delete under a loop will compact
+            return
+        self._compaction = loop.create_task(self.compact_index())
+    
+    async def compact_index(self) -> int:
+        """
+        Reclaim tombstoned rows from the vector index.
+        
+        The rebuild runs on a worker thread; searches keep using the old
+        arrays until the rebuilt ones are swapped in.
+        
+        Returns:
+            Number of rows reclaimed
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.vector_store.compact)
+    
+    def _release_blob(self, blob: Optional[str]) -> None:
+        """Drop a reference to an original, deleting it with its last document."""
+        if blob is None:
+            return
+        self._blob_refs[blob] -= 1
+        if self._blob_refs[blob] <= 0:
+            del self._blob_refs[blob]
+            self.blob_store.delete(blob)
+    
+    # === Re-indexing ===
+    
+    def restore(self) -> int:
+        """
+        Bring back the documents of an earlier process from the blob manifest.
+        
+        Documents and indexes only live in memory, but the originals and
+        the manifest of which documents they belong to survive a restart.
+        Restored documents are listed as "processing" with nothing indexed
+        until `reindex` rebuilds them.
+        
+        Returns:
+            Number of documents restored
+        """
+        restored = 0
+        for record in self.blob_store.manifest.load():
+            if record["id"] in self._documents or record["blob"] not in self.blob_store:
+                continue
+            doc = {
+                **record,
+                "pages": 0,
+                "pages_indexed": 0,
+                "status": "processing",
+                "chunk_count": 0,
+                "duplicate_chunks": 0,
+                "text_length": 0,
+            }
+            self._documents[doc["id"]] = doc
+            self._index.add(doc)
+            self._blob_refs[doc["blob"]] += 1
+            restored += 1
+        return restored
+    
+    @property
+    def reindex_running(self) -> bool:
+        return self._reindex is not None and not self._reindex.done()
+    
+    def start_reindex(self, **options) -> dict:
+        """
+        Start `reindex` in the background.
+        
+        Progress is reported in `reindex_status`.
+        
+        Raises:
+            RuntimeError: A re-index is already running
+        """
+        if self.reindex_running:
+            raise RuntimeError("A re-index is already running")
+        self.reindex_status = {"state": "running", "started_at": datetime.utcnow().isoformat()}
+        self._reindex = asyncio.get_running_loop().create_task(self._run_reindex(options))
+        return self.reindex_status
+    
+    async def _run_reindex(self, options: dict) -> None:
+        status = self.reindex_status
+        try:
+            status.update(await self.reindex(**options), state="completed")
+        except Exception as e:
+            status.update(state="failed", error=str(e))
+        status["finished_at"] = datetime.utcnow().isoformat()
+    
+    async def reindex(
+        self,
+        chunk_size: Optional[int] = None,
+        chunk_overlap: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        pause: float = 0.0,
+        checkpoint_path: Optional[str] = None,
+    ) -> dict:
+        """
+        Rebuild every chunk, embedding and index from the stored originals.
+        
+        Originals are re-extracted on the extraction pool and indexed into
+        a fresh vector store, dedup index and routing index while the live
+        ones keep serving. At most `concurrency` documents' text is held in
+        memory at once: each is dropped as soon as it is indexed. Documents uploaded meanwhile are picked up
+        before the end; the rebuilt indexes are then swapped in in one
+        step, with no await in between, so searches see either the old
+        index or the new one. If anything fails, the live index is left
+        untouched.
+        
+        Args:
+            chunk_size: New chunk size (defaults to the current one)
+            chunk_overlap: New chunk overlap (defaults to the current one)
+            concurrency: Extractions in flight at once; defaults to half
+                the extraction pool, leaving the rest to live uploads
+            pause: Seconds to yield to live traffic after each document
+            checkpoint_path: File recording extracted text per original.
+                A re-index that was interrupted, in this process or
+                before a restart, resumes from it without re-extracting;
+                it is removed once the swap is done. Defaults to
+                ``reindex.checkpoint`` in DOCUMIND_DATA_DIR.
+            
+        Returns:
+            Counts of documents rebuilt, resumed from the checkpoint and
+            chunks indexed
+        """
+        chunk_size = chunk_size or self.chunk_size
+        chunk_overlap = self.chunk_overlap if chunk_overlap is None else chunk_overlap
+        if chunk_overlap >= chunk_size:
+            raise ValueError("chunk_overlap must be smaller than chunk_size")
+        if checkpoint_path is None and self._data_dir:
+            checkpoint_path = os.path.join(self._data_dir, "reindex.checkpoint")
+        
+        shadow = DocumentService(
+            vector_store=self.vector_store.empty_copy(),
+            embedder=self.embedder,
+            embedding_cache=self.embedding_cache,
+            dedup_threshold=self._dedup.threshold if self._dedup is not None else None,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            route_top_n=self.route_top_n,
+            blob_store=self.blob_store,
+        )
+        
+        loop = asyncio.get_running_loop()
+        checkpoint = await loop.run_in_executor(None, _scan_checkpoint, checkpoint_path)
+        limit = asyncio.Semaphore(concurrency or max(1, self.extraction_workers // 2))
+        indexing = asyncio.Lock()  # the shadow indexes take one document at a time
+        status = self.reindex_status
+        status.update(total=len(self._documents), done=0, resumed=0)
+        rebuilt: set[str] = set()
+        
+        async def extract(doc: dict) -> tuple[Optional[list[str]], int]:
+            if doc["blob"] in checkpoint:
+                status["resumed"] += 1
+                return await loop.run_in_executor(
+                    None, _read_checkpoint, checkpoint_path, checkpoint[doc["blob"]]
+                )
+            try:
+                content = await loop.run_in_executor(None, self.blob_store.get, doc["blob"])
+            except KeyError:
+                if doc["id"] not in self._documents:
+                    # Deleted (with its original) since the re-index started
+                    return None, 0
+                raise
+            extension = doc["filename"].split(".")[-1].lower() if "." in doc["filename"] else ""
+            page_texts, pages = await loop.run_in_executor(
+                self._get_pool(), DocumentService._extract, extension, content, None
+            )
+            if checkpoint_path:
+                checkpoint[doc["blob"]] = await loop.run_in_executor(
+                    None, _append_checkpoint, checkpoint_path, doc["blob"], page_texts, pages
+                )
+            return page_texts, pages
+        
+        async def rebuild(doc: dict) -> None:
+            async with limit:
+                page_texts, pages = await extract(doc)
+                if page_texts is None or doc["id"] not in self._documents:
+                    return
+                async with indexing:
+                    shadow._documents[doc["id"]] = {
+                        **doc,
+                        "pages": pages,
+                        "pages_indexed": 0,
+                        "chunk_count": 0,
+                        "duplicate_chunks": 0,
+                        "text_length": 0,
+                        "status": "processed",
+                    }
+                    # Off the event loop: nothing else touches the shadow indexes
+                    await loop.run_in_executor(None, shadow._index_pages, doc["id"], page_texts, 1)
+            rebuilt.add(doc["id"])
+            status["done"] += 1
+            await asyncio.sleep(pause)
+        
+        while True:
+            pending = [d for d in self._documents.values() if d["id"] not in rebuilt]
+            if pending:
+                status["total"] = len(rebuilt) + len(pending)
+                tasks = [asyncio.create_task(rebuild(d)) for d in pending]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+            elif self._indexing_tasks:
+                await self.wait_for_indexing()
+            elif self._compaction is not None and not self._compaction.done():
+                await asyncio.wait({self._compaction})
+            else:
+                break
+        
+        # === Swap (synchronous from here on) ===
+        for doc_id in list(shadow._documents):
+            if doc_id not in self._documents:
+                # Deleted meanwhile. Only the rebuilt indexes still hold it:
+                # the shared blob store and its refcounts belong to the live side
+                del shadow._documents[doc_id]
+                shadow._drop_chunks(doc_id)
+        
+        old_store = self.vector_store
+        self.vector_store = shadow.vector_store
+        self._dedup = shadow._dedup
+        self._routing = shadow._routing
+        self.chunk_size, self.chunk_overlap = chunk_size, chunk_overlap
+        for doc_id, doc in self._documents.items():
+            fresh = shadow._documents[doc_id]
+            for field in ("pages", "pages_indexed", "chunk_count", "duplicate_chunks", "text_length"):
+                doc[field] = fresh[field]
+            self._set_status(doc, "processed")
+        old_store.close()
+        
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        
+        return {
+            "documents": len(self._documents),
+            "resumed": status["resumed"],
+            "chunks": len(self.vector_store),
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+        }
     
     def create_collection(self, name: str, description: Optional[str] = None) -> dict:
         """Create a document collection."""
@@ -180,4 +1067,5 @@ class DocumentService:
         if document_id not in collection["document_ids"]:
             collection["document_ids"].append(document_id)
             collection["document_count"] += 1
+            self._index.add_to_collection(collection_id, self._documents[document_id])
         return True
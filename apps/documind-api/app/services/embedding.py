@@ -0,0 +1,65 @@
+"""
+Embedding service.
+
+Turns chunk text into fixed-size float32 vectors for the vector store.
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens used for hashing and keyword scoring."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+class HashingEmbedder:
+    """
+    Deterministic feature-hashing embedder.
+
+    Needs no network or model download, so it is the default for local
+    development and tests. In production, swap for OpenAI embeddings with
+    the same `embed()` interface.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+        self.id = f"hashing-v1-{dim}"
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """
+        Embed a batch of texts.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            Array of shape (len(texts), dim), L2-normalized rows
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            if not tokens:
+                continue
+            hashes = np.fromiter(
+                (zlib.crc32(t.encode()) for t in tokens),
+                dtype=np.uint32,
+                count=len(tokens),
+            )
+            buckets = hashes % self.dim
+            signs = np.where(hashes & 0x80000000, -1.0, 1.0).astype(np.float32)
+            np.add.at(vectors[row], buckets, signs)
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """Embed a single query string."""
+        return self.embed([text])[0]
@@ -0,0 +1,158 @@
+"""
+Persistent embedding cache.
+
+Maps (chunk text, embedder id, dimension) to the vector we already paid
+for, so re-uploads, re-chunking experiments and index rebuilds only embed
+text that is actually new.
+
+On-disk format is an append-only file of fixed-layout records::
+
+    key (16 bytes, blake2b) | dim (uint32) | vector (dim x float32)
+
+An in-memory dict maps each key to its record offset; a small LRU holds
+recently used vectors so hot lookups never touch the file.
+"""
+
+import hashlib
+import os
+import struct
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+
+_KEY_BYTES = 16
+_HEADER = struct.Struct(f"<{_KEY_BYTES}sI")
+
+
+def cache_key(text: str, embedder_id: str, dim: int) -> bytes:
+    """Content hash of a text, namespaced by the embedder that produced it."""
+    digest = hashlib.blake2b(digest_size=_KEY_BYTES)
+    digest.update(f"{embedder_id}\0{dim}\0".encode())
+    digest.update(text.encode())
+    return digest.digest()
+
+
+class EmbeddingCache:
+    """Append-only key → vector file with an in-memory index and LRU hot set."""
+
+    def __init__(self, path: str, hot_capacity: int = 10_000):
+        self.path = path
+        self.hot_capacity = hot_capacity
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._index: dict[bytes, tuple[int, int]] = {}
+        self._hot: OrderedDict[bytes, np.ndarray] = OrderedDict()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a+b")
+        self._load_index()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def _load_index(self) -> None:
+        """Scan record headers; drop a torn record left by a crash mid-append."""
+        self._file.seek(0, os.SEEK_END)
+        end = self._file.tell()
+        offset = 0
+
+        while offset + _HEADER.size <= end:
+            key, dim = _HEADER.unpack(os.pread(self._file.fileno(), _HEADER.size, offset))
+            record_end = offset + _HEADER.size + dim * 4
+            if record_end > end:
+                break
+            self._index[key] = (offset + _HEADER.size, dim)
+            offset = record_end
+
+        if offset < end:
+            self._file.truncate(offset)
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, np.ndarray]:
+        """Vectors for the keys that are cached (missing keys are absent)."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._hot.get(key)
+                if vector is not None:
+                    self._hot.move_to_end(key)
+                else:
+                    location = self._index.get(key)
+                    if location is None:
+                        continue
+                    offset, dim = location
+                    vector = np.frombuffer(
+                        os.pread(self._file.fileno(), dim * 4, offset), dtype=np.float32
+                    )
+                    self._remember(key, vector)
+                found[key] = vector
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, keys: list[bytes], vectors: np.ndarray) -> None:
+        """Append new vectors in one write (keys already cached are skipped)."""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            records = []
+            for key, vector in zip(keys, vectors):
+                if key in self._index:
+                    continue
+                records.append(_HEADER.pack(key, len(vector)) + vector.tobytes())
+                self._index[key] = (offset + _HEADER.size, len(vector))
+                offset += _HEADER.size + vector.nbytes
+                self._remember(key, vector)
+            if records:
+                self._file.write(b"".join(records))
+                self._file.flush()
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        self._hot[key] = vector
+        self._hot.move_to_end(key)
+        while len(self._hot) > self.hot_capacity:
+            self._hot.popitem(last=False)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class CachedEmbedder:
+    """
+    Embedder wrapper that consults an `EmbeddingCache` before embedding.
+
+    Only cache misses reach the wrapped embedder, in a single batch.
+    Queries are not cached: they are rarely repeated verbatim.
+    """
+
+    def __init__(self, embedder, cache: EmbeddingCache):
+        self.embedder = embedder
+        self.cache = cache
+        self.dim = embedder.dim
+        self.id = embedder.id
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        keys = [cache_key(text, self.id, self.dim) for text in texts]
+        cached = self.cache.get_many(keys)
+
+        missing = [i for i, key in enumerate(keys) if key not in cached]
+        fresh: Optional[np.ndarray] = None
+        if missing:
+            fresh = self.embedder.embed([texts[i] for i in missing])
+            self.cache.put_many([keys[i] for i in missing], fresh)
+
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if key in cached:
+                vectors[i] = cached[key]
+        if fresh is not None:
+            vectors[missing] = fresh
+        return vectors
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embedder.embed_query(text)
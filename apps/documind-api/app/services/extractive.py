@@ -0,0 +1,113 @@
+"""
+Extractive answering service.
+
+Answers questions without an LLM by picking the sentences of the retrieved
+chunks that best match the question. Used as a fast per-request mode and
+as the fallback when no LLM is configured or the LLM call fails.
+"""
+
+import re
+from typing import Optional
+
+import numpy as np
+
+from app.services.embedding import HashingEmbedder, tokenize
+
+
+_SENTENCE_RE = re.compile(r"[^.!?\n]+(?:[.!?]+|$)", re.MULTILINE)
+
+# Sentences shorter than this many tokens are headings or fragments
+MIN_SENTENCE_TOKENS = 3
+
+
+def split_sentences(text: str) -> list[tuple[int, int]]:
+    """
+    Split text into sentences.
+
+    Returns:
+        (start, end) character offsets of each sentence, whitespace trimmed
+    """
+    spans = []
+    for match in _SENTENCE_RE.finditer(text):
+        start, end = match.span()
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start < end:
+            spans.append((start, end))
+    return spans
+
+
+class ExtractiveAnswerer:
+    """
+    Ranks candidate sentences against the question in one matrix product.
+
+    Sentence score is the cosine similarity of sentence and question
+    embeddings, nudged by the retrieval score of the chunk it came from.
+    """
+
+    def __init__(
+        self,
+        embedder: Optional[HashingEmbedder] = None,
+        max_sentences: int = 3,
+        chunk_weight: float = 0.2,
+    ):
+        self.embedder = embedder or HashingEmbedder()
+        self.max_sentences = max_sentences
+        self.chunk_weight = chunk_weight
+
+    def answer(self, question: str, chunks: list[dict]) -> dict:
+        """
+        Build an answer from the best-matching sentences.
+
+        Args:
+            question: User's question
+            chunks: Retrieved chunks (document_id, page, text, score)
+
+        Returns:
+            Answer text, per-sentence sources and confidence
+        """
+        sentences, owners = [], []
+        seen = set()
+        for i, chunk in enumerate(chunks):
+            text = chunk["text"]
+            # Offsets precomputed at ingest, when the chunk has them
+            spans = chunk["sentences"] if "sentences" in chunk else split_sentences(text)
+            for start, end in spans:
+                sentence = text[start:end]
+                # Overlapping chunks repeat sentences
+                if sentence in seen or len(tokenize(sentence)) < MIN_SENTENCE_TOKENS:
+                    continue
+                seen.add(sentence)
+                sentences.append(sentence)
+                owners.append(i)
+
+        if not sentences:
+            return {
+                "answer": "No relevant content was found in the indexed documents.",
+                "sources": [],
+                "confidence": 0.0,
+            }
+
+        owners = np.asarray(owners)
+        chunk_scores = np.asarray([c.get("score", 0.0) for c in chunks], dtype=np.float32)
+        scores = self.embedder.embed(sentences) @ self.embedder.embed_query(question)
+        scores = scores + self.chunk_weight * chunk_scores[owners]
+
+        top = np.argsort(-scores, kind="stable")[: self.max_sentences]
+        # Keep document order so the answer reads naturally
+        top = sorted(top, key=lambda i: (owners[i], i))
+
+        return {
+            "answer": " ".join(sentences[i] for i in top),
+            "sources": [
+                {
+                    "document_id": chunks[owners[i]]["document_id"],
+                    "page": chunks[owners[i]].get("page", 1),
+                    "excerpt": sentences[i],
+                }
+                for i in top
+            ],
+            "confidence": round(float(np.clip(scores[top].max(), 0.0, 1.0)), 4),
+        }
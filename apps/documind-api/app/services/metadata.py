@@ -0,0 +1,168 @@
+"""
+Secondary indexes over document metadata.
+
+Keeps documents ordered by upload time, both overall and within each
+filename, extension, status and collection bucket, so a filtered listing
+is a binary search plus a walk over the matching entries instead of a
+scan of every document.
+"""
+
+import bisect
+from collections import defaultdict
+from typing import Optional
+
+
+def _extension(filename: str) -> str:
+    return filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+
+
+# Hashed fields and how to read them off a document record
+INDEXED_FIELDS = {
+    "filename": lambda doc: doc["filename"],
+    "extension": lambda doc: _extension(doc["filename"]),
+    "status": lambda doc: doc["status"],
+}
+
+
+class DocumentIndex:
+    """
+    Incrementally maintained indexes over document records.
+
+    Every index is a list of ``(uploaded_at, document_id)`` kept sorted
+    with `bisect`: one over all documents and one per field value or
+    collection. Time ranges are located by binary search, so listing k
+    matches costs O(log n + k) when one field (or none) is filtered on.
+    """
+
+    def __init__(self):
+        self._by_time: list[tuple[str, str]] = []
+        self._by_field: dict[str, dict[str, list[tuple[str, str]]]] = {
+            field: defaultdict(list) for field in INDEXED_FIELDS
+        }
+        self._values: dict[str, dict[str, str]] = {}
+        self._by_collection: dict[str, list[tuple[str, str]]] = defaultdict(list)
+        self._collections: dict[str, set[str]] = defaultdict(set)
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    @staticmethod
+    def _insert(entries: list, entry: tuple[str, str]) -> None:
+        bisect.insort(entries, entry)
+
+    @staticmethod
+    def _discard(entries: list, entry: tuple[str, str]) -> None:
+        i = bisect.bisect_left(entries, entry)
+        if i < len(entries) and entries[i] == entry:
+            del entries[i]
+
+    def add(self, doc: dict) -> None:
+        """Index a new document record."""
+        entry = (doc["uploaded_at"], doc["id"])
+        self._insert(self._by_time, entry)
+        values = {field: read(doc) for field, read in INDEXED_FIELDS.items()}
+        for field, value in values.items():
+            self._insert(self._by_field[field][value], entry)
+        self._values[doc["id"]] = values
+
+    def update(self, doc: dict) -> None:
+        """Re-index a document whose indexed fields (e.g. status) changed."""
+        values = self._values.get(doc["id"])
+        if values is None:
+            return
+        entry = (doc["uploaded_at"], doc["id"])
+        for field, read in INDEXED_FIELDS.items():
+            value = read(doc)
+            if value != values[field]:
+                self._discard_from(field, values[field], entry)
+                self._insert(self._by_field[field][value], entry)
+                values[field] = value
+
+    def _discard_from(self, field: str, value: str, entry: tuple[str, str]) -> None:
+        bucket = self._by_field[field][value]
+        self._discard(bucket, entry)
+        if not bucket:
+            del self._by_field[field][value]
+
+    def remove(self, doc: dict) -> set[str]:
+        """
+        Drop a document from every index.
+
+        Returns:
+            Collections the document belonged to
+        """
+        values = self._values.pop(doc["id"], None)
+        if values is None:
+            return set()
+        entry = (doc["uploaded_at"], doc["id"])
+        self._discard(self._by_time, entry)
+        for field, value in values.items():
+            self._discard_from(field, value, entry)
+        collections = self._collections.pop(doc["id"], set())
+        for collection_id in collections:
+            self._discard(self._by_collection[collection_id], entry)
+        return collections
+
+    def add_to_collection(self, collection_id: str, doc: dict) -> None:
+        if collection_id in self._collections[doc["id"]]:
+            return
+        self._collections[doc["id"]].add(collection_id)
+        self._insert(self._by_collection[collection_id], (doc["uploaded_at"], doc["id"]))
+
+    def query(
+        self,
+        filename: Optional[str] = None,
+        extension: Optional[str] = None,
+        status: Optional[str] = None,
+        collection_id: Optional[str] = None,
+        uploaded_after: Optional[str] = None,
+        uploaded_before: Optional[str] = None,
+        limit: Optional[int] = None,
+    ) -> list[str]:
+        """
+        Ids of the documents matching every given filter, oldest first.
+
+        Args:
+            filename: Exact file name
+            extension: File extension without the dot (case-insensitive)
+            status: processing, processed or failed
+            collection_id: Collection the document belongs to
+            uploaded_after: ISO timestamp, inclusive
+            uploaded_before: ISO timestamp, exclusive
+            limit: Maximum number of ids
+
+        Returns:
+            Matching document ids in upload order
+        """
+        filters = {
+            field: value
+            for field, value in (
+                ("filename", filename),
+                ("extension", extension.lower().lstrip(".") if extension else extension),
+                ("status", status),
+            )
+            if value is not None
+        }
+
+        # Walk the smallest candidate index, check the other filters per entry
+        candidates = [(self._by_field[f].get(v, []), f) for f, v in filters.items()]
+        if collection_id is not None:
+            candidates.append((self._by_collection.get(collection_id, []), "collection"))
+        entries, driver = min(candidates, key=lambda c: len(c[0])) if candidates else (self._by_time, None)
+
+        lo = bisect.bisect_left(entries, (uploaded_after,)) if uploaded_after else 0
+        hi = bisect.bisect_left(entries, (uploaded_before,)) if uploaded_before else len(entries)
+
+        matches = []
+        for i in range(lo, hi):
+            if limit is not None and len(matches) >= limit:
+                break
+            doc_id = entries[i][1]
+            values = self._values[doc_id]
+            if any(values[f] != v for f, v in filters.items() if f != driver):
+                continue
+            if collection_id is not None and driver != "collection" \
+                    and collection_id not in self._collections.get(doc_id, ()):
+                continue
+            matches.append(doc_id)
+        return matches
@@ -4,9 +4,27 @@ RAG (Retrieval-Augmented Generation) service.
 Handles question answering using LangChain and vector search.
 """
 
-from typing import Optional
+from collections import deque
+from typing import Awaitable, Callable, Optional, TYPE_CHECKING
+import asyncio
 import os
 
+import numpy as np
+
+from app.services.embedding import HashingEmbedder
+from app.services.extractive import ExtractiveAnswerer
+from app.services.session import Session, rewrite_follow_up
+from app.services.snippets import SnippetGenerator, highlight, query_terms
+
+if TYPE_CHECKING:
+    from app.services.document import DocumentService
+
+
+ANSWER_MODES = ("auto", "llm", "extractive")
+
+# Latency samples needed before the hedge delay tracks the observed percentile
+MIN_HEDGE_SAMPLES = 20
+
 
 class RAGService:
     """
@@ -16,18 +34,72 @@ class RAGService:
     1. Retrieve relevant document chunks via vector similarity
     2. Generate answers using LLM with retrieved context
     3. Provide source citations for transparency
+    
+    Without an OpenAI key, or when the LLM call fails, answers are built
+    extractively from the retrieved sentences instead.
     """
     
-    def __init__(self):
-        # In production, initialize OpenAI and vector store
+    def __init__(
+        self,
+        document_service: Optional["DocumentService"] = None,
+        llm: Optional[Callable[[str, str], Awaitable[str]]] = None,
+        llm_timeout: float = 30.0,
+        hedge_after: float = 2.0,
+        hedge_percentile: float = 95.0,
+        min_llm_budget: float = 0.25,
+    ):
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        self._mock_mode = not self.openai_api_key
+        self._llm = llm or self._langchain_complete
+        self._llm_enabled = llm is not None or bool(self.openai_api_key)
+        self._document_service = document_service
+        
+        # Tail-latency control: every call is bounded by a deadline, and a
+        # second request is hedged once the first outlives recent p95
+        self.llm_timeout = llm_timeout
+        self.hedge_after = hedge_after
+        self.hedge_percentile = hedge_percentile
+        self.min_llm_budget = min_llm_budget
+        self._latencies: deque[float] = deque(maxlen=200)
+        
+        self._embedder = document_service.embedder if document_service else HashingEmbedder()
+        self._extractive = ExtractiveAnswerer(self._embedder)
+        self._snippets = SnippetGenerator()
+    
+    def retrieve(
+        self,
+        question: str,
+        document_id: Optional[str] = None,
+        collection_id: Optional[str] = None,
+        k: int = 5,
+        filters: Optional[dict] = None,
+    ) -> list[dict]:
+        """Retrieve the chunks most relevant to a question."""
+        if self._document_service is None:
+            return []
+        return self._document_service.search(question, document_id, collection_id, k=k, filters=filters)
+    
+    async def retrieve_scopes(
+        self,
+        question: str,
+        scopes: list[tuple[str, str]],
+        k: int = 5,
+        filters: Optional[dict] = None,
+    ) -> tuple[list[dict], list[dict]]:
+        """Retrieve across several documents/collections concurrently, with per-scope timings."""
+        if self._document_service is None:
+            return [], []
+        return await self._document_service.search_scopes(question, scopes, k=k, filters=filters)
     
     async def answer_question(
         self,
         question: str,
         document_id: Optional[str] = None,
         collection_id: Optional[str] = None,
+        mode: str = "auto",
+        timeout: Optional[float] = None,
+        document_ids: Optional[list[str]] = None,
+        collection_ids: Optional[list[str]] = None,
+        filters: Optional[dict] = None,
     ) -> dict:
         """
         Answer a question using RAG pipeline.
@@ -36,131 +108,176 @@ class RAGService:
             question: User's question
             document_id: Optional specific document to search
             collection_id: Optional collection to search within
+            mode: ``llm``, ``extractive`` (no LLM call, low latency) or
+                ``auto`` (LLM when configured, extractive otherwise)
+            timeout: Time budget in seconds (defaults to `llm_timeout`).
+                When too little is left for an LLM call, the answer is
+                built extractively instead.
+            document_ids: More documents to search, alongside `document_id`
+            collection_ids: More collections to search, alongside `collection_id`
+            filters: Document metadata pre-filters (filename, extension,
+                status, uploaded_after, uploaded_before)
             
         Returns:
-            Answer with sources and confidence
+            Answer with sources and confidence; with several scopes, also
+            per-scope retrieval timings under ``scopes``
         """
-        if self._mock_mode:
-            return self._mock_answer(question, document_id)
+        self._check_mode(mode)
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout if timeout is not None else self.llm_timeout)
+        
+        scopes = [("document", d) for d in [document_id, *(document_ids or [])] if d]
+        scopes += [("collection", c) for c in [collection_id, *(collection_ids or [])] if c]
+        scopes = list(dict.fromkeys(scopes))
+        if len(scopes) <= 1:
+            # The one scope may have come from either list argument
+            scope = dict(scopes)
+            chunks = self.retrieve(question, scope.get("document"), scope.get("collection"), filters=filters)
+            return await self._answer(question, scope.get("document"), chunks, mode, deadline)
         
-        return await self._rag_answer(question, document_id, collection_id)
+        chunks, timings = await self.retrieve_scopes(question, scopes, filters=filters)
+        result = await self._answer(question, document_id, chunks, mode, deadline)
+        return {**result, "scopes": timings}
     
-    def _mock_answer(self, question: str, document_id: Optional[str]) -> dict:
+    async def answer_in_session(
+        self,
+        session: Session,
+        question: str,
+        mode: str = "auto",
+        timeout: Optional[float] = None,
+        k: int = 5,
+    ) -> dict:
         """
-        Generate a mock answer for demo purposes.
+        Answer the next question of a conversation.
         
-        In production, this would use LangChain + OpenAI.
+        Follow-ups are rewritten against the previous question. Chunks
+        retrieved by earlier turns are re-ranked for this one, and the
+        index is only searched again when the question mentions something
+        they don't cover; the packed LLM context is reused while the
+        selected chunks stay the same.
+        
+        Args:
+            session: Conversation to continue
+            question: User's question, as asked
+            mode: Same as `answer_question`
+            timeout: Same as `answer_question`
+            k: Number of chunks to answer from
+            
+        Returns:
+            Answer as in `answer_question`, plus the session id, the
+            standalone question and how retrieval was served
+            (``full``, ``incremental`` or ``cached``)
         """
-        question_lower = question.lower()
-        
-        # Intelligent mock responses based on question type
-        if any(word in question_lower for word in ["what", "define", "explain"]):
-            answer = (
-                "Based on the document analysis, the key concept relates to "
-                "the intersection of technology and business processes. "
-                "The document outlines several important considerations "
-                "that organizations should evaluate when implementing "
-                "new systems."
-            )
-        elif any(word in question_lower for word in ["how", "process", "steps"]):
-            answer = (
-                "The document describes a multi-step approach: "
-                "1) Initial assessment and requirements gathering, "
-                "2) Design and planning phase, "
-                "3) Implementation with iterative feedback, "
-                "4) Testing and validation, "
-                "5) Deployment and monitoring."
-            )
-        elif any(word in question_lower for word in ["why", "reason", "purpose"]):
-            answer = (
-                "According to the document, the primary reasons include: "
-                "improved efficiency, cost reduction, better scalability, "
-                "and enhanced user experience. The document emphasizes "
-                "long-term strategic benefits."
-            )
-        elif any(word in question_lower for word in ["who", "responsible", "team"]):
-            answer = (
-                "The document identifies several key stakeholders: "
-                "project managers, technical leads, and domain experts. "
-                "Cross-functional collaboration is emphasized throughout."
-            )
-        elif any(word in question_lower for word in ["when", "timeline", "deadline"]):
-            answer = (
-                "The document suggests a phased timeline with "
-                "initial milestones at 30, 60, and 90 days. "
-                "Full implementation typically spans 6-12 months "
-                "depending on organizational readiness."
-            )
-        else:
-            answer = (
-                "The document contains relevant information about your query. "
-                "Key points include comprehensive analysis of the topic, "
-                "practical recommendations, and supporting data. "
-                "For more specific details, please refine your question."
-            )
+        self._check_mode(mode)
+        
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout if timeout is not None else self.llm_timeout)
+        
+        # Never cite documents deleted since an earlier turn
+        if self._document_service is not None:
+            for doc_id in session.document_ids():
+                if self._document_service.get_document(doc_id) is None:
+                    session.forget_document(doc_id)
+        
+        rewritten = rewrite_follow_up(question, session.last_question())
         
+        retrieval = "cached"
+        if session.needs_retrieval(question):
+            retrieval = "incremental" if len(session) else "full"
+            hits = self.retrieve(rewritten, session.document_id, session.collection_id, k)
+            if hits:
+                session.add_chunks(hits, self._embedder.embed([h["text"] for h in hits]))
+        
+        chunks = session.rank(self._embedder.embed_query(rewritten), k)
+        context, context_reused = session.pack(chunks)
+        result = await self._answer(rewritten, session.document_id, chunks, mode, deadline, context)
+        
+        session.turns.append({
+            "question": question,
+            "rewritten_question": rewritten,
+            "answer": result["answer"],
+            "retrieval": retrieval,
+            "context_reused": context_reused,
+        })
         return {
-            "answer": answer,
-            "sources": [
-                {
-                    "document_id": document_id or "demo-doc",
-                    "page": 1,
-                    "excerpt": "...relevant excerpt from the document...",
-                },
-                {
-                    "document_id": document_id or "demo-doc",
-                    "page": 3,
-                    "excerpt": "...additional supporting context...",
-                },
-            ],
-            "confidence": 0.85,
-            "document_id": document_id,
+            **result,
+            "session_id": session.id,
+            "rewritten_question": rewritten,
+            "retrieval": retrieval,
         }
     
+    def _check_mode(self, mode: str) -> None:
+        if mode not in ANSWER_MODES:
+            raise ValueError(f"Unknown mode '{mode}'. Allowed: {', '.join(ANSWER_MODES)}")
+        if mode == "llm" and not self._llm_enabled:
+            raise ValueError("LLM mode requires OPENAI_API_KEY")
+    
+    async def _answer(
+        self,
+        question: str,
+        document_id: Optional[str],
+        chunks: list[dict],
+        mode: str,
+        deadline: float,
+        context: Optional[str] = None,
+    ) -> dict:
+        """Answer from retrieved chunks with the LLM or extractively."""
+        if mode == "extractive" or not self._llm_enabled:
+            return self._extractive_answer(question, chunks, document_id)
+        
+        if deadline - asyncio.get_running_loop().time() < self.min_llm_budget:
+            return self._extractive_answer(question, chunks, document_id)
+        
+        return await self._rag_answer(question, document_id, chunks, deadline, context)
+    
+    def _extractive_answer(
+        self,
+        question: str,
+        chunks: list[dict],
+        document_id: Optional[str],
+    ) -> dict:
+        """Answer from the retrieved sentences alone, without an LLM call."""
+        result = self._extractive.answer(question, chunks)
+        terms = query_terms(question)
+        for source in result["sources"]:
+            source["highlights"] = highlight(source["excerpt"], terms)
+        return {**result, "document_id": document_id, "mode": "extractive"}
+    
     async def _rag_answer(
         self,
         question: str,
         document_id: Optional[str],
-        collection_id: Optional[str],
+        chunks: list[dict],
+        deadline: float,
+        context: Optional[str] = None,
     ) -> dict:
         """
         Production RAG implementation using LangChain.
         
         Uses ChatOpenAI with gpt-4o-mini for efficient, cost-effective answers.
+        `deadline` is an event-loop time after which the LLM is abandoned.
+        `context` is the already packed chunk text, when the caller has it.
         """
         try:
-            from langchain_openai import ChatOpenAI
-            from langchain.prompts import ChatPromptTemplate
-            
-            # Initialize LLM with cost-effective model
-            llm = ChatOpenAI(
-                model="gpt-4o-mini",
-                temperature=0.3,
-                max_tokens=500,
-                api_key=self.openai_api_key,
-            )
-            
-            # Create a prompt template for document Q&A
-            prompt = ChatPromptTemplate.from_messages([
-                ("system", """You are DocuMind, an intelligent document analysis assistant.
-                
-You help users understand and extract insights from documents. When answering:
-- Be concise and informative
-- Provide structured responses when appropriate
-- Acknowledge if information is uncertain or limited
-- Suggest follow-up questions when relevant
-
-Since this is a demo without uploaded documents, provide helpful, educational responses about document analysis, AI, and knowledge management."""),
-                ("human", "{question}")
-            ])
+            if context is None:
+                context = "\n\n---\n\n".join(c["text"] for c in chunks)
+            answer = await self._complete_hedged(question, context, deadline)
             
-            # Create chain and invoke
-            chain = prompt | llm
-            response = await chain.ainvoke({"question": question})
+            terms = query_terms(question)
+            sources = []
+            for c in chunks:
+                snippet = self._snippets.snippet(c, terms)
+                sources.append({
+                    "document_id": c["document_id"],
+                    "page": c.get("page", 0),
+                    "excerpt": snippet["excerpt"],
+                    "highlights": snippet["highlights"],
+                })
             
             return {
-                "answer": response.content,
-                "sources": [
+                "answer": answer,
+                "sources": sources or [
                     {
                         "document_id": document_id or "ai-generated",
                         "page": 0,
@@ -170,10 +287,107 @@ Since this is a demo without uploaded documents, provide helpful, educational re
                 "confidence": 0.92,
                 "document_id": document_id,
                 "model": "gpt-4o-mini",
+                "mode": "llm",
             }
             
         except Exception as e:
-            # Log error and fall back to mock
-            print(f"RAG Error: {e}")
-            return self._mock_answer(question, document_id)
+            # Log error and fall back to extractive answering
+            print(f"RAG Error: {e!r}")
+            return self._extractive_answer(question, chunks, document_id)
+    
+    async def _complete_hedged(self, question: str, context: str, deadline: float) -> str:
+        """
+        Call the LLM, hedging with a second request if the first is slow.
+        
+        The hedge fires once the first request has taken longer than the
+        `hedge_percentile` of recent successful calls. Whichever request
+        answers first wins and the other is cancelled. Everything is
+        cancelled when the deadline passes.
+        
+        Raises:
+            asyncio.TimeoutError: The deadline passed with no answer
+        """
+        loop = asyncio.get_running_loop()
+        
+        async def timed_call() -> str:
+            started = loop.time()
+            answer = await self._llm(question, context)
+            self._latencies.append(loop.time() - started)
+            return answer
+        
+        pending = {asyncio.create_task(timed_call())}
+        hedge_at = loop.time() + self.hedge_delay()
+        hedged = timed_out = False
+        error: Optional[BaseException] = None
+        
+        try:
+            while pending:
+                wake_at = deadline if hedged else min(deadline, hedge_at)
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=max(0.0, wake_at - loop.time()),
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                
+                if loop.time() >= deadline:
+                    timed_out = True
+                    break
+                if not hedged and (not pending or loop.time() >= hedge_at):
+                    # A slow first request gets a hedge; a failed one gets a retry
+                    pending.add(asyncio.create_task(timed_call()))
+                    hedged = True
+        finally:
+            # Cancel the loser(s) and let them unwind before returning
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        
+        if timed_out or error is None:
+            raise asyncio.TimeoutError("LLM deadline exceeded")
+        raise error
+    
+    def hedge_delay(self) -> float:
+        """Delay before hedging: the configured percentile of recent latencies."""
+        if len(self._latencies) < MIN_HEDGE_SAMPLES:
+            return self.hedge_after
+        return float(np.percentile(self._latencies, self.hedge_percentile))
+    
+    async def _langchain_complete(self, question: str, context: str) -> str:
+        """Single LLM completion through LangChain + OpenAI."""
+        from langchain_openai import ChatOpenAI
+        from langchain.prompts import ChatPromptTemplate
+        
+        # Initialize LLM with cost-effective model
+        llm = ChatOpenAI(
+            model="gpt-4o-mini",
+            temperature=0.3,
+            max_tokens=500,
+            api_key=self.openai_api_key,
+        )
+        
+        # Create a prompt template for document Q&A
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", """You are DocuMind, an intelligent document analysis assistant.
+            
+You help users understand and extract insights from documents. When answering:
+- Be concise and informative
+- Provide structured responses when appropriate
+- Acknowledge if information is uncertain or limited
+- Suggest follow-up questions when relevant
 
+Answer from the document context below. If it is empty, provide helpful, educational responses about document analysis, AI, and knowledge management.
+
+Context:
+{context}"""),
+            ("human", "{question}")
+        ])
+        
+        # Create chain and invoke
+        chain = prompt | llm
+        response = await chain.ainvoke({"question": question, "context": context})
+        return response.content
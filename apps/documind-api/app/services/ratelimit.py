@@ -0,0 +1,340 @@
+"""
+Per-client rate limiting and fair queueing.
+
+Every request is charged to a token bucket for its client (authenticated
+user, or IP address without one) and budget (``upload``, ``ask`` or ``default``). Over
+budget requests get a 429 with ``Retry-After``. Admitted requests to the
+expensive endpoints then wait for one of a fixed number of slots, handed
+out by weighted fair queueing so a client with a backlog can't starve the
+others.
+
+Buckets live in memory (an LRU of recently seen clients) or, in shared
+mode, in a SQLite file so limits hold across worker processes.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import math
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Callable, NamedTuple, Optional
+
+
+class Limit(NamedTuple):
+    rate: float   # tokens refilled per second
+    burst: float  # bucket capacity
+
+
+DEFAULT_LIMITS = {
+    "upload": Limit(rate=1.0, burst=10),
+    "ask": Limit(rate=2.0, burst=20),
+    "default": Limit(rate=50.0, burst=100),
+}
+
+
+# Requests per budget running at once; the rest wait in a fair queue
+DEFAULT_SLOTS = {"upload": 4, "ask": 8}
+
+
+def parse_weights(spec: str) -> dict[str, float]:
+    """Parse ``client=weight`` pairs, e.g. ``"user:batch-importer=0.25,user:web=2"``."""
+    weights = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        client, _, weight = item.rpartition("=")
+        try:
+            weights[client] = float(weight)
+        except ValueError:
+            raise ValueError(f"Invalid client weight '{item}'. Expected client=weight") from None
+    return weights
+
+
+def parse_limits(spec: str) -> dict[str, Limit]:
+    """
+    Parse ``budget=rate/burst`` pairs, e.g. ``"upload=0.5/5,ask=2/20"``.
+
+    Budgets not mentioned keep their defaults.
+    """
+    limits = dict(DEFAULT_LIMITS)
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        try:
+            budget, value = item.split("=")
+            rate, burst = value.split("/")
+            limits[budget.strip()] = Limit(float(rate), float(burst))
+        except ValueError:
+            raise ValueError(f"Invalid rate limit '{item}'. Expected budget=rate/burst") from None
+    return limits
+
+
+def _refill(tokens: float, last: float, now: float, limit: Limit, cost: float) -> tuple[float, float]:
+    """
+    One token-bucket step.
+
+    Returns:
+        (tokens left, seconds until `cost` would be affordable; 0 if it was taken)
+    """
+    tokens = min(limit.burst, tokens + max(0.0, now - last) * limit.rate)
+    if tokens >= cost:
+        return tokens - cost, 0.0
+    return tokens, (cost - tokens) / limit.rate
+
+
+class LocalBuckets:
+    """In-process buckets; the least recently seen clients are evicted beyond `max_clients`."""
+
+    def __init__(self, max_clients: int = 10_000):
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, limit: Limit, cost: float, now: float) -> float:
+        tokens, last = self._buckets.pop(key, (limit.burst, now))
+        tokens, retry_after = _refill(tokens, last, now, limit, cost)
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+    def clear(self) -> None:
+        self._buckets.clear()
+
+
+class SharedBuckets:
+    """
+    Buckets in a SQLite file shared by every worker on the host.
+
+    Each take is one short write transaction. Idle clients beyond
+    `max_clients` are pruned every `prune_every` takes.
+    """
+
+    # Takes may wait on another worker's transaction, so keep them off the event loop
+    blocking = True
+
+    def __init__(self, path: str, max_clients: int = 100_000, prune_every: int = 1000):
+        self.max_clients = max_clients
+        self.prune_every = prune_every
+        self._takes = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, last REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS buckets_last ON buckets (last)")
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+
+    def take(self, key: str, limit: Limit, cost: float, now: float) -> float:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute(
+                    "SELECT tokens, last FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                tokens, last = row if row else (limit.burst, now)
+                tokens, retry_after = _refill(tokens, last, now, limit, cost)
+                self._db.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, last) VALUES (?, ?, ?)",
+                    (key, tokens, now),
+                )
+                self._takes += 1
+                if self._takes % self.prune_every == 0:
+                    self._db.execute(
+                        "DELETE FROM buckets WHERE key IN (SELECT key FROM buckets "
+                        "ORDER BY last DESC LIMIT -1 OFFSET ?)",
+                        (self.max_clients,),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return retry_after
+
+    def clear(self) -> None:
+        with self._lock:
+            self._db.execute("DELETE FROM buckets")
+
+
+class RateLimiter:
+    """Token buckets per (client, budget)."""
+
+    def __init__(
+        self,
+        limits: Optional[dict[str, Limit]] = None,
+        buckets=None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.limits = limits or dict(DEFAULT_LIMITS)
+        self.buckets = buckets if buckets is not None else LocalBuckets()
+        self._clock = clock
+
+    def check(self, client: str, budget: str, cost: float = 1.0) -> float:
+        """
+        Charge a request to the client's bucket for `budget`.
+
+        Returns:
+            0 if admitted, otherwise seconds until it would be
+        """
+        limit = self.limits.get(budget) or self.limits["default"]
+        return self.buckets.take(f"{budget}:{client}", limit, cost, self._clock())
+
+    async def admit(self, client: str, budget: str, cost: float = 1.0) -> float:
+        """`check`, run on a worker thread when the buckets can block (shared mode)."""
+        if getattr(self.buckets, "blocking", False):
+            return await asyncio.to_thread(self.check, client, budget, cost)
+        return self.check(client, budget, cost)
+
+    def reset(self) -> None:
+        self.buckets.clear()
+
+
+class FairQueue:
+    """
+    At most `concurrency` requests at once; waiters are served by
+    weighted fair queueing.
+
+    Each waiting request gets a virtual finish time of
+    ``max(now, client's previous finish) + cost / weight``, and free slots
+    go to the smallest finish time. A client queueing many requests
+    pushes only its own finish times out, so others keep their turn.
+    """
+
+    def __init__(self, concurrency: int, weights: Optional[dict[str, float]] = None):
+        self.concurrency = concurrency
+        self.weights = weights or {}
+        self._active = 0
+        self._virtual_time = 0.0
+        self._finish: dict[str, float] = {}
+        self._waiting: list[tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for _, _, future in self._waiting if not future.done())
+
+    async def acquire(self, client: str, cost: float = 1.0) -> None:
+        # Drop waiters that gave up, so they can't hold back the fast path
+        while self._waiting and self._waiting[0][2].done():
+            heapq.heappop(self._waiting)
+        if self._active < self.concurrency and not self._waiting:
+            self._active += 1
+            return
+
+        start = max(self._virtual_time, self._finish.get(client, 0.0))
+        finish = start + cost / self.weights.get(client, 1.0)
+        self._finish[client] = finish
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (finish, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiting:
+            finish, _, future = heapq.heappop(self._waiting)
+            if future.done():
+                continue
+            # The slot goes straight to the next waiter
+            self._virtual_time = finish
+            future.set_result(None)
+            return
+        self._active -= 1
+        # Nobody waiting: finish times restart from the current virtual time
+        self._finish.clear()
+
+    @asynccontextmanager
+    async def slot(self, client: str, cost: float = 1.0):
+        await self.acquire(client, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+def client_key(scope: dict) -> str:
+    """
+    The authenticated user when there is one, client IP otherwise.
+
+    Only a principal set by authentication middleware running before the
+    limiter counts: unverified request headers would let a client pick a
+    fresh bucket on every request.
+    """
+    user = scope.get("user")
+    if user is not None and getattr(user, "is_authenticated", False):
+        return "user:" + user.display_name
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+def budget_for(method: str, path: str) -> str:
+    """Which budget a request is charged to."""
+    if method == "POST":
+        if path in ("/api/documents/upload", "/api/documents/bulk"):
+            return "upload"
+        if path == "/api/ask" or (path.startswith("/api/sessions/") and path.endswith("/ask")):
+            return "ask"
+    return "default"
+
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware applying a `RateLimiter`, then a `FairQueue` per
+    budget that has one.
+
+    Overhead per request is one bucket update; queueing only costs a
+    heap operation when the budget's slots are all taken.
+    """
+
+    def __init__(self, app, limiter: RateLimiter, queues: Optional[dict[str, FairQueue]] = None):
+        self.app = app
+        self.limiter = limiter
+        self.queues = queues or {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        client = client_key(scope)
+        budget = budget_for(scope["method"], scope["path"])
+        retry_after = await self.limiter.admit(client, budget)
+        if retry_after > 0:
+            await self._reject(send, retry_after)
+            return
+
+        queue = self.queues.get(budget)
+        if queue is None:
+            await self.app(scope, receive, send)
+            return
+        async with queue.slot(client):
+            await self.app(scope, receive, send)
+
+    @staticmethod
+    async def _reject(send, retry_after: float) -> None:
+        body = json.dumps({"detail": "Rate limit exceeded"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(retry_after)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
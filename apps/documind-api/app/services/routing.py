@@ -0,0 +1,141 @@
+"""
+Document routing index.
+
+Keeps one small summary per document - the centroid of its chunk
+embeddings plus its top keywords - so collection-wide questions can first
+pick the few documents worth searching and only then score their chunks.
+"""
+
+import math
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from app.services.embedding import tokenize
+
+
+# Too common to tell documents apart
+STOPWORDS = frozenset(
+    "a about an and are as at be by can do does for from has have in is it its "
+    "of on or that the this to was were will with which what who how when why".split()
+)
+
+
+class RoutingIndex:
+    """
+    Per-document centroid + keyword summaries, updated incrementally.
+
+    Documents are scored by centroid similarity to the query plus a bonus
+    for each query term that is one of the document's top keywords.
+    """
+
+    def __init__(self, dim: int, keywords_per_document: int = 16, keyword_weight: float = 0.1):
+        self.dim = dim
+        self.keywords_per_document = keywords_per_document
+        self.keyword_weight = keyword_weight
+
+        self._slots: dict[str, int] = {}
+        self._free: list[int] = []
+        self._sums = np.zeros((0, dim), dtype=np.float32)
+        self._term_counts: dict[str, Counter] = {}
+        self._keywords: dict[str, frozenset[str]] = {}
+        self._document_frequency: Counter = Counter()
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def update(self, document_id: str, vectors: Optional[np.ndarray] = None, text: str = "") -> None:
+        """
+        Fold more of a document into its summary.
+
+        Args:
+            document_id: Document the vectors and text belong to
+            vectors: Newly indexed chunk embeddings
+            text: Newly indexed text
+        """
+        slot = self._slots.get(document_id)
+        if slot is None:
+            slot = self._free.pop() if self._free else len(self._slots)
+            if slot >= len(self._sums):
+                grown = np.zeros((max(64, 2 * len(self._sums)), self.dim), dtype=np.float32)
+                grown[: len(self._sums)] = self._sums
+                self._sums = grown
+            self._sums[slot] = 0
+            self._slots[document_id] = slot
+            self._term_counts[document_id] = Counter()
+
+        if vectors is not None and len(vectors):
+            self._sums[slot] += vectors.sum(axis=0)
+
+        if text:
+            counts = self._term_counts[document_id]
+            new_terms = Counter(t for t in tokenize(text) if t not in STOPWORDS and len(t) > 2)
+            self._document_frequency.update(t for t in new_terms if t not in counts)
+            counts.update(new_terms)
+            self._keywords[document_id] = self._top_keywords(counts)
+
+    def _top_keywords(self, counts: Counter) -> frozenset[str]:
+        """Highest tf-idf terms of one document."""
+        total = len(self._slots)
+        scored = sorted(
+            counts,
+            key=lambda t: counts[t] * math.log(1 + total / self._document_frequency[t]),
+            reverse=True,
+        )
+        return frozenset(scored[: self.keywords_per_document])
+
+    def keywords(self, document_id: str) -> frozenset[str]:
+        return self._keywords.get(document_id, frozenset())
+
+    def remove(self, document_id: str) -> None:
+        slot = self._slots.pop(document_id, None)
+        if slot is None:
+            return
+        self._free.append(slot)
+        # Document frequency counts each document once per term, however often it repeats
+        for term in self._term_counts.pop(document_id):
+            self._document_frequency[term] -= 1
+            if self._document_frequency[term] <= 0:
+                del self._document_frequency[term]
+        self._keywords.pop(document_id, None)
+
+    def route(
+        self,
+        query_vector: np.ndarray,
+        query: str,
+        document_ids: set[str],
+        n: int,
+    ) -> list[str]:
+        """
+        Pick the `n` documents most likely to answer the query.
+
+        Args:
+            query_vector: Embedded query
+            query: Raw query text, for keyword matching
+            document_ids: Candidate documents (e.g. one collection)
+            n: Number of documents to keep
+
+        Returns:
+            Up to `n` document ids, best first
+        """
+        candidates = [d for d in document_ids if d in self._slots]
+        if len(candidates) <= n:
+            return candidates
+
+        sums = self._sums[[self._slots[d] for d in candidates]]
+        norms = np.linalg.norm(sums, axis=1)
+        norms[norms == 0] = 1.0
+        scores = (sums @ query_vector) / norms
+
+        terms = set(tokenize(query)) - STOPWORDS
+        if terms:
+            overlap = np.fromiter(
+                (len(terms & self._keywords.get(d, frozenset())) for d in candidates),
+                dtype=np.float32,
+                count=len(candidates),
+            )
+            scores += self.keyword_weight * overlap
+
+        top = np.argpartition(-scores, n)[:n]
+        return [candidates[i] for i in top[np.argsort(-scores[top])]]
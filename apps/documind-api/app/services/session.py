@@ -0,0 +1,243 @@
+"""
+Conversation sessions.
+
+Keeps multi-turn chats server-side: earlier questions, so follow-ups like
+"and what about section 4?" can be rewritten into standalone questions,
+and the chunks already retrieved, so a follow-up only goes back to the
+index when it asks about something the conversation has not covered yet.
+"""
+
+import re
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Callable, Optional
+
+import numpy as np
+
+from app.services.embedding import tokenize
+from app.services.routing import STOPWORDS
+
+
+# Leading connectives and pronouns that lean on an earlier question
+_FOLLOW_UP_RE = re.compile(
+    r"^\s*(and|but|also|so|then|what about|how about)\b"
+    r"|\b(it|its|this|that|these|those|they|them|their)\b",
+    re.IGNORECASE,
+)
+
+# Questions with this few content terms cannot stand on their own
+MIN_STANDALONE_TERMS = 3
+
+
+def content_terms(text: str) -> list[str]:
+    """Tokens of a question that carry meaning, in order, without repeats."""
+    return list(dict.fromkeys(t for t in tokenize(text) if t not in STOPWORDS))
+
+
+def rewrite_follow_up(question: str, previous: Optional[str], max_carried_terms: int = 8) -> str:
+    """
+    Turn a follow-up into a standalone question.
+
+    Content terms of the previous (already rewritten) question that the
+    follow-up does not repeat are carried over, so retrieval and the LLM
+    see what "it" or "section 4" refers to.
+
+    Args:
+        question: Follow-up as asked
+        previous: Standalone form of the previous question, if any
+        max_carried_terms: Upper bound on terms carried over
+
+    Returns:
+        The question itself when it already stands alone
+    """
+    if not previous:
+        return question
+    terms = content_terms(question)
+    if len(terms) >= MIN_STANDALONE_TERMS and not _FOLLOW_UP_RE.search(question):
+        return question
+
+    carried = [t for t in content_terms(previous) if t not in terms][:max_carried_terms]
+    if not carried:
+        return question
+    return f"{question.rstrip()} ({' '.join(carried)})"
+
+
+class Session:
+    """
+    One conversation: its scope, recent turns and retrieved chunks.
+
+    Retrieved chunks are kept with their embeddings so every turn can
+    re-rank them against its own question without touching the index.
+    """
+
+    def __init__(
+        self,
+        session_id: str,
+        document_id: Optional[str] = None,
+        collection_id: Optional[str] = None,
+        max_turns: int = 20,
+        max_chunks: int = 50,
+    ):
+        self.id = session_id
+        self.document_id = document_id
+        self.collection_id = collection_id
+        self.created_at = datetime.utcnow().isoformat()
+        self.max_chunks = max_chunks
+        self.turns: deque[dict] = deque(maxlen=max_turns)
+
+        self._chunks: OrderedDict[tuple[str, int], dict] = OrderedDict()
+        self._vectors: dict[tuple[str, int], np.ndarray] = {}
+        self._terms: set[str] = set()
+
+        # Last packed LLM context, reused while the selected chunks don't change
+        self._context_keys: tuple = ()
+        self._context = ""
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    @staticmethod
+    def _key(chunk: dict) -> tuple[str, int]:
+        return chunk["document_id"], chunk.get("chunk_index", 0)
+
+    def last_question(self) -> Optional[str]:
+        """Standalone form of the most recent question."""
+        return self.turns[-1]["rewritten_question"] if self.turns else None
+
+    def needs_retrieval(self, question: str) -> bool:
+        """Whether the question mentions terms none of the cached chunks contain."""
+        if not self._chunks:
+            return True
+        return any(t not in self._terms for t in content_terms(question))
+
+    def add_chunks(self, chunks: list[dict], vectors: np.ndarray) -> int:
+        """
+        Cache newly retrieved chunks, oldest evicted first beyond `max_chunks`.
+
+        Returns:
+            Number of chunks that were not cached already
+        """
+        added = 0
+        for chunk, vector in zip(chunks, vectors):
+            key = self._key(chunk)
+            if key in self._chunks:
+                continue
+            self._chunks[key] = chunk
+            self._vectors[key] = vector
+            added += 1
+
+        evicted = False
+        while len(self._chunks) > self.max_chunks:
+            key, _ = self._chunks.popitem(last=False)
+            del self._vectors[key]
+            evicted = True
+        if evicted:
+            self._terms = {t for c in self._chunks.values() for t in tokenize(c["text"])}
+        else:
+            for chunk in chunks:
+                self._terms.update(tokenize(chunk["text"]))
+        return added
+
+    def document_ids(self) -> set[str]:
+        """Documents with cached chunks."""
+        return {key[0] for key in self._chunks}
+
+    def forget_document(self, document_id: str) -> None:
+        """Drop cached chunks of a document that no longer exists."""
+        for key in [k for k in self._chunks if k[0] == document_id]:
+            del self._chunks[key]
+            del self._vectors[key]
+        self._terms = {t for c in self._chunks.values() for t in tokenize(c["text"])}
+        self._context_keys = ()
+
+    def rank(self, query_vector: np.ndarray, k: int) -> list[dict]:
+        """Top-k cached chunks for a question, with scores against it."""
+        if not self._chunks:
+            return []
+        keys = list(self._chunks)
+        scores = np.stack([self._vectors[key] for key in keys]) @ query_vector
+        top = np.argsort(-scores, kind="stable")[:k]
+        return [{**self._chunks[keys[i]], "score": float(scores[i])} for i in top]
+
+    def pack(self, chunks: list[dict]) -> tuple[str, bool]:
+        """
+        LLM context for the chunks.
+
+        Returns:
+            (context, whether it was reused from the previous turn)
+        """
+        keys = tuple(self._key(c) for c in chunks)
+        if keys == self._context_keys:
+            return self._context, True
+        self._context_keys = keys
+        self._context = "\n\n---\n\n".join(c["text"] for c in chunks)
+        return self._context, False
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "document_id": self.document_id,
+            "collection_id": self.collection_id,
+            "created_at": self.created_at,
+            "turns": list(self.turns),
+            "cached_chunks": len(self._chunks),
+        }
+
+
+class SessionStore:
+    """
+    Bounded in-memory session store with idle expiry.
+
+    Sessions are kept in least-recently-used order, so expired sessions
+    are always at the front and eviction never scans the whole store.
+    """
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        ttl: float = 1800.0,
+        max_turns: int = 20,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_turns = max_turns
+        self._clock = clock
+        self._sessions: OrderedDict[str, tuple[Session, float]] = OrderedDict()
+
+    def __len__(self) -> int:
+        self._evict_expired()
+        return len(self._sessions)
+
+    def create(self, document_id: Optional[str] = None, collection_id: Optional[str] = None) -> Session:
+        """Start a session, evicting the least recently used one when full."""
+        self._evict_expired()
+        while len(self._sessions) >= self.max_sessions:
+            self._sessions.popitem(last=False)
+
+        session = Session(str(uuid.uuid4()), document_id, collection_id, max_turns=self.max_turns)
+        self._sessions[session.id] = (session, self._clock())
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Look up a live session and mark it as used."""
+        self._evict_expired()
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return None
+        self._sessions[session_id] = (entry[0], self._clock())
+        self._sessions.move_to_end(session_id)
+        return entry[0]
+
+    def delete(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    def _evict_expired(self) -> None:
+        cutoff = self._clock() - self.ttl
+        while self._sessions:
+            _, last_used = next(iter(self._sessions.values()))
+            if last_used > cutoff:
+                break
+            self._sessions.popitem(last=False)
@@ -0,0 +1,108 @@
+"""
+Citation snippets.
+
+At ingest, every chunk gets its sentence offsets and a small inverted
+index from term to the sentences containing it. A citation then picks the
+best window of consecutive sentences by looking up the question's terms
+only, and highlights them within that window - so rendering a source
+costs the same however long its chunk is.
+"""
+
+import re
+from typing import Iterable
+
+from app.services.embedding import tokenize
+from app.services.extractive import split_sentences
+from app.services.routing import STOPWORDS
+
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def sentence_index(text: str) -> dict:
+    """
+    Precompute what snippets need from a chunk.
+
+    Returns:
+        ``sentences``: (start, end) offsets of each sentence, and
+        ``sentence_terms``: term -> indices of the sentences containing it
+    """
+    sentences = split_sentences(text)
+    terms: dict[str, list[int]] = {}
+    for i, (start, end) in enumerate(sentences):
+        for term in set(tokenize(text[start:end])):
+            if term not in STOPWORDS:
+                terms.setdefault(term, []).append(i)
+    return {"sentences": sentences, "sentence_terms": terms}
+
+
+def query_terms(question: str) -> set[str]:
+    """Terms of a question worth matching and highlighting."""
+    return {t for t in tokenize(question) if t not in STOPWORDS}
+
+
+def highlight(text: str, terms: Iterable[str]) -> list[tuple[int, int]]:
+    """(start, end) offsets of every occurrence of the terms in `text`."""
+    terms = set(terms)
+    return [m.span() for m in _TOKEN_RE.finditer(text.lower()) if m.group() in terms]
+
+
+class SnippetGenerator:
+    """
+    Picks the best-matching window of consecutive sentences in a chunk.
+
+    A window's score is the number of question terms in each of its
+    sentences. Only windows touching a matching sentence are considered,
+    so the cost depends on the matches, not on the chunk's length.
+    """
+
+    def __init__(self, window: int = 2, max_chars: int = 300):
+        self.window = window
+        self.max_chars = max_chars
+
+    def snippet(self, chunk: dict, terms: set[str]) -> dict:
+        """
+        Build a citation snippet.
+
+        Args:
+            chunk: Chunk with ``text`` and, ideally, precomputed
+                ``sentences`` / ``sentence_terms`` (computed on the fly
+                for chunks indexed without them)
+            terms: Question terms, see `query_terms`
+
+        Returns:
+            ``excerpt``, its ``start`` / ``end`` in the chunk text, and
+            ``highlights`` as (start, end) offsets within the excerpt
+        """
+        text = chunk["text"]
+        if "sentences" not in chunk:
+            chunk = {**chunk, **sentence_index(text)}
+        sentences = chunk["sentences"]
+        if not sentences:
+            return {"excerpt": "", "start": 0, "end": 0, "highlights": []}
+
+        scores: dict[int, int] = {}
+        for term in terms:
+            for i in chunk["sentence_terms"].get(term, ()):
+                scores[i] = scores.get(i, 0) + 1
+
+        # Ties go to windows that open on a match, then to the earliest
+        best, best_key = 0, (0, False, 0)
+        last_start = max(0, len(sentences) - self.window)
+        for matched in scores:
+            for first in range(max(0, matched - self.window + 1), min(matched, last_start) + 1):
+                score = sum(scores.get(i, 0) for i in range(first, first + self.window))
+                key = (score, first in scores, -first)
+                if key > best_key:
+                    best, best_key = first, key
+
+        start = sentences[best][0]
+        end = sentences[min(best + self.window, len(sentences)) - 1][1]
+        end = min(end, start + self.max_chars)
+        excerpt = text[start:end]
+        return {
+            "excerpt": excerpt,
+            "start": start,
+            "end": end,
+            "highlights": highlight(excerpt, terms),
+        }
@@ -0,0 +1,526 @@
+"""
+Vector store for chunk embeddings.
+
+Holds one row per chunk and answers top-k inner-product queries. Instead of
+keeping full float32 vectors in memory, rows can be stored as int8 scalar
+codes or product-quantization (PQ) codes. The originals then live in an
+on-disk memmap and are only read to re-score a small candidate set.
+
+Deletes only set a tombstone bit per document; rows are physically removed
+by `compact()`, which rebuilds the arrays off to the side and swaps them in.
+"""
+
+import os
+import tempfile
+import threading
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+
+QUANTIZATION_MODES = ("none", "int8", "pq")
+
+
+def _grow(array: Optional[np.ndarray], needed: int, shape: tuple, dtype) -> np.ndarray:
+    """Return `array` with room for at least `needed` rows (doubling growth)."""
+    if array is not None and len(array) >= needed:
+        return array
+    capacity = max(needed, 2 * (len(array) if array is not None else 0), 64)
+    grown = np.zeros((capacity, *shape), dtype=dtype)
+    if array is not None:
+        grown[: len(array)] = array
+    return grown
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """Plain Lloyd's k-means, returns (k, d) centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].copy()
+
+    for _ in range(iterations):
+        # ||x - c||^2 up to a per-row constant
+        distances = (centroids ** 2).sum(axis=1) - 2.0 * data @ centroids.T
+        assignment = distances.argmin(axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+
+    return centroids
+
+
+class _View(NamedTuple):
+    """Consistent snapshot of the row-aligned arrays for one search."""
+    size: int
+    row_doc: Optional[np.ndarray]
+    doc_dead: np.ndarray
+    metadata: list
+    vectors: Optional[np.ndarray]
+    codes: Optional[np.ndarray]
+    scales: Optional[np.ndarray]
+    codebooks: Optional[np.ndarray]
+    raw: Optional[np.ndarray]
+    garbage: int
+    doc_ranges: dict
+
+
+class _CompactionPlan(NamedTuple):
+    """Rows kept by a compaction, and the arrays rebuilt from them."""
+    size: int
+    row_doc: np.ndarray
+    metadata: list
+    vectors: Optional[np.ndarray]
+    codes: Optional[np.ndarray]
+    scales: Optional[np.ndarray]
+    raw_path: Optional[str]
+
+
+class VectorStore:
+    """
+    Append-only vector index with optional quantization.
+
+    Modes:
+    - ``none``: float32 rows in memory, exact search
+    - ``int8``: per-row scaled int8 codes in memory (~4x smaller)
+    - ``pq``: product-quantization codes, one byte per subvector (~dim/4 x smaller)
+
+    Quantized modes score all rows on the codes (asymmetric: the query stays
+    float32), then re-score the best ``k * rescore_factor`` candidates
+    exactly against the full vectors in the memmap.
+
+    Writers hold ``_lock``; searches only hold it long enough to take a
+    `_View`, so they never wait on a compaction in progress.
+    """
+
+    def __init__(
+        self,
+        dim: int = 256,
+        quantization: str = "none",
+        pq_subvectors: int = 16,
+        pq_centroids: int = 256,
+        rescore_factor: int = 4,
+        storage_dir: Optional[str] = None,
+    ):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(
+                f"Unknown quantization '{quantization}'. Allowed: {', '.join(QUANTIZATION_MODES)}"
+            )
+        if quantization == "pq" and dim % pq_subvectors:
+            raise ValueError("dim must be divisible by pq_subvectors")
+        if pq_centroids > 256:
+            raise ValueError("pq_centroids must fit in one byte (<= 256)")
+
+        self.dim = dim
+        self.quantization = quantization
+        self.pq_subvectors = pq_subvectors
+        self.pq_centroids = pq_centroids
+        self.rescore_factor = rescore_factor
+        self._storage_dir = storage_dir
+
+        self._lock = threading.RLock()
+        self._size = 0
+        self._metadata: list[dict] = []
+        self._row_doc: Optional[np.ndarray] = None
+
+        # Documents get an ordinal on first add; deletes tombstone the ordinal
+        self._doc_index: dict[str, int] = {}
+        self._next_ordinal = 0
+        self._doc_dead = np.zeros(0, dtype=bool)
+        self._doc_rows = np.zeros(0, dtype=np.int64)
+        # ordinal -> [(start, end)] row ranges, so filtered search touches only those rows
+        self._doc_ranges: dict[int, list[tuple[int, int]]] = {}
+        self._garbage = 0
+        self._generation = 0
+
+        # In-memory representation (depends on mode)
+        self._vectors: Optional[np.ndarray] = None
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._codebooks: Optional[np.ndarray] = None
+
+        # On-disk full vectors (quantized modes only)
+        self._raw_path: Optional[str] = None
+        self._raw_map: Optional[np.memmap] = None
+
+    def __len__(self) -> int:
+        return self._size - self._garbage
+
+    def empty_copy(self) -> "VectorStore":
+        """A new, empty store with the same parameters (e.g. to rebuild into)."""
+        return VectorStore(
+            dim=self.dim,
+            quantization=self.quantization,
+            pq_subvectors=self.pq_subvectors,
+            pq_centroids=self.pq_centroids,
+            rescore_factor=self.rescore_factor,
+            storage_dir=self._storage_dir,
+        )
+
+    def close(self) -> None:
+        """Remove the on-disk vector file of a store that is no longer used."""
+        with self._lock:
+            path, self._raw_path, self._raw_map = self._raw_path, None, None
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    @property
+    def garbage_ratio(self) -> float:
+        """Fraction of stored rows that belong to deleted documents."""
+        return self._garbage / self._size if self._size else 0.0
+
+    # === Writes ===
+
+    def add(self, vectors: np.ndarray, metadata: list[dict]) -> list[int]:
+        """
+        Append vectors with per-row metadata.
+
+        Args:
+            vectors: Array of shape (n, dim)
+            metadata: One dict per row; must include ``document_id``
+
+        Returns:
+            Row ids assigned to the new vectors
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if len(vectors) != len(metadata):
+            raise ValueError("vectors and metadata must have the same length")
+
+        with self._lock:
+            n = len(vectors)
+            start, end = self._size, self._size + n
+
+            self._row_doc = _grow(self._row_doc, end, (), np.int32)
+            for offset, meta in enumerate(metadata):
+                self._row_doc[start + offset] = self._ordinal(meta["document_id"])
+            np.add.at(self._doc_rows, self._row_doc[start:end], 1)
+            self._add_ranges(self._doc_ranges, self._row_doc[start:end], start)
+            self._metadata.extend(metadata)
+
+            if self.quantization == "none":
+                self._vectors = _grow(self._vectors, end, (self.dim,), np.float32)
+                self._vectors[start:end] = vectors
+            else:
+                self._append_raw(vectors)
+                if self.quantization == "int8":
+                    self._codes = _grow(self._codes, end, (self.dim,), np.int8)
+                    self._scales = _grow(self._scales, end, (), np.float32)
+                    self._codes[start:end], self._scales[start:end] = self._encode_int8(vectors)
+                elif self._codebooks is not None:
+                    self._codes = _grow(self._codes, end, (self.pq_subvectors,), np.uint8)
+                    self._codes[start:end] = self._encode_pq(vectors)
+
+            self._size = end
+
+            if self.quantization == "pq" and self._codebooks is None and end >= self.pq_centroids:
+                self.train_pq()
+
+        return list(range(start, end))
+
+    @staticmethod
+    def _add_ranges(ranges: dict, row_doc: np.ndarray, offset: int) -> None:
+        """Record the runs of equal ordinals in `row_doc` as row ranges."""
+        if len(row_doc) == 0:
+            return
+        bounds = [0, *(np.flatnonzero(np.diff(row_doc)) + 1), len(row_doc)]
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            doc_ranges = ranges.setdefault(int(row_doc[start]), [])
+            start, end = int(start) + offset, int(end) + offset
+            if doc_ranges and doc_ranges[-1][1] == start:
+                doc_ranges[-1] = (doc_ranges[-1][0], end)
+            else:
+                doc_ranges.append((start, end))
+
+    def _ordinal(self, document_id: str) -> int:
+        """Ordinal for a live document, assigning a new one if needed."""
+        ordinal = self._doc_index.get(document_id)
+        if ordinal is None:
+            ordinal = self._doc_index[document_id] = self._next_ordinal
+            self._next_ordinal += 1
+            self._doc_dead = _grow(self._doc_dead, self._next_ordinal, (), bool)
+            self._doc_rows = _grow(self._doc_rows, self._next_ordinal, (), np.int64)
+        return ordinal
+
+    def delete_document(self, document_id: str) -> int:
+        """
+        Tombstone every row of a document in O(1).
+
+        The document's ordinal is retired, so rows added later under the
+        same id start a fresh, live ordinal.
+
+        Returns:
+            Number of rows that became garbage
+        """
+        with self._lock:
+            ordinal = self._doc_index.pop(document_id, None)
+            if ordinal is None:
+                return 0
+            self._doc_dead[ordinal] = True
+            rows = int(self._doc_rows[ordinal])
+            self._garbage += rows
+            return rows
+
+    def _append_raw(self, vectors: np.ndarray) -> None:
+        """Append full vectors to the on-disk file backing re-scoring."""
+        if self._raw_path is None:
+            self._raw_path = self._new_raw_path()
+            open(self._raw_path, "wb").close()
+        with open(self._raw_path, "ab") as f:
+            f.write(vectors.tobytes())
+        self._raw_map = None
+
+    def _new_raw_path(self) -> str:
+        if self._storage_dir is None:
+            self._storage_dir = tempfile.mkdtemp(prefix="documind-vectors-")
+        os.makedirs(self._storage_dir, exist_ok=True)
+        self._generation += 1
+        return os.path.join(self._storage_dir, f"vectors-{id(self):x}-{self._generation}.f32")
+
+    def _raw(self) -> Optional[np.ndarray]:
+        """Read-only memmap over the full vectors written so far."""
+        if self._raw_path is None or self._size == 0:
+            return None
+        if self._raw_map is None or len(self._raw_map) != self._size:
+            self._raw_map = np.memmap(
+                self._raw_path, dtype=np.float32, mode="r", shape=(self._size, self.dim)
+            )
+        return self._raw_map
+
+    # === Compaction ===
+
+    def compact(self) -> int:
+        """
+        Physically drop tombstoned rows.
+
+        The expensive part (`_build_compaction`) reads a snapshot without
+        holding the lock, so searches and adds carry on meanwhile. Only the
+        final swap, which also copies rows added during the build, locks.
+
+        Returns:
+            Number of rows reclaimed
+        """
+        plan = self._build_compaction()
+        if plan is None:
+            return 0
+        return self._apply_compaction(plan)
+
+    def _build_compaction(self) -> Optional[_CompactionPlan]:
+        with self._lock:
+            view = self._view()
+            raw_path = self._new_raw_path() if view.raw is not None else None
+        if view.garbage == 0:
+            return None
+
+        keep = np.flatnonzero(~view.doc_dead[view.row_doc[: view.size]])
+        if raw_path is not None:
+            with open(raw_path, "wb") as f:
+                for block in np.array_split(keep, max(1, len(keep) // 4096)):
+                    f.write(np.ascontiguousarray(view.raw[block]).tobytes())
+
+        return _CompactionPlan(
+            size=view.size,
+            row_doc=view.row_doc[keep],
+            metadata=[view.metadata[i] for i in keep],
+            vectors=view.vectors[keep] if view.vectors is not None else None,
+            codes=view.codes[keep] if view.codes is not None else None,
+            scales=view.scales[keep] if view.scales is not None else None,
+            raw_path=raw_path,
+        )
+
+    def _apply_compaction(self, plan: _CompactionPlan) -> int:
+        with self._lock:
+            # Rows appended while the plan was being built
+            tail = slice(plan.size, self._size)
+
+            def merged(new: Optional[np.ndarray], current: Optional[np.ndarray]) -> Optional[np.ndarray]:
+                if new is None or current is None:
+                    return current
+                return np.concatenate([new, current[tail]])
+
+            reclaimed = plan.size - len(plan.row_doc)
+            raw = self._raw()
+            if plan.raw_path is not None and raw is not None:
+                with open(plan.raw_path, "ab") as f:
+                    f.write(np.ascontiguousarray(raw[tail]).tobytes())
+                old_path, self._raw_path, self._raw_map = self._raw_path, plan.raw_path, None
+                os.remove(old_path)
+
+            self._row_doc = merged(plan.row_doc, self._row_doc)
+            self._vectors = merged(plan.vectors, self._vectors)
+            self._scales = merged(plan.scales, self._scales)
+            self._codes = merged(plan.codes, self._codes)
+            self._metadata = plan.metadata + self._metadata[plan.size:]
+            self._size = len(self._row_doc)
+
+            if plan.codes is None and self._codebooks is not None:
+                # PQ was trained mid-build, so the codes don't line up; re-encode
+                self.train_pq()
+
+            # Deletes that landed during the build are still garbage
+            self._doc_rows = np.bincount(self._row_doc, minlength=len(self._doc_dead)).astype(np.int64)
+            self._doc_ranges = {}
+            self._add_ranges(self._doc_ranges, self._row_doc, 0)
+            self._garbage = int(self._doc_rows[self._doc_dead[: len(self._doc_rows)]].sum())
+            return reclaimed
+
+    # === Quantizers ===
+
+    def _encode_int8(self, vectors: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+
+    def train_pq(self) -> None:
+        """(Re)train PQ codebooks on all stored vectors and re-encode them."""
+        if self.quantization != "pq" or self._size == 0:
+            return
+        data = np.asarray(self._raw())
+        k = min(self.pq_centroids, len(data))
+        dsub = self.dim // self.pq_subvectors
+        self._codebooks = np.stack([
+            _kmeans(data[:, m * dsub:(m + 1) * dsub], k, seed=m)
+            for m in range(self.pq_subvectors)
+        ])
+        self._codes = _grow(None, self._size, (self.pq_subvectors,), np.uint8)
+        self._codes[: self._size] = self._encode_pq(data)
+
+    def _encode_pq(self, vectors: np.ndarray) -> np.ndarray:
+        dsub = self.dim // self.pq_subvectors
+        codes = np.empty((len(vectors), self.pq_subvectors), dtype=np.uint8)
+        for m, codebook in enumerate(self._codebooks):
+            sub = vectors[:, m * dsub:(m + 1) * dsub]
+            distances = (codebook ** 2).sum(axis=1) - 2.0 * sub @ codebook.T
+            codes[:, m] = distances.argmin(axis=1)
+        return codes
+
+    # === Reads ===
+
+    def get(self, row: int) -> dict:
+        """Metadata stored for a row."""
+        return self._metadata[row]
+
+    def _view(self) -> _View:
+        with self._lock:
+            return _View(
+                size=self._size,
+                row_doc=self._row_doc,
+                doc_dead=self._doc_dead,
+                metadata=self._metadata,
+                vectors=self._vectors,
+                codes=self._codes,
+                scales=self._scales,
+                codebooks=self._codebooks,
+                raw=self._raw(),
+                garbage=self._garbage,
+                doc_ranges=self._doc_ranges,
+            )
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int = 5,
+        document_ids: Optional[set[str]] = None,
+    ) -> list[dict]:
+        """
+        Top-k rows by inner product with `query`.
+
+        Args:
+            query: Query vector of shape (dim,)
+            k: Number of results
+            document_ids: Optional restriction to these documents
+
+        Returns:
+            Row metadata dicts with ``row`` and ``score`` added, best first
+        """
+        view = self._view()
+        if view.size == 0 or k <= 0:
+            return []
+
+        rows = self._candidate_rows(view, document_ids)
+        if rows is not None and len(rows) == 0:
+            return []
+
+        query = np.asarray(query, dtype=np.float32).reshape(self.dim)
+        approx = self._approximate_scores(view, query, rows)
+        candidates = np.arange(view.size) if rows is None else rows
+
+        if self.quantization == "none" or (self.quantization == "pq" and view.codebooks is None):
+            scores, picked = approx, candidates
+        else:
+            shortlist = _top_indices(approx, k * self.rescore_factor)
+            # Sorted row order keeps the memmap reads sequential
+            picked = np.sort(candidates[shortlist])
+            scores = view.raw[picked] @ query
+
+        order = _top_indices(scores, k)
+        return [
+            {**view.metadata[int(picked[i])], "row": int(picked[i]), "score": float(scores[i])}
+            for i in order
+        ]
+
+    def _candidate_rows(self, view: _View, document_ids: Optional[set[str]]) -> Optional[np.ndarray]:
+        """Row ids allowed by the filter and tombstones, or None for all rows."""
+        row_doc = view.row_doc[: view.size]
+        if document_ids is None:
+            if view.garbage == 0:
+                return None
+            return np.flatnonzero(~view.doc_dead[row_doc])
+        ranges = sorted(
+            (start, min(end, view.size))
+            for d in document_ids
+            if d in self._doc_index
+            for start, end in view.doc_ranges.get(self._doc_index[d], ())
+            if start < view.size
+        )
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(start, end) for start, end in ranges])
+
+    def _approximate_scores(self, view: _View, query: np.ndarray, rows: Optional[np.ndarray]) -> np.ndarray:
+        """Score rows on whatever representation is held in memory."""
+        select = slice(0, view.size) if rows is None else rows
+
+        if self.quantization == "none":
+            return view.vectors[select] @ query
+
+        if self.quantization == "int8":
+            return (view.codes[select] @ query) * view.scales[select]
+
+        if view.codebooks is None:
+            return view.raw[select] @ query
+
+        # Asymmetric distance: one lookup table per subvector, then gather + sum
+        dsub = self.dim // self.pq_subvectors
+        table = np.einsum(
+            "mkd,md->mk", view.codebooks, query.reshape(self.pq_subvectors, dsub)
+        )
+        return table[np.arange(self.pq_subvectors), view.codes[select]].sum(axis=1)
+
+    def memory_stats(self) -> dict:
+        """Memory footprint of the in-memory index."""
+        if self.quantization == "none":
+            per_vector = self.dim * 4
+        elif self.quantization == "int8":
+            per_vector = self.dim + 4
+        else:
+            per_vector = self.pq_subvectors if self._codebooks is not None else 0
+
+        codebook_bytes = self._codebooks.nbytes if self._codebooks is not None else 0
+        return {
+            "vectors": self._size,
+            "garbage_ratio": round(self.garbage_ratio, 4),
+            "quantization": self.quantization,
+            "bytes_per_vector": per_vector,
+            "float32_bytes_per_vector": self.dim * 4,
+            "index_bytes": per_vector * self._size + codebook_bytes,
+            "disk_bytes": self._size * self.dim * 4 if self._raw_path else 0,
+        }
+
+
+def _top_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` largest scores, best first."""
+    if k >= len(scores):
+        return np.argsort(-scores, kind="stable")
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part], kind="stable")]
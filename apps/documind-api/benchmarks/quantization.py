@@ -0,0 +1,66 @@
+"""
+Benchmark: memory per vector and recall@k for the vector store quantizers.
+
+Usage:
+    python -m benchmarks.quantization [--vectors 20000] [--dim 256]
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from app.services.vectorstore import VectorStore
+
+
+def clustered_vectors(n: int, dim: int, clusters: int = 64, seed: int = 0) -> np.ndarray:
+    """Unit vectors drawn around random centres, closer to real embeddings than pure noise."""
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    data = centres[rng.integers(clusters, size=n)] + 0.5 * rng.normal(size=(n, dim))
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    return data.astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("-k", type=int, default=10)
+    args = parser.parse_args()
+
+    data = clustered_vectors(args.vectors, args.dim)
+    queries = clustered_vectors(args.queries, args.dim, seed=1)
+    metadata = [{"document_id": "bench"}] * args.vectors
+    truth = np.argsort(-(queries @ data.T), axis=1)[:, : args.k]
+
+    configs = [
+        ("none", {}),
+        ("int8", {"rescore_factor": 1}),
+        ("int8", {"rescore_factor": 4}),
+        ("pq", {"rescore_factor": 1}),
+        ("pq", {"rescore_factor": 4}),
+        ("pq", {"rescore_factor": 16}),
+    ]
+
+    print(f"{'mode':<6} {'rescore':>7} {'B/vec':>7} {'ratio':>6} {'recall@k':>9} {'ms/query':>9}")
+    for mode, options in configs:
+        store = VectorStore(dim=args.dim, quantization=mode, **options)
+        store.add(data, metadata)
+        stats = store.memory_stats()
+
+        start = time.perf_counter()
+        hits = [[h["row"] for h in store.search(q, k=args.k)] for q in queries]
+        elapsed = (time.perf_counter() - start) / args.queries * 1000
+
+        recall = np.mean([len(set(h) & set(t)) / args.k for h, t in zip(hits, truth)])
+        ratio = stats["float32_bytes_per_vector"] / stats["bytes_per_vector"]
+        print(
+            f"{mode:<6} {options.get('rescore_factor', '-'):>7} {stats['bytes_per_vector']:>7} "
+            f"{ratio:>5.1f}x {recall:>9.3f} {elapsed:>9.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Benchmark: recall and latency of two-stage (routed) collection search vs flat search.
+
+Builds one collection of documents drawn from a handful of topics, each
+with a few subject terms of its own, then asks about individual documents
+both by scoring every chunk in the collection and by first routing to the
+top-N documents. Recall@k is the fraction of the flat
+top-k chunks the routed search also returns.
+
+Usage:
+    python -m benchmarks.routing [--documents 2000] [--topics 40] [--top-n 8]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+
+from app.services.document import DocumentService
+
+
+def make_corpus(documents: int, topics: int, seed: int = 0) -> list[bytes]:
+    """One text per document: topic vocabulary, shared filler and its own subject terms."""
+    rng = random.Random(seed)
+    vocab = [[f"topic{t}term{w}" for w in range(30)] for t in range(topics)]
+    shared = [f"common{w}" for w in range(200)]
+    corpus = []
+    for d in range(documents):
+        topic = vocab[rng.randrange(topics)]
+        subject = [f"doc{d}subject{w}" for w in range(5)]
+        pools = rng.choices([subject, topic, shared], weights=[2, 3, 5], k=6 * 150)
+        words = [rng.choice(pool) for pool in pools]
+        paragraphs = [" ".join(words[i:i + 150]) for i in range(0, len(words), 150)]
+        corpus.append("\n\n".join(paragraphs).encode())
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--documents", type=int, default=2000)
+    parser.add_argument("--topics", type=int, default=40)
+    parser.add_argument("--top-n", type=int, default=8)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    service = DocumentService(extraction_workers=1, dedup_threshold=None, route_top_n=args.top_n)
+    collection = service.create_collection("bench")
+
+    async def ingest():
+        for i, content in enumerate(make_corpus(args.documents, args.topics)):
+            await service.ingest(f"doc-{i}.txt", content, collection["id"])
+
+    asyncio.run(ingest())
+
+    # Questions about one document, phrased with its subject terms
+    rng = random.Random(1)
+    queries = [
+        " ".join(f"doc{d}subject{rng.randrange(5)}" for _ in range(3))
+        for d in (rng.randrange(args.documents) for _ in range(args.queries))
+    ]
+
+    def run(top_n: int) -> tuple[list[set], float]:
+        service.route_top_n = top_n
+        started = time.perf_counter()
+        hits = [
+            {(h["document_id"], h["chunk_index"]) for h in service.search(q, collection_id=collection["id"], k=args.k)}
+            for q in queries
+        ]
+        return hits, (time.perf_counter() - started) / len(queries)
+
+    flat, flat_time = run(args.documents)
+    routed, routed_time = run(args.top_n)
+    recall = sum(len(f & r) for f, r in zip(flat, routed)) / sum(len(f) for f in flat)
+
+    print(f"documents:        {args.documents}")
+    print(f"index rows:       {len(service.vector_store)}")
+    print(f"routed to:        top {args.top_n} documents")
+    print(f"recall@{args.k}:         {recall:.3f}")
+    print(f"query latency:    {1000 * flat_time:.2f}ms -> {1000 * routed_time:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,9 +2,15 @@
 Tests for DocuMind API endpoints.
 """
 
+import asyncio
+import io
+import json
+import zipfile
+
 import pytest
 from httpx import AsyncClient, ASGITransport
-from app.main import app
+from app.main import app, rate_limiter
+from app.services.ratelimit import Limit
 
 
 @pytest.fixture
@@ -14,6 +20,7 @@ def anyio_backend():
 
 @pytest.fixture
 async def client():
+    rate_limiter.reset()
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as client:
         yield client
@@ -46,9 +53,20 @@ async def test_list_collections_empty(client: AsyncClient):
     assert response.json() == []
 
 
+async def _upload_text(client: AsyncClient, filename: str, content: bytes) -> str:
+    response = await client.post(
+        "/api/documents/upload",
+        files={"file": (filename, content, "text/plain")}
+    )
+    return response.json()["id"]
+
+
 @pytest.mark.anyio
 async def test_ask_question(client: AsyncClient):
     """Test asking a question."""
+    await _upload_text(
+        client, "topic.txt", b"The main topic of this report is renewable energy adoption."
+    )
     response = await client.post(
         "/api/ask",
         json={"question": "What is the main topic?"}
@@ -65,11 +83,14 @@ async def test_ask_question(client: AsyncClient):
 @pytest.mark.anyio
 async def test_ask_question_with_document(client: AsyncClient):
     """Test asking a question about a specific document."""
+    doc_id = await _upload_text(
+        client, "process.txt", b"The process works in three steps. First, data is collected."
+    )
     response = await client.post(
         "/api/ask",
         json={
             "question": "How does this process work?",
-            "document_id": "test-doc-123"
+            "document_id": doc_id
         }
     )
     assert response.status_code == 200
@@ -77,6 +98,63 @@ async def test_ask_question_with_document(client: AsyncClient):
     data = response.json()
     assert "answer" in data
     assert len(data["sources"]) > 0
+    assert all(s["document_id"] == doc_id for s in data["sources"])
+
+
+@pytest.mark.anyio
+async def test_ask_question_extractive_mode(client: AsyncClient):
+    """Test the extractive answer mode cites the matching sentence."""
+    doc_id = await _upload_text(
+        client,
+        "policy.txt",
+        b"Employees accrue vacation monthly. Refunds are processed within 14 days. "
+        b"The office closes at six.",
+    )
+    response = await client.post(
+        "/api/ask",
+        json={"question": "How long do refunds take?", "document_id": doc_id, "mode": "extractive"}
+    )
+    assert response.status_code == 200
+    
+    data = response.json()
+    assert data["mode"] == "extractive"
+    assert "14 days" in data["answer"]
+    assert data["sources"][0]["page"] == 1
+    
+    source = next(s for s in data["sources"] if "Refunds" in s["excerpt"])
+    start, end = source["highlights"][0]
+    assert source["excerpt"][start:end] == "Refunds"
+
+
+@pytest.mark.anyio
+async def test_ask_question_multiple_scopes(client: AsyncClient):
+    """Test asking across several documents at once."""
+    first = await _upload_text(client, "warranty.txt", b"The warranty lasts two years from purchase.")
+    second = await _upload_text(client, "returns.txt", b"Returns are accepted within thirty days of delivery.")
+    
+    response = await client.post(
+        "/api/ask",
+        json={
+            "question": "How long do I have to return an item?",
+            "document_ids": [first, second],
+            "mode": "extractive",
+        },
+    )
+    assert response.status_code == 200
+    
+    data = response.json()
+    assert "thirty days" in data["answer"]
+    assert [s["id"] for s in data["scopes"]] == [first, second]
+
+
+@pytest.mark.anyio
+async def test_ask_question_llm_mode_without_key(client: AsyncClient):
+    """Test that forcing LLM mode without an API key is a client error."""
+    response = await client.post(
+        "/api/ask",
+        json={"question": "What is the main topic?", "mode": "llm"}
+    )
+    assert response.status_code == 400
 
 
 @pytest.mark.anyio
@@ -131,6 +209,22 @@ async def test_upload_invalid_file_type(client: AsyncClient):
     assert response.status_code == 400
 
 
+@pytest.mark.anyio
+async def test_list_documents_filtered(client: AsyncClient):
+    """Test filtering the document list by metadata."""
+    doc_id = await _upload_text(client, "quarterly-filter-test.md", b"# Quarterly numbers")
+    
+    response = await client.get("/api/documents", params={"filename": "quarterly-filter-test.md"})
+    assert response.status_code == 200
+    assert [d["id"] for d in response.json()] == [doc_id]
+    
+    response = await client.get("/api/documents", params={"extension": "md", "status": "processed"})
+    assert doc_id in [d["id"] for d in response.json()]
+    
+    response = await client.get("/api/documents", params={"status": "unknown"})
+    assert response.status_code == 422
+
+
 @pytest.mark.anyio
 async def test_upload_txt_file(client: AsyncClient):
     """Test uploading a text file."""
@@ -145,3 +239,182 @@ async def test_upload_txt_file(client: AsyncClient):
     assert data["status"] == "processed"
     assert "id" in data
     assert data["filename"] == "test.txt"
+
+
+@pytest.mark.anyio
+async def test_bulk_upload_files(client: AsyncClient):
+    """Test uploading several files in one request."""
+    response = await client.post(
+        "/api/documents/bulk",
+        files=[
+            ("files", ("one.txt", b"First document.", "text/plain")),
+            ("files", ("two.md", b"# Second document", "text/markdown")),
+        ],
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(r["filename"] for r in results) == ["one.txt", "two.md"]
+    assert all(r["status"] == "processed" for r in results)
+
+
+@pytest.mark.anyio
+async def test_bulk_upload_zip_into_collection(client: AsyncClient):
+    """Test uploading a ZIP archive straight into a collection."""
+    collection = (await client.post("/api/collections", json={"name": "Bulk"})).json()
+    
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for i in range(3):
+            archive.writestr(f"doc-{i}.txt", f"Archived document {i}.")
+    
+    response = await client.post(
+        "/api/documents/bulk",
+        files={"files": ("batch.zip", buffer.getvalue(), "application/zip")},
+        data={"collection_id": collection["id"]},
+    )
+    assert response.status_code == 200
+    
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert len(results) == 3
+    
+    collections = (await client.get("/api/collections")).json()
+    assert next(c for c in collections if c["id"] == collection["id"])["document_count"] == 3
+
+
+@pytest.mark.anyio
+async def test_bulk_upload_charges_per_file(client: AsyncClient, monkeypatch):
+    """Test that every archive member costs an upload token, not just the request."""
+    monkeypatch.setitem(rate_limiter.limits, "upload", Limit(rate=0.01, burst=3))
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for i in range(5):
+            archive.writestr(f"doc-{i}.txt", f"Archived document {i}.")
+    
+    response = await client.post(
+        "/api/documents/bulk", files={"files": ("batch.zip", buffer.getvalue(), "application/zip")}
+    )
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert sorted(r["status"] for r in results) == ["processed"] * 3 + ["rate_limited"]
+    limited = next(r for r in results if r["status"] == "rate_limited")
+    assert limited["filename"] == "doc-3.txt" and "retry after" in limited["message"]
+    
+    response = await client.post("/api/documents/upload", files={"file": ("one.txt", b"More.", "text/plain")})
+    assert response.status_code == 429
+
+
+@pytest.mark.anyio
+async def test_bulk_upload_unknown_collection(client: AsyncClient):
+    """Test bulk upload into a missing collection."""
+    response = await client.post(
+        "/api/documents/bulk",
+        files={"files": ("one.txt", b"content", "text/plain")},
+        data={"collection_id": "missing"},
+    )
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_session_follow_up(client: AsyncClient):
+    """Test a two-turn conversation reusing the first turn's retrieval."""
+    doc_id = await _upload_text(
+        client,
+        "lease.txt",
+        b"The monthly rent is 1200 dollars and is due on the first day. "
+        b"Section 4 says the tenant pays for water and electricity.",
+    )
+    session = (await client.post("/api/sessions", json={"document_id": doc_id})).json()
+    
+    first = await client.post(
+        f"/api/sessions/{session['id']}/ask",
+        json={"question": "How much is the monthly rent?", "mode": "extractive"},
+    )
+    assert first.status_code == 200
+    assert first.json()["retrieval"] == "full"
+    assert first.json()["session_id"] == session["id"]
+    
+    follow_up = await client.post(
+        f"/api/sessions/{session['id']}/ask",
+        json={"question": "and when is it due?", "mode": "extractive"},
+    )
+    data = follow_up.json()
+    assert data["retrieval"] == "cached"
+    assert "rent" in data["rewritten_question"]
+    
+    info = (await client.get(f"/api/sessions/{session['id']}")).json()
+    assert [t["question"] for t in info["turns"]] == ["How much is the monthly rent?", "and when is it due?"]
+    
+    assert (await client.delete(f"/api/sessions/{session['id']}")).status_code == 200
+    assert (await client.get(f"/api/sessions/{session['id']}")).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_session_not_found(client: AsyncClient):
+    """Test asking in a missing or expired session."""
+    response = await client.post("/api/sessions/missing/ask", json={"question": "Anything?"})
+    assert response.status_code == 404
+    
+    response = await client.post("/api/sessions", json={"document_id": "missing"})
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_reindex_endpoint(client: AsyncClient):
+    """Test starting a re-index and following it to completion."""
+    await _upload_text(client, "reindex.txt", b"Content that is rebuilt from its original.")
+    
+    response = await client.post("/api/maintenance/reindex", json={"chunk_size": 500, "chunk_overlap": 50})
+    assert response.status_code == 202
+    assert response.json()["state"] == "running"
+    
+    for _ in range(100):
+        status = (await client.get("/api/maintenance/reindex")).json()
+        if status["state"] != "running":
+            break
+        await asyncio.sleep(0.05)
+    assert status["state"] == "completed"
+    assert status["chunk_size"] == 500
+    
+    response = await client.post("/api/maintenance/reindex", json={"chunk_size": 100, "chunk_overlap": 100})
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_rate_limit(client: AsyncClient, monkeypatch):
+    """Test that a client over its ask budget gets 429 and Retry-After."""
+    monkeypatch.setitem(rate_limiter.limits, "ask", Limit(rate=0.1, burst=2))
+    
+    for _ in range(2):
+        response = await client.post("/api/ask", json={"question": "Anything?"})
+        assert response.status_code != 429
+    
+    # A made-up API key is not a new client
+    response = await client.post("/api/ask", json={"question": "Anything?"}, headers={"X-API-Key": "fresh"})
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
+    
+    # Other clients and other budgets are unaffected
+    transport = ASGITransport(app=app, client=("10.0.0.2", 123))
+    async with AsyncClient(transport=transport, base_url="http://test") as other:
+        response = await other.post("/api/ask", json={"question": "Anything?"})
+        assert response.status_code != 429
+    assert (await client.get("/api/documents")).status_code == 200
+
+
+@pytest.mark.anyio
+async def test_rate_limit_behind_cors(client: AsyncClient, monkeypatch):
+    """Test that preflights use no tokens and 429s still carry CORS headers."""
+    monkeypatch.setitem(rate_limiter.limits, "ask", Limit(rate=0.1, burst=1))
+    origin = {"Origin": "http://localhost:3000"}
+    
+    for _ in range(3):
+        response = await client.options(
+            "/api/ask", headers={**origin, "Access-Control-Request-Method": "POST"}
+        )
+        assert response.status_code == 200
+    
+    assert (await client.post("/api/ask", json={"question": "Anything?"}, headers=origin)).status_code != 429
+    response = await client.post("/api/ask", json={"question": "Anything?"}, headers=origin)
+    assert response.status_code == 429
+    assert response.headers["access-control-allow-origin"] == "http://localhost:3000"
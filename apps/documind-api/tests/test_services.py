@@ -2,11 +2,74 @@
 Tests for DocuMind services - Document and RAG.
 """
 
+import asyncio
 import pytest
+import numpy as np
+import os
+import sys
+import time
+import tarfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 from unittest.mock import MagicMock, AsyncMock
-from app.services.document import DocumentService
+from app.services.blobstore import BlobStore
+from app.services.dedup import NearDuplicateIndex
+from app.services.document import DocumentService, _append_checkpoint, _scan_checkpoint, iter_archive
+from app.services.embedding import HashingEmbedder
+from app.services.embedding_cache import CachedEmbedder, EmbeddingCache, cache_key
+from app.services.metadata import DocumentIndex
 from app.services.rag import RAGService
+from app.services.ratelimit import (
+    FairQueue,
+    LocalBuckets,
+    RateLimiter,
+    SharedBuckets,
+    budget_for,
+    client_key,
+    parse_limits,
+)
+from app.services.routing import RoutingIndex
+from app.services.session import SessionStore, rewrite_follow_up
+from app.services.snippets import SnippetGenerator, query_terms, sentence_index
+from app.services.vectorstore import VectorStore
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+def _make_pdf(page_texts: list[str]) -> bytes:
+    """Build a PDF with one line of text per page."""
+    from pypdf import PdfWriter
+    from pypdf.generic import DictionaryObject, NameObject, StreamObject
+    
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    for text in page_texts:
+        page = writer.add_blank_page(612, 792)
+        stream = StreamObject()
+        stream.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode())
+        page[NameObject("/Contents")] = writer._add_object(stream)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+        })
+    
+    buffer = BytesIO()
+    writer.write(buffer)
+    return buffer.getvalue()
+
+
+def _unit_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    data = rng.normal(size=(n, dim)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
 
 
 class TestDocumentService:
@@ -144,19 +207,1237 @@ class TestDocumentService:
         assert service.get_document(doc_id) is None
 
 
+    @pytest.mark.anyio
+    async def test_search_returns_indexed_chunks(self):
+        """Test that processed chunks are searchable."""
+        service = DocumentService()
+        
+        mock_file = MagicMock()
+        mock_file.filename = "notes.txt"
+        mock_file.read = AsyncMock(return_value=b"Kubernetes schedules pods onto nodes.")
+        result = await service.process_document(mock_file)
+        
+        hits = service.search("how are pods scheduled", document_id=result["id"])
+        assert hits
+        assert hits[0]["document_id"] == result["id"]
+        assert "Kubernetes" in hits[0]["text"]
+        
+        assert service.search("pods", document_id="other-doc") == []
+
+    @pytest.mark.anyio
+    async def test_ingest_small_pdf(self):
+        """Test that short PDFs are indexed synchronously with page numbers."""
+        service = DocumentService()
+        pdf = _make_pdf(["Alpha introduction.", "Beta appendix about zebras."])
+        
+        result = await service.ingest("small.pdf", pdf)
+        
+        assert result["status"] == "processed"
+        assert result["pages"] == 2
+        assert service.search("zebras", document_id=result["id"], k=1)[0]["page"] == 2
+
+    @pytest.mark.anyio
+    async def test_ingest_large_pdf_progressively(self):
+        """Test page-sharded extraction with progressive indexing."""
+        service = DocumentService(extraction_workers=2, pdf_shard_pages=2)
+        pdf = _make_pdf([f"Page {i} discusses topic{i}." for i in range(1, 8)])
+        
+        result = await service.ingest("manual.pdf", pdf)
+        doc_id = result["id"]
+        
+        assert result["status"] == "processing"
+        assert result["pages"] == 7
+        # Only the first shard is searchable so far
+        assert {h["page"] for h in service.search("topic", document_id=doc_id, k=10)} == {1, 2}
+        
+        await service.wait_for_indexing()
+        
+        doc = service.get_document(doc_id)
+        assert doc["status"] == "processed"
+        assert doc["pages_indexed"] == 7
+        hits = service.search("topic6", document_id=doc_id, k=1)
+        assert hits[0]["page"] == 6
+
+    @pytest.mark.anyio
+    async def test_failed_shard_fails_document(self, monkeypatch):
+        """Test that a page shard that cannot be extracted marks the document failed."""
+        service = DocumentService(extraction_workers=2, pdf_shard_pages=2)
+        service._pool = ThreadPoolExecutor(max_workers=2)
+        extract_pdf = DocumentService._extract_pdf
+        
+        def flaky_extract(source, start=0, end=None):
+            if start == 4:
+                raise ValueError("corrupt page")
+            return extract_pdf(source, start, end)
+        
+        monkeypatch.setattr(DocumentService, "_extract_pdf", staticmethod(flaky_extract))
+        pdf = _make_pdf([f"Page {i} discusses topic{i}." for i in range(1, 8)])
+        
+        result = await service.ingest("manual.pdf", pdf)
+        await service.wait_for_indexing()
+        
+        assert service.get_document(result["id"])["status"] == "failed"
+
+    @pytest.mark.anyio
+    async def test_delete_compacts_in_background(self):
+        """Test that deletes past the garbage threshold trigger compaction."""
+        service = DocumentService(compaction_threshold=0.5)
+        ids = [
+            (await service.ingest(f"doc-{i}.txt", f"Document {i} about rivers.".encode()))["id"]
+            for i in range(4)
+        ]
+        
+        assert service.delete_document(ids[0])
+        assert service._compaction is None
+        assert all(h["document_id"] != ids[0] for h in service.search("rivers", k=10))
+        
+        assert service.delete_document(ids[1])
+        assert await service._compaction == 2
+        assert service.vector_store.garbage_ratio == 0
+        assert {h["document_id"] for h in service.search("rivers", k=10)} == set(ids[2:])
+
+    def test_iter_archive_zip(self):
+        """Test streaming members out of a ZIP archive."""
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            archive.writestr("docs/", "")
+            archive.writestr("docs/a.txt", "alpha")
+            archive.writestr("docs/b.md", "# beta")
+        buffer.seek(0)
+        
+        members = dict(iter_archive(buffer, "upload.zip"))
+        assert members == {"docs/a.txt": b"alpha", "docs/b.md": b"# beta"}
+
+    def test_iter_archive_tar(self):
+        """Test streaming members out of a gzipped TAR archive."""
+        buffer = BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+            info = tarfile.TarInfo("a.txt")
+            info.size = 5
+            archive.addfile(info, BytesIO(b"alpha"))
+        buffer.seek(0)
+        
+        assert list(iter_archive(buffer, "upload.tar.gz")) == [("a.txt", b"alpha")]
+
+    def test_iter_archive_invalid(self):
+        """Test that corrupt archives raise ValueError."""
+        with pytest.raises(ValueError):
+            list(iter_archive(BytesIO(b"not a zip"), "broken.zip"))
+
+    @pytest.mark.anyio
+    async def test_ingest_many(self):
+        """Test bulk ingestion with skips and collection membership."""
+        service = DocumentService(extraction_workers=2)
+        collection = service.create_collection("Bulk")
+        files = [(f"doc-{i}.txt", f"Document number {i}.".encode()) for i in range(5)]
+        files.append(("image.png", b"\x89PNG"))
+        
+        results = [r async for r in service.ingest_many(iter(files), collection["id"])]
+        
+        assert len(results) == 6
+        assert sum(r["status"] == "processed" for r in results) == 5
+        assert sum(r["status"] == "skipped" for r in results) == 1
+        assert service.list_collections()[0]["document_count"] == 5
+
+    @pytest.mark.anyio
+    async def test_ingest_many_reads_off_loop_within_limit(self):
+        """Test that files are read on a worker thread and never past the in-flight limit."""
+        service = DocumentService(extraction_workers=1)
+        release = asyncio.Event()
+        
+        async def slow_ingest(filename, content, collection_id):
+            await release.wait()
+            return {"filename": filename, "status": "processed"}
+        
+        service._ingest_one = slow_ingest
+        readers = []
+        
+        def files():
+            for i in range(5):
+                readers.append(threading.get_ident())
+                yield f"doc-{i}.txt", b"text"
+        
+        results = service.ingest_many(files())
+        first = asyncio.create_task(results.__anext__())
+        await asyncio.sleep(0.05)
+        assert len(readers) == 2
+        assert threading.get_ident() not in readers
+        
+        release.set()
+        assert len([await first] + [r async for r in results]) == 5
+
+
+class TestMultiScopeSearch:
+    """Tests for concurrent retrieval across several scopes."""
+
+    @pytest.mark.anyio
+    async def test_merges_scopes_into_global_top_k(self):
+        """Test k-way merge across documents and collections without repeats."""
+        service = DocumentService()
+        rivers = await service.ingest("rivers.txt", b"Rivers carry sediment to the delta.")
+        lava = await service.ingest("lava.txt", b"Volcanoes erupt lava and ash.")
+        ice = await service.ingest("ice.txt", b"Glaciers carve valleys from ice.")
+        collection = service.create_collection("Geo")
+        service.add_to_collection(collection["id"], lava["id"])
+        service.add_to_collection(collection["id"], ice["id"])
+        
+        scopes = [("document", rivers["id"]), ("document", lava["id"]), ("collection", collection["id"])]
+        hits, timings = await service.search_scopes("volcanoes erupt lava", scopes, k=3)
+        
+        assert hits[0]["document_id"] == lava["id"]
+        assert len(hits) == 3
+        assert len({(h["document_id"], h["chunk_index"]) for h in hits}) == 3
+        assert [h["score"] for h in hits] == sorted((h["score"] for h in hits), reverse=True)
+        assert [(t["scope"], t["id"]) for t in timings] == scopes
+        assert all(t["ms"] >= 0 for t in timings)
+
+    @pytest.mark.anyio
+    async def test_scopes_run_concurrently(self, monkeypatch):
+        """Test that a wide search costs about its slowest scope, not the sum, and doesn't block the loop."""
+        service = DocumentService(search_workers=4)
+        
+        def slow_search(query, document_id=None, collection_id=None, k=5, query_vector=None, filters=None):
+            time.sleep(0.1)
+            return []
+        monkeypatch.setattr(service, "search", slow_search)
+        
+        ticks = 0
+        
+        async def tick():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        
+        ticker = asyncio.create_task(tick())
+        started = time.perf_counter()
+        _, timings = await service.search_scopes("anything", [("document", str(i)) for i in range(4)])
+        ticker.cancel()
+        
+        assert time.perf_counter() - started < 0.3
+        assert ticks >= 3
+        assert all(t["ms"] >= 100 for t in timings)
+
+    @pytest.mark.anyio
+    async def test_answer_reports_scope_timings(self):
+        """Test that multi-scope answers carry per-scope timings."""
+        service = DocumentService()
+        a = await service.ingest("a.txt", b"The warranty lasts two years from purchase.")
+        b = await service.ingest("b.txt", b"Returns are accepted within thirty days.")
+        rag = RAGService(document_service=service)
+        
+        result = await rag.answer_question("How long is the warranty?", document_ids=[a["id"], b["id"]])
+        assert "two years" in result["answer"]
+        assert [s["id"] for s in result["scopes"]] == [a["id"], b["id"]]
+        
+        single = await rag.answer_question("How long is the warranty?", document_id=a["id"])
+        assert "scopes" not in single
+
+    @pytest.mark.anyio
+    async def test_single_entry_scope_lists_stay_scoped(self):
+        """Test that one document or collection given as a list still limits the search."""
+        service = DocumentService()
+        a = await service.ingest("a.txt", b"The warranty lasts two years from purchase.")
+        b = await service.ingest("b.txt", b"The warranty on batteries lasts six months.")
+        collection = service.create_collection("Batteries")
+        service.add_to_collection(collection["id"], b["id"])
+        rag = RAGService(document_service=service)
+        
+        result = await rag.answer_question("How long is the warranty?", document_ids=[a["id"]])
+        assert {s["document_id"] for s in result["sources"]} == {a["id"]}
+        assert "scopes" not in result
+        
+        result = await rag.answer_question("How long is the warranty?", collection_ids=[collection["id"]])
+        assert {s["document_id"] for s in result["sources"]} == {b["id"]}
+
+
+class TestDocumentIndex:
+    """Tests for the secondary metadata indexes."""
+
+    def _doc(self, i: int, filename: str, status: str = "processed") -> dict:
+        return {"id": f"d{i}", "filename": filename, "status": status, "uploaded_at": f"2024-01-{i:02d}T00:00:00"}
+
+    def _index(self) -> tuple[DocumentIndex, list[dict]]:
+        index = DocumentIndex()
+        docs = [
+            self._doc(1, "a.pdf"),
+            self._doc(2, "b.txt"),
+            self._doc(3, "c.PDF", status="processing"),
+            self._doc(4, "a.pdf"),
+            self._doc(5, "e.md"),
+        ]
+        # Out of order on purpose: the indexes keep upload order
+        for doc in reversed(docs):
+            index.add(doc)
+        return index, docs
+
+    def test_field_filters(self):
+        """Test hash filters, combined filters and limits, oldest first."""
+        index, _ = self._index()
+        
+        assert index.query() == ["d1", "d2", "d3", "d4", "d5"]
+        assert index.query(extension="pdf") == ["d1", "d3", "d4"]
+        assert index.query(extension=".PDF", status="processed") == ["d1", "d4"]
+        assert index.query(filename="a.pdf", limit=1) == ["d1"]
+        assert index.query(status="failed") == []
+
+    def test_time_range(self):
+        """Test upload-time ranges, alone and with a field filter."""
+        index, _ = self._index()
+        
+        assert index.query(uploaded_after="2024-01-02", uploaded_before="2024-01-05") == ["d2", "d3", "d4"]
+        assert index.query(extension="pdf", uploaded_after="2024-01-02") == ["d3", "d4"]
+
+    def test_incremental_updates(self):
+        """Test status changes, collection membership and removal."""
+        index, docs = self._index()
+        
+        docs[2]["status"] = "processed"
+        index.update(docs[2])
+        assert index.query(status="processing") == []
+        
+        index.add_to_collection("c1", docs[4])
+        index.add_to_collection("c1", docs[0])
+        assert index.query(collection_id="c1") == ["d1", "d5"]
+        assert index.query(collection_id="c1", extension="md") == ["d5"]
+        
+        assert index.remove(docs[0]) == {"c1"}
+        assert index.query(collection_id="c1") == ["d5"]
+        assert index.query(filename="a.pdf") == ["d4"]
+        assert len(index) == 4
+
+    @pytest.mark.anyio
+    async def test_service_filters_and_prefilters(self):
+        """Test filtered listing and metadata pre-filters on retrieval."""
+        service = DocumentService()
+        notes = await service.ingest("notes.md", b"The launch date moved to March.")
+        memo = await service.ingest("memo.txt", b"The launch date is still in February.")
+        collection = service.create_collection("Launch")
+        service.add_to_collection(collection["id"], notes["id"])
+        
+        assert [d["id"] for d in service.list_documents(extension="md")] == [notes["id"]]
+        assert [d["id"] for d in service.list_documents(collection_id=collection["id"])] == [notes["id"]]
+        
+        hits = service.search("launch date", filters={"extension": "txt"})
+        assert {h["document_id"] for h in hits} == {memo["id"]}
+        assert service.search("launch date", collection_id=collection["id"], filters={"extension": "txt"}) == []
+        
+        service.delete_document(notes["id"])
+        assert service.list_collections()[0]["document_count"] == 0
+        assert service.list_documents(collection_id=collection["id"]) == []
+
+
+class TestVectorStore:
+    """Tests for VectorStore quantization modes."""
+
+    @pytest.mark.parametrize("mode", ["none", "int8", "pq"])
+    def test_finds_exact_match(self, mode, tmp_path):
+        """Test that a stored vector is its own nearest neighbour."""
+        data = _unit_vectors(300, 32)
+        store = VectorStore(
+            dim=32, quantization=mode, pq_subvectors=8, pq_centroids=16, storage_dir=str(tmp_path)
+        )
+        store.add(data, [{"document_id": f"doc-{i % 3}"} for i in range(300)])
+        
+        hits = store.search(data[42], k=3)
+        assert hits[0]["row"] == 42
+        assert hits[0]["score"] == pytest.approx(1.0, abs=1e-5)
+
+    def test_quantized_memory_is_smaller(self, tmp_path):
+        """Test bytes per vector for each mode."""
+        stats = {}
+        for mode in ("none", "int8", "pq"):
+            store = VectorStore(dim=64, quantization=mode, pq_subvectors=8, storage_dir=str(tmp_path))
+            store.add(_unit_vectors(300, 64), [{"document_id": "d"}] * 300)
+            stats[mode] = store.memory_stats()["bytes_per_vector"]
+        
+        assert stats == {"none": 256, "int8": 68, "pq": 8}
+
+    def test_rescoring_recall(self, tmp_path):
+        """Test int8 and PQ recall@10 after exact re-scoring."""
+        data = _unit_vectors(1000, 64)
+        queries = _unit_vectors(20, 64, seed=1)
+        truth = np.argsort(-(queries @ data.T), axis=1)[:, :10]
+        
+        for mode, expected in (("int8", 0.95), ("pq", 0.5)):
+            store = VectorStore(
+                dim=64, quantization=mode, pq_subvectors=16, rescore_factor=8, storage_dir=str(tmp_path)
+            )
+            store.add(data, [{"document_id": "d"}] * len(data))
+            recall = np.mean([
+                len({h["row"] for h in store.search(q, k=10)} & set(t)) / 10
+                for q, t in zip(queries, truth)
+            ])
+            assert recall >= expected
+
+    def test_document_filter(self):
+        """Test restricting search to a set of documents."""
+        data = _unit_vectors(10, 16)
+        store = VectorStore(dim=16)
+        store.add(data, [{"document_id": "a" if i < 5 else "b"} for i in range(10)])
+        
+        hits = store.search(data[0], k=10, document_ids={"b"})
+        assert len(hits) == 5
+        assert all(h["document_id"] == "b" for h in hits)
+        assert store.search(data[0], document_ids={"missing"}) == []
+
+    @pytest.mark.parametrize("mode", ["none", "int8", "pq"])
+    def test_delete_and_compact(self, mode, tmp_path):
+        """Test that tombstoned rows are hidden, then reclaimed by compaction."""
+        data = _unit_vectors(300, 32)
+        store = VectorStore(
+            dim=32, quantization=mode, pq_subvectors=8, pq_centroids=16, storage_dir=str(tmp_path)
+        )
+        store.add(data, [{"document_id": f"doc-{i % 3}", "i": i} for i in range(300)])
+        
+        assert store.delete_document("doc-0") == 100
+        assert store.delete_document("doc-0") == 0
+        assert store.garbage_ratio == pytest.approx(1 / 3)
+        assert all(h["document_id"] != "doc-0" for h in store.search(data[0], k=20))
+        
+        assert store.compact() == 100
+        assert store.garbage_ratio == 0
+        assert len(store) == 200
+        hits = store.search(data[1], k=1)
+        assert hits[0]["i"] == 1
+        assert hits[0]["score"] == pytest.approx(1.0, abs=1e-5)
+
+    def test_compaction_keeps_concurrent_writes(self, tmp_path):
+        """Test rows added and deleted while a compaction is being built."""
+        data = _unit_vectors(30, 16)
+        store = VectorStore(dim=16, quantization="int8", storage_dir=str(tmp_path))
+        store.add(data[:20], [{"document_id": f"doc-{i % 2}", "i": i} for i in range(20)])
+        store.delete_document("doc-0")
+        
+        plan = store._build_compaction()
+        store.add(data[20:], [{"document_id": "doc-new", "i": i} for i in range(20, 30)])
+        store.delete_document("doc-1")
+        store._apply_compaction(plan)
+        
+        assert len(store) == 10
+        assert store.garbage_ratio == pytest.approx(10 / 20)
+        assert store.search(data[25], k=1)[0]["i"] == 25
+
+    def test_unknown_quantization(self):
+        """Test that unknown modes are rejected."""
+        with pytest.raises(ValueError):
+            VectorStore(quantization="fp4")
+
+
+class CountingEmbedder(HashingEmbedder):
+    """Hashing embedder that counts how many texts it embedded."""
+
+    def __init__(self, dim: int = 64):
+        super().__init__(dim)
+        self.calls = 0
+
+    def embed(self, texts):
+        self.calls += len(texts)
+        return super().embed(texts)
+
+
+class TestEmbeddingCache:
+    """Tests for EmbeddingCache and CachedEmbedder."""
+
+    def test_round_trip_and_reload(self, tmp_path):
+        """Test that vectors survive reopening the cache file."""
+        path = str(tmp_path / "embeddings.cache")
+        keys = [cache_key(t, "test", 4) for t in ("a", "b")]
+        vectors = np.arange(8, dtype=np.float32).reshape(2, 4)
+        
+        cache = EmbeddingCache(path)
+        cache.put_many(keys, vectors)
+        cache.close()
+        
+        reopened = EmbeddingCache(path, hot_capacity=1)
+        found = reopened.get_many(keys + [cache_key("c", "test", 4)])
+        assert len(reopened) == 2
+        np.testing.assert_array_equal(found[keys[1]], vectors[1])
+        assert reopened.hits == 2 and reopened.misses == 1
+
+    def test_torn_record_is_dropped(self, tmp_path):
+        """Test recovery from a partially written trailing record."""
+        path = str(tmp_path / "embeddings.cache")
+        cache = EmbeddingCache(path)
+        cache.put_many([cache_key("a", "test", 4)], np.ones((1, 4)))
+        cache.close()
+        with open(path, "ab") as f:
+            f.write(b"\x00" * 10)
+        
+        assert len(EmbeddingCache(path)) == 1
+
+    def test_key_depends_on_embedder(self):
+        """Test that the same text under another embedder is a different key."""
+        assert cache_key("text", "model-a", 64) != cache_key("text", "model-b", 64)
+        assert cache_key("text", "model-a", 64) != cache_key("text", "model-a", 128)
+
+    def test_cached_embedder_only_embeds_misses(self, tmp_path):
+        """Test that only uncached texts reach the wrapped embedder."""
+        inner = CountingEmbedder()
+        embedder = CachedEmbedder(inner, EmbeddingCache(str(tmp_path / "c")))
+        
+        first = embedder.embed(["alpha", "beta"])
+        second = embedder.embed(["beta", "gamma", "alpha"])
+        
+        assert inner.calls == 3
+        np.testing.assert_array_equal(second[0], first[1])
+        np.testing.assert_array_equal(second[2], first[0])
+
+    @pytest.mark.anyio
+    async def test_reingest_costs_no_embedding_calls(self, tmp_path):
+        """Test that rebuilding from unchanged text never calls the embedder."""
+        path = str(tmp_path / "embeddings.cache")
+        text = b"Section one covers setup. " * 200
+        
+        first_embedder = CountingEmbedder()
+        first = DocumentService(embedder=first_embedder, embedding_cache=EmbeddingCache(path))
+        await first.ingest("manual.txt", text)
+        assert first_embedder.calls > 0
+        
+        # A fresh process (new service, reopened cache file) rebuilding the same corpus
+        rebuild_embedder = CountingEmbedder()
+        rebuild = DocumentService(embedder=rebuild_embedder, embedding_cache=EmbeddingCache(path))
+        await rebuild.ingest("manual.txt", text)
+        assert rebuild_embedder.calls == 0
+        assert rebuild.search("setup", k=1)
+
+
+class StubLLMServer:
+    """
+    Local stand-in for the LLM upstream with scripted per-request latency.
+    
+    Requests take `latencies[i]` seconds (the last value repeats) and
+    record whether they completed or were cancelled.
+    """
+
+    def __init__(self, *latencies: float, fail: bool = False):
+        self.latencies = list(latencies)
+        self.fail = fail
+        self.started = 0
+        self.completed = 0
+        self.cancelled = 0
+
+    async def __call__(self, question: str, context: str) -> str:
+        latency = self.latencies[min(self.started, len(self.latencies) - 1)]
+        self.started += 1
+        try:
+            await asyncio.sleep(latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            raise RuntimeError("upstream error")
+        self.completed += 1
+        return f"answer after {latency}s"
+
+
+class TestSnippets:
+    """Tests for precomputed sentence offsets and citation snippets."""
+
+    TEXT = (
+        "Chapter two covers onboarding. New hires get a laptop on day one. "
+        "The security training must be finished within a week. "
+        "Payroll runs on the last Friday of each month. Questions go to HR."
+    )
+
+    def test_sentence_index(self):
+        """Test offsets and term postings computed at ingest."""
+        index = sentence_index(self.TEXT)
+        
+        first, second = index["sentences"][:2]
+        assert self.TEXT[first[0]:first[1]] == "Chapter two covers onboarding."
+        assert self.TEXT[second[0]:second[1]] == "New hires get a laptop on day one."
+        assert index["sentence_terms"]["payroll"] == [3]
+        assert "the" not in index["sentence_terms"]
+
+    def test_best_window_with_highlights(self):
+        """Test that the snippet is the best sentence window, with the terms highlighted."""
+        chunk = {"text": self.TEXT, **sentence_index(self.TEXT)}
+        snippet = SnippetGenerator(window=2).snippet(chunk, query_terms("When does payroll run each month?"))
+        
+        assert snippet["excerpt"].startswith("Payroll runs")
+        assert self.TEXT[snippet["start"]:snippet["end"]] == snippet["excerpt"]
+        highlighted = {snippet["excerpt"][s:e].lower() for s, e in snippet["highlights"]}
+        assert highlighted == {"payroll", "each", "month"}
+
+    def test_chunks_without_offsets(self):
+        """Test chunks indexed before offsets existed, and chunks with no match."""
+        generator = SnippetGenerator(window=1)
+        
+        snippet = generator.snippet({"text": self.TEXT}, query_terms("laptop"))
+        assert snippet["excerpt"] == "New hires get a laptop on day one."
+        
+        snippet = generator.snippet({"text": self.TEXT}, query_terms("unrelated"))
+        assert snippet["excerpt"] == "Chapter two covers onboarding."
+        assert snippet["highlights"] == []
+
+    @pytest.mark.anyio
+    async def test_sources_carry_snippets(self):
+        """Test that ingested chunks store offsets and LLM answers cite snippets."""
+        service = DocumentService()
+        await service.ingest("handbook.txt", self.TEXT.encode())
+        assert service.search("payroll")[0]["sentences"]
+        
+        rag = RAGService(document_service=service, llm=StubLLMServer(0.0))
+        result = await rag.answer_question("When does payroll run?", mode="llm")
+        
+        source = result["sources"][0]
+        assert "Payroll runs" in source["excerpt"]
+        assert source["highlights"]
+
+
+class TestReindex:
+    """Tests for the blob store and rebuilding from stored originals."""
+
+    def test_blob_store(self, tmp_path):
+        """Test content addressing, dedup of identical content and deletes."""
+        store = BlobStore(str(tmp_path))
+        digest = store.put(b"original bytes")
+        
+        assert store.put(b"original bytes") == digest
+        assert store.get(digest) == b"original bytes"
+        assert store.delete(digest)
+        assert digest not in store
+        with pytest.raises(KeyError):
+            store.get(digest)
+
+    def test_temporary_blob_store_is_removed(self):
+        """Test that a store without a root cleans up its directory."""
+        store = BlobStore()
+        store.put(b"scratch bytes")
+        assert os.path.isdir(store.root)
+        
+        store.close()
+        assert not os.path.exists(store.root)
+
+    @pytest.mark.anyio
+    async def test_originals_follow_documents(self, tmp_path):
+        """Test that a shared original is removed with its last document."""
+        service = DocumentService(blob_store=BlobStore(str(tmp_path)))
+        a = await service.ingest("a.txt", b"Same bytes uploaded twice.")
+        b = await service.ingest("b.txt", b"Same bytes uploaded twice.")
+        blob = service.get_document(a["id"])["blob"]
+        
+        service.delete_document(a["id"])
+        assert blob in service.blob_store
+        service.delete_document(b["id"])
+        assert blob not in service.blob_store
+
+    @pytest.mark.anyio
+    async def test_reindex_with_new_chunking(self, tmp_path):
+        """Test a rebuild with a smaller chunk size, swapped in whole."""
+        service = DocumentService(extraction_workers=2)
+        text = " ".join(f"Sentence {i} about the quarterly budget review." for i in range(60))
+        doc = await service.ingest("report.txt", text.encode())
+        other = await service.ingest("pdf.pdf", _make_pdf(["Page one text.", "Page two text."]))
+        before = service.get_document(doc["id"])["chunk_count"]
+        old_store = service.vector_store
+        
+        result = await service.reindex(chunk_size=300, chunk_overlap=0, checkpoint_path=str(tmp_path / "ckpt"))
+        
+        assert service.vector_store is not old_store
+        assert service.chunk_size == 300
+        assert service.get_document(doc["id"])["chunk_count"] > before
+        assert service.get_document(other["id"])["pages_indexed"] == 2
+        assert result["documents"] == 2
+        assert result["chunks"] == len(service.vector_store)
+        assert service.search("quarterly budget", document_id=doc["id"])
+        assert not (tmp_path / "ckpt").exists()
+
+    @pytest.mark.anyio
+    async def test_interrupted_reindex_resumes(self, tmp_path, monkeypatch):
+        """Test that a failed rebuild leaves the live index alone and resumes from its checkpoint."""
+        service = DocumentService()
+        ids = [(await service.ingest(f"{i}.txt", f"Document number {i}.".encode()))["id"] for i in range(3)]
+        checkpoint = str(tmp_path / "ckpt")
+        old_store = service.vector_store
+        
+        index_pages = DocumentService._index_pages
+        calls = []
+        def flaky(self, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError("worker lost")
+            return index_pages(self, *args, **kwargs)
+        monkeypatch.setattr(DocumentService, "_index_pages", flaky)
+        
+        with pytest.raises(RuntimeError):
+            await service.reindex(chunk_size=500, chunk_overlap=0, checkpoint_path=checkpoint)
+        assert service.vector_store is old_store
+        assert service.chunk_size == 1000
+        assert (tmp_path / "ckpt").exists()
+        
+        monkeypatch.setattr(DocumentService, "_index_pages", index_pages)
+        result = await service.reindex(chunk_size=500, chunk_overlap=0, checkpoint_path=checkpoint)
+        assert result["resumed"] >= 1
+        assert len(service.vector_store) == 3
+        assert all(service.search("document number", document_id=i) for i in ids)
+
+    @pytest.mark.anyio
+    async def test_delete_during_reindex_keeps_shared_original(self, tmp_path):
+        """Test that a document deleted mid-rebuild doesn't take a shared original with it."""
+        service = DocumentService(blob_store=BlobStore(str(tmp_path)))
+        a = await service.ingest("a.txt", b"Same bytes uploaded twice.")
+        b = await service.ingest("b.txt", b"Same bytes uploaded twice.")
+        blob = service.get_document(a["id"])["blob"]
+        
+        service.start_reindex(chunk_size=400, chunk_overlap=0, pause=0.05)
+        while service.reindex_status.get("done", 0) < 2:
+            await asyncio.sleep(0.01)
+        service.delete_document(b["id"])
+        await service._reindex
+        
+        assert service.reindex_status["state"] == "completed"
+        assert blob in service.blob_store
+        assert service.search("same bytes", document_id=a["id"])
+        assert not service.search("same bytes", document_id=b["id"])
+        service.delete_document(a["id"])
+        assert blob not in service.blob_store
+
+    @pytest.mark.anyio
+    async def test_restart_restores_from_manifest(self, tmp_path):
+        """Test that a new process finds the documents behind the stored originals and rebuilds them."""
+        service = DocumentService(blob_store=BlobStore(str(tmp_path)))
+        kept = await service.ingest("kept.txt", b"The lighthouse keeper logs every passing ship.")
+        gone = await service.ingest("gone.txt", b"This one is deleted before the restart.")
+        service.delete_document(gone["id"])
+        
+        restarted = DocumentService(blob_store=BlobStore(str(tmp_path)))
+        assert restarted.restore() == 1
+        assert restarted.get_document(kept["id"])["status"] == "processing"
+        assert restarted.get_document(gone["id"]) is None
+        
+        await restarted.reindex(checkpoint_path=str(tmp_path / "ckpt"))
+        assert restarted.get_document(kept["id"])["status"] == "processed"
+        assert restarted.search("lighthouse keeper", document_id=kept["id"])
+        restarted.delete_document(kept["id"])
+        assert DocumentService(blob_store=BlobStore(str(tmp_path))).restore() == 0
+
+    @pytest.mark.anyio
+    async def test_checkpoint_is_streamed(self, tmp_path):
+        """Test that resuming reads checkpointed text per document and cuts a torn last record."""
+        service = DocumentService()
+        for i in range(3):
+            await service.ingest(f"{i}.txt", f"Checkpointed document {i}.".encode())
+        checkpoint = tmp_path / "ckpt"
+        for i, blob in enumerate(d["blob"] for d in service.list_documents()):
+            _append_checkpoint(str(checkpoint), blob, [f"Checkpointed document {i}."], 1)
+        with open(checkpoint, "ab") as f:
+            f.write(b'{"blob": "torn')
+        
+        assert len(_scan_checkpoint(str(checkpoint))) == 3
+        assert checkpoint.read_bytes().endswith(b"\n")
+        
+        result = await service.reindex(checkpoint_path=str(checkpoint))
+        assert result["resumed"] == 3
+        assert not checkpoint.exists()
+
+    @pytest.mark.anyio
+    async def test_only_one_reindex_at_a_time(self):
+        """Test the background job and its status."""
+        service = DocumentService()
+        await service.ingest("a.txt", b"Some text to rebuild.")
+        
+        status = service.start_reindex(chunk_size=400, chunk_overlap=0)
+        assert status["state"] == "running"
+        with pytest.raises(RuntimeError):
+            service.start_reindex()
+        
+        await service._reindex
+        assert service.reindex_status["state"] == "completed"
+        assert service.reindex_status["done"] == 1
+
+
+class TestTailLatency:
+    """Tests for hedged and deadline-bounded LLM calls."""
+
+    @staticmethod
+    async def _documents() -> DocumentService:
+        documents = DocumentService()
+        await documents.ingest("a.txt", b"The warranty covers parts for two years.")
+        return documents
+
+    @pytest.mark.anyio
+    async def test_hedge_beats_slow_request(self):
+        """Test that a hedged request answers and the slow one is cancelled."""
+        upstream = StubLLMServer(5.0, 0.01)
+        service = RAGService(await self._documents(), llm=upstream, hedge_after=0.05)
+        
+        started = time.perf_counter()
+        result = await service.answer_question("How long is the warranty?")
+        
+        assert time.perf_counter() - started < 1.0
+        assert result["mode"] == "llm"
+        assert result["answer"] == "answer after 0.01s"
+        assert upstream.started == 2
+        assert upstream.cancelled == 1
+
+    @pytest.mark.anyio
+    async def test_fast_request_is_not_hedged(self):
+        """Test that requests faster than the hedge delay are sent once."""
+        upstream = StubLLMServer(0.01)
+        service = RAGService(await self._documents(), llm=upstream, hedge_after=0.5)
+        
+        await service.answer_question("How long is the warranty?")
+        
+        assert upstream.started == 1
+
+    @pytest.mark.anyio
+    async def test_hedge_delay_tracks_percentile(self):
+        """Test that the hedge delay follows the observed latency percentile."""
+        service = RAGService(llm=StubLLMServer(0.0), hedge_after=2.0, hedge_percentile=90)
+        assert service.hedge_delay() == 2.0
+        
+        service._latencies.extend([0.1] * 90 + [1.0] * 10)
+        assert service.hedge_delay() == pytest.approx(0.19, abs=0.01)
+
+    @pytest.mark.anyio
+    async def test_deadline_falls_back_to_extractive(self):
+        """Test that a slow upstream is abandoned at the deadline."""
+        upstream = StubLLMServer(5.0)
+        service = RAGService(
+            await self._documents(), llm=upstream, hedge_after=0.05, min_llm_budget=0.01
+        )
+        
+        started = time.perf_counter()
+        result = await service.answer_question("How long is the warranty?", timeout=0.2)
+        
+        assert time.perf_counter() - started < 1.0
+        assert result["mode"] == "extractive"
+        assert "two years" in result["answer"]
+        assert upstream.cancelled == upstream.started == 2
+
+    @pytest.mark.anyio
+    async def test_exhausted_budget_skips_llm(self):
+        """Test that a nearly spent budget goes straight to the extractive path."""
+        upstream = StubLLMServer(0.01)
+        service = RAGService(await self._documents(), llm=upstream, min_llm_budget=0.5)
+        
+        result = await service.answer_question("How long is the warranty?", timeout=0.1)
+        
+        assert result["mode"] == "extractive"
+        assert upstream.started == 0
+
+    @pytest.mark.anyio
+    async def test_failed_request_is_retried_once(self):
+        """Test that a fast failure uses the hedge as a retry, then falls back."""
+        upstream = StubLLMServer(0.0, fail=True)
+        service = RAGService(await self._documents(), llm=upstream, hedge_after=1.0)
+        
+        result = await service.answer_question("How long is the warranty?")
+        
+        assert upstream.started == 2
+        assert result["mode"] == "extractive"
+
+
+FOOTER = (
+    "This document is confidential and intended solely for the use of the "
+    "individual to whom it is addressed. Any unauthorized review, use, "
+    "disclosure or distribution is prohibited. Copyright {year} Example Corp."
+)
+
+
+class TestNearDuplicates:
+    """Tests for MinHash/LSH near-duplicate detection."""
+
+    def test_signature_similarity(self):
+        """Test that signature agreement tracks text similarity."""
+        index = NearDuplicateIndex()
+        a = index.signature(FOOTER.format(year=2023))
+        b = index.signature(FOOTER.format(year=2024))
+        c = index.signature("An entirely different paragraph about rivers and mountains.")
+        
+        assert np.mean(a == b) > 0.8
+        assert np.mean(a == c) < 0.2
+
+    def test_find_near_duplicate(self):
+        """Test LSH lookup of a registered representative."""
+        index = NearDuplicateIndex(threshold=0.8)
+        rep = {"document_id": "a", "text": FOOTER.format(year=2023)}
+        index.add_representative(index.signature(rep["text"]), rep)
+        
+        assert index.find(index.signature(FOOTER.format(year=2024))) is rep
+        assert index.find(index.signature("Unrelated text about gardening tools.")) is None
+
+    @pytest.mark.anyio
+    async def test_duplicates_share_one_row(self):
+        """Test that boilerplate across documents is indexed once but still cited."""
+        service = DocumentService(dedup_threshold=0.8)
+        a = await service.ingest("a.txt", FOOTER.format(year=2023).encode())
+        b = await service.ingest("b.txt", FOOTER.format(year=2024).encode())
+        
+        assert len(service.vector_store) == 1
+        assert service.get_document(b["id"])["duplicate_chunks"] == 1
+        
+        hits = service.search("confidential distribution", document_id=b["id"])
+        assert len(hits) == 1
+        assert hits[0]["document_id"] == b["id"]
+        assert "2024" in hits[0]["text"]
+
+    @pytest.mark.anyio
+    async def test_delete_promotes_duplicate(self):
+        """Test that deleting the representative's document keeps duplicates searchable."""
+        service = DocumentService(dedup_threshold=0.8)
+        a = await service.ingest("a.txt", FOOTER.format(year=2023).encode())
+        b = await service.ingest("b.txt", FOOTER.format(year=2024).encode())
+        
+        service.delete_document(a["id"])
+        
+        assert len(service.vector_store) == 1
+        assert service.get_document(b["id"])["duplicate_chunks"] == 0
+        hits = service.search("confidential distribution")
+        assert [h["document_id"] for h in hits] == [b["id"]]
+
+    @pytest.mark.anyio
+    async def test_dedup_disabled(self):
+        """Test that every chunk gets a row when dedup is off."""
+        service = DocumentService(dedup_threshold=None)
+        await service.ingest("a.txt", FOOTER.format(year=2023).encode())
+        await service.ingest("b.txt", FOOTER.format(year=2024).encode())
+        
+        assert len(service.vector_store) == 2
+
+
+class TestRoutingIndex:
+    """Tests for document-level routing of collection queries."""
+
+    TOPICS = {
+        "rivers": "Rivers carry sediment downstream and floods reshape the river delta.",
+        "volcanoes": "Volcanoes erupt magma and lava when pressure builds in the crust.",
+        "glaciers": "Glaciers grind valleys as ice sheets advance and retreat.",
+        "deserts": "Deserts receive little rainfall and dunes migrate with the wind.",
+    }
+
+    def _index(self) -> tuple[RoutingIndex, HashingEmbedder]:
+        embedder = HashingEmbedder()
+        index = RoutingIndex(embedder.dim)
+        for doc_id, text in self.TOPICS.items():
+            index.update(doc_id, embedder.embed([text]), text)
+        return index, embedder
+
+    def test_routes_to_matching_document(self):
+        """Test that the document about the query's subject ranks first."""
+        index, embedder = self._index()
+        query = "Where does lava come from?"
+        
+        routed = index.route(embedder.embed_query(query), query, set(self.TOPICS), 2)
+        assert len(routed) == 2
+        assert routed[0] == "volcanoes"
+        assert "magma" in index.keywords("volcanoes")
+
+    def test_remove_reuses_slot(self):
+        """Test that removed documents are no longer routed to."""
+        index, embedder = self._index()
+        index.remove("rivers")
+        index.update("oceans", embedder.embed(["Tides and currents move ocean water."]), "tides currents ocean")
+        
+        assert len(index) == 4
+        query = "river delta floods"
+        routed = index.route(embedder.embed_query(query), query, set(self.TOPICS) | {"oceans"}, 3)
+        assert "rivers" not in routed
+
+    @pytest.mark.anyio
+    async def test_reingest_after_deleting_repeated_terms(self):
+        """Test that deleting a document that repeats a term leaves the term's frequency sane."""
+        service = DocumentService()
+        doc = await service.ingest("widgets.txt", b"widget widget widget widget widget catalogue")
+        service.delete_document(doc["id"])
+        assert service._routing._document_frequency["widget"] == 0
+        
+        for name in ("a.txt", "b.txt"):
+            doc = await service.ingest(name, b"The widget assembly manual for the widget line.")
+            assert doc["status"] == "processed"
+        assert service._routing._document_frequency["widget"] == 2
+
+    @pytest.mark.anyio
+    async def test_collection_search_only_scores_routed_documents(self):
+        """Test two-stage retrieval over a collection larger than route_top_n."""
+        service = DocumentService(route_top_n=2)
+        collection = service.create_collection("Geography")
+        ids = {}
+        for topic, text in self.TOPICS.items():
+            doc = await service.ingest(f"{topic}.txt", text.encode(), collection["id"])
+            ids[topic] = doc["id"]
+        
+        hits = service.search("magma and lava eruptions", collection_id=collection["id"], k=4)
+        assert hits[0]["document_id"] == ids["volcanoes"]
+        assert len({h["document_id"] for h in hits}) <= 2
+        
+        service.delete_document(ids["volcanoes"])
+        hits = service.search("magma and lava eruptions", collection_id=collection["id"], k=4)
+        assert ids["volcanoes"] not in {h["document_id"] for h in hits}
+
+
+class TestSessions:
+    """Tests for multi-turn conversation sessions."""
+
+    LEASE = (
+        "The monthly rent is 1200 dollars and is due on the first day of each month. "
+        "Late payments incur a fee of fifty dollars."
+    )
+    UTILITIES = "Section 4 says the tenant pays for water, gas and electricity."
+
+    def test_rewrite_follow_up(self):
+        """Test that follow-ups carry over the previous question's subject."""
+        previous = "What are the payment terms of the lease?"
+        
+        rewritten = rewrite_follow_up("and what about section 4?", previous)
+        assert rewritten.startswith("and what about section 4?")
+        assert "payment" in rewritten and "lease" in rewritten
+        
+        standalone = "Who maintains the garden at the property?"
+        assert rewrite_follow_up(standalone, previous) == standalone
+        assert rewrite_follow_up("and then?", None) == "and then?"
+
+    def test_store_expires_idle_sessions(self):
+        """Test TTL expiry and the bound on live sessions."""
+        now = [0.0]
+        store = SessionStore(max_sessions=2, ttl=10.0, clock=lambda: now[0])
+        a = store.create()
+        b = store.create()
+        
+        now[0] = 8.0
+        assert store.get(a.id) is a
+        c = store.create()  # full: evicts b, the least recently used
+        assert store.get(b.id) is None
+        
+        now[0] = 12.0
+        assert store.get(c.id) is c
+        now[0] = 19.0  # a idle for 11s, c only for 7s
+        assert store.get(a.id) is None
+        assert store.get(c.id) is c
+        assert len(store) == 1
+
+    @pytest.mark.anyio
+    async def test_follow_ups_reuse_retrieval(self):
+        """Test that only questions about new material go back to the index."""
+        service = DocumentService()
+        await service.ingest("lease.txt", self.LEASE.encode())
+        await service.ingest("utilities.txt", self.UTILITIES.encode())
+        rag = RAGService(document_service=service)
+        rag.retrieve = MagicMock(wraps=rag.retrieve)
+        session = SessionStore().create()
+        
+        first = await rag.answer_in_session(session, "How much is the monthly rent?", k=1)
+        assert first["retrieval"] == "full"
+        assert "1200" in first["answer"]
+        
+        second = await rag.answer_in_session(session, "and when is it due?", k=1)
+        assert second["retrieval"] == "cached"
+        assert "rent" in second["rewritten_question"]
+        assert rag.retrieve.call_count == 1
+        assert session.turns[-1]["context_reused"]
+        
+        third = await rag.answer_in_session(session, "Who pays for electricity?", k=1)
+        assert third["retrieval"] == "incremental"
+        assert "electricity" in third["answer"]
+        assert rag.retrieve.call_count == 2
+
+    @pytest.mark.anyio
+    async def test_deleted_documents_are_forgotten(self):
+        """Test that cached chunks of deleted documents are not cited."""
+        service = DocumentService()
+        doc = await service.ingest("lease.txt", self.LEASE.encode())
+        rag = RAGService(document_service=service)
+        session = SessionStore().create()
+        
+        await rag.answer_in_session(session, "How much is the monthly rent?")
+        service.delete_document(doc["id"])
+        result = await rag.answer_in_session(session, "and the late fee?")
+        
+        assert result["sources"] == []
+        assert len(session) == 0
+
+
+class TestRateLimiting:
+    """Tests for rate limiting and fair queueing."""
+
+    def test_bucket_refills_over_time(self):
+        """Test burst, rejection with a retry delay, and refill."""
+        now = [0.0]
+        limiter = RateLimiter(parse_limits("ask=2/3"), clock=lambda: now[0])
+        
+        assert [limiter.check("ip:a", "ask") for _ in range(3)] == [0, 0, 0]
+        assert limiter.check("ip:a", "ask") == pytest.approx(0.5)
+        assert limiter.check("ip:b", "ask") == 0  # budgets are per client
+        
+        now[0] = 0.5
+        assert limiter.check("ip:a", "ask") == 0
+        assert limiter.check("ip:a", "ask") > 0
+
+    def test_parse_limits(self):
+        """Test overriding some budgets and rejecting malformed specs."""
+        limits = parse_limits("upload=0.5/5")
+        assert limits["upload"] == (0.5, 5)
+        assert limits["ask"] == (2.0, 20)
+        with pytest.raises(ValueError):
+            parse_limits("upload=5")
+
+    def test_idle_clients_are_evicted(self):
+        """Test that local buckets keep only the most recently seen clients."""
+        limiter = RateLimiter(buckets=LocalBuckets(max_clients=2))
+        for client in ("ip:a", "ip:b", "ip:a", "ip:c"):
+            limiter.check(client, "default")
+        
+        assert len(limiter.buckets) == 2
+        assert list(limiter.buckets._buckets) == ["default:ip:a", "default:ip:c"]
+
+    def test_shared_buckets_span_limiters(self, tmp_path):
+        """Test that limiters on one state file share a client's budget."""
+        path = str(tmp_path / "limits.db")
+        limits = parse_limits("upload=1/2")
+        first = RateLimiter(limits, buckets=SharedBuckets(path), clock=lambda: 100.0)
+        second = RateLimiter(limits, buckets=SharedBuckets(path), clock=lambda: 100.0)
+        
+        assert first.check("key:k", "upload") == 0
+        assert second.check("key:k", "upload") == 0
+        assert first.check("key:k", "upload") > 0
+        assert second.check("key:other", "upload") == 0
+
+    @pytest.mark.anyio
+    async def test_shared_buckets_are_taken_off_the_loop(self, tmp_path):
+        """Test that admitting against the SQLite file runs on a worker thread."""
+        buckets = SharedBuckets(str(tmp_path / "limits.db"))
+        take = buckets.take
+        threads = []
+        
+        def recording_take(*args):
+            threads.append(threading.get_ident())
+            return take(*args)
+        
+        buckets.take = recording_take
+        limiter = RateLimiter(parse_limits("upload=1/1"), buckets=buckets)
+        
+        assert await limiter.admit("ip:a", "upload") == 0
+        assert await limiter.admit("ip:a", "upload") > 0
+        assert threads and threading.get_ident() not in threads
+
+    def test_shared_buckets_prune_idle_clients(self, tmp_path):
+        """Test the bound on clients kept in the state file."""
+        buckets = SharedBuckets(str(tmp_path / "limits.db"), max_clients=2, prune_every=4)
+        limiter = RateLimiter(buckets=buckets, clock=time.monotonic)
+        for client in ("a", "b", "c", "d"):
+            limiter.check(client, "default")
+        assert len(buckets) == 2
+
+    def test_classification(self):
+        """Test which client and budget a request is charged to."""
+        user = MagicMock(is_authenticated=True, display_name="alice")
+        assert client_key({"user": user, "client": ("1.2.3.4", 1)}) == "user:alice"
+        assert client_key({"headers": [(b"x-api-key", b"secret")], "client": ("1.2.3.4", 1)}) == "ip:1.2.3.4"
+        anonymous = MagicMock(is_authenticated=False)
+        assert client_key({"user": anonymous, "client": ("1.2.3.4", 1)}) == "ip:1.2.3.4"
+        
+        assert budget_for("POST", "/api/documents/upload") == "upload"
+        assert budget_for("POST", "/api/documents/bulk") == "upload"
+        assert budget_for("POST", "/api/ask") == "ask"
+        assert budget_for("POST", "/api/sessions/abc/ask") == "ask"
+        assert budget_for("GET", "/api/documents") == "default"
+
+    @pytest.mark.anyio
+    async def test_fair_queue_interleaves_clients(self):
+        """Test that a backlogged client doesn't starve one arriving later."""
+        queue = FairQueue(concurrency=1)
+        order = []
+        
+        async def request(client: str):
+            async with queue.slot(client):
+                order.append(client)
+                await asyncio.sleep(0)
+        
+        await queue.acquire("warmup")
+        tasks = [asyncio.create_task(request("heavy")) for _ in range(4)]
+        await asyncio.sleep(0)
+        tasks += [asyncio.create_task(request("light")) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert queue.waiting == 6
+        
+        queue.release()
+        await asyncio.gather(*tasks)
+        assert order == ["heavy", "light", "heavy", "light", "heavy", "heavy"]
+        assert queue.active == 0
+
+    @pytest.mark.anyio
+    async def test_fair_queue_weights(self):
+        """Test that a heavier weight earns proportionally more turns."""
+        queue = FairQueue(concurrency=1, weights={"gold": 2.0})
+        order = []
+        
+        async def request(client: str):
+            async with queue.slot(client):
+                order.append(client)
+        
+        await queue.acquire("warmup")
+        tasks = [asyncio.create_task(request(c)) for c in ["basic"] * 3 + ["gold"] * 4]
+        await asyncio.sleep(0)
+        queue.release()
+        await asyncio.gather(*tasks)
+        assert order == ["gold", "basic", "gold", "gold", "basic", "gold", "basic"]
+
+    @pytest.mark.anyio
+    async def test_cancelled_waiter_passes_its_slot_on(self):
+        """Test that a waiter giving up doesn't leak a slot."""
+        queue = FairQueue(concurrency=1)
+        await queue.acquire("a")
+        gone = asyncio.create_task(queue.acquire("b"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        await asyncio.sleep(0)
+        
+        queue.release()
+        assert queue.active == 0
+        await asyncio.wait_for(queue.acquire("c"), timeout=1)
+        assert queue.active == 1
+
+
 class TestRAGService:
     """Tests for RAGService."""
 
     @pytest.mark.anyio
     async def test_answer_general_question(self):
         """Test answering a general question."""
-        service = RAGService()
+        documents = DocumentService()
+        await documents.ingest(
+            "ml.txt", b"Machine learning is a field of AI that learns patterns from data."
+        )
+        service = RAGService(document_service=documents)
         result = await service.answer_question("What is machine learning?")
         
         assert "answer" in result
         assert "sources" in result
         assert "confidence" in result
         assert result["confidence"] > 0
+        assert result["mode"] == "extractive"
+
+    @pytest.mark.anyio
+    async def test_answer_without_documents(self):
+        """Test that nothing retrieved yields an empty, zero-confidence answer."""
+        service = RAGService()
+        result = await service.answer_question("What is machine learning?")
+        
+        assert result["sources"] == []
+        assert result["confidence"] == 0
+
+    @pytest.mark.anyio
+    async def test_llm_failure_falls_back_to_extractive(self, monkeypatch):
+        """Test the automatic extractive fallback when the LLM call fails."""
+        monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+        # Make the LangChain import fail deterministically
+        monkeypatch.setitem(sys.modules, "langchain_openai", None)
+        documents = DocumentService()
+        await documents.ingest("a.txt", b"The warranty covers parts for two years.")
+        service = RAGService(document_service=documents)
+        
+        result = await service.answer_question("How long is the warranty?")
+        
+        assert result["mode"] == "extractive"
+        assert "two years" in result["answer"]
+
+    @pytest.mark.anyio
+    async def test_unknown_mode(self):
+        """Test that unknown answer modes are rejected."""
+        with pytest.raises(ValueError):
+            await RAGService().answer_question("What?", mode="magic")
 
     @pytest.mark.anyio
     async def test_answer_with_document_id(self):